@@ -0,0 +1,406 @@
+# benchmark_improver.py
+# Runs main_improvement_loop against MockOllamaClient, a stand-in for the Ollama server that answers every pipeline
+# step with deterministic synthetic text at a configurable speed, so the loop's own cost can be measured without a GPU.
+# Each case runs in a fresh process and work directory (the improver keeps process-wide state - logging, the Ollama
+# host pool, LLM cache, telemetry - that one case must not leave behind for the next) and the results are written as
+# JSON, which --compare checks against an earlier run.
+#
+#   python benchmark_improver.py                                   # quick suite -> benchmark_results.json
+#   python benchmark_improver.py --suite full --output full.json
+#   python benchmark_improver.py --only overhead,memory --iterations 50
+#   python benchmark_improver.py --compare benchmark_results.json  # exits 1 if a case got slower or grew more memory
+#
+# Suites: "overhead" (each Examples/ paper, instant LLM: all the time measured is the loop's own), "size" (one paper
+# scaled up), "concurrency" (ollama_num_parallel with a timed LLM), "synthesis" (best-of-N synthesis candidates and
+# their tournament), "backups" (a backup store pre-filled with versions) and "memory" (hundreds of iterations under
+# tracemalloc).
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource # Unix only; peak RSS is left out elsewhere
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(REPO_DIR, "Examples")
+MOCK_WORDS = ("agent", "loop", "critique", "evidence", "model", "prompt", "novel", "idea", "hypothesis", "analogy", "method",
+              "result", "failure", "signal", "memory", "search", "policy", "review", "draft", "section", "claim", "source",
+              "risk", "benefit", "trial", "patient", "market", "governance", "speech", "platform", "incentive", "metric",
+              "baseline", "variance", "feedback", "iteration", "synthesis", "framework", "constraint", "tradeoff", "dataset",
+              "experiment", "outcome", "scale", "cost", "latency", "adoption", "community", "safety", "alignment", "audit",
+              "regulator", "network", "cluster", "theory", "practice", "pilot", "survey", "protocol", "standard", "budget")
+CHARS_PER_TOKEN = 4
+
+# --- Mock LLM ---
+class MockOllamaClient:
+    # Implements the parts of ollama.Client the improver uses (generate, with and without stream or a JSON format, embed and list). Each
+    # answer is seeded from the prompt and the temperature, so a case gives the same answers whatever order the concurrent calls run
+    # in, and calls that differ only in temperature (the best-of-N synthesis candidates) get different answers.
+    # Timing: load_seconds once, then first_token_seconds + prompt tokens / prompt_tokens_per_second before the first
+    # chunk and output tokens / output_tokens_per_second spread over the chunks. A rate of 0 means instant.
+    def __init__(self, seed=0, load_seconds=0.0, first_token_seconds=0.0, prompt_tokens_per_second=0, output_tokens_per_second=0,
+                 accept_rate=0.7, brainstorm_rate=0.5, note_tokens=250, patch_tokens=200, chunk_tokens=8):
+        self.seed = seed
+        self.load_seconds, self.first_token_seconds = load_seconds, first_token_seconds
+        self.prompt_tokens_per_second, self.output_tokens_per_second = prompt_tokens_per_second, output_tokens_per_second
+        self.accept_rate, self.brainstorm_rate = accept_rate, brainstorm_rate
+        self.note_tokens, self.patch_tokens, self.chunk_tokens = note_tokens, patch_tokens, chunk_tokens
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "in_flight": 0, "max_in_flight": 0, "busy_seconds": 0.0, "busy_since": None}
+
+    def list(self):
+        return {"models": [{"model": "mock"}]}
+
+    # Text
+    def words(self, rng, count):
+        sentences, sentence = [], []
+        for _ in range(count):
+            sentence.append(rng.choice(MOCK_WORDS))
+            if len(sentence) >= rng.randint(8, 16):
+                sentences.append(" ".join(sentence).capitalize() + "."); sentence = []
+        if sentence: sentences.append(" ".join(sentence).capitalize() + ".")
+        return " ".join(sentences)
+
+    def paragraphs(self, rng, tokens):
+        return "\n\n".join(self.words(rng, max(20, tokens // 3)) for _ in range(3))
+
+    def answer(self, prompt, rng, response_format=None):
+        if isinstance(response_format, dict): # Structured steps: a JSON answer with the schema's fields
+            return json.dumps(self.structured_answer(response_format.get("properties", {}), rng))
+        if "Summarize this section" in prompt: # Section summaries for the condensed paper view
+            return self.words(rng, 60)
+        if "EXISTING SECTION HEADINGS:\n" in prompt: # 2 and synthesis in patch mode
+            headings = [line[2:] for line in prompt.split("EXISTING SECTION HEADINGS:\n", 1)[1].splitlines() if line.startswith("- ")]
+            target = rng.choice(headings) if headings else "Abstract:"
+            return f"@@@ INSERT AFTER: {target}\nBenchmark Addition {rng.randrange(10**9)}:\n{self.paragraphs(rng, self.patch_tokens)}\n@@@ END"
+        if "INSTRUCTIONS:" in prompt or "targeted section" in prompt: # 2 and synthesis in full mode
+            document = prompt.split("CURRENT DOCUMENT:\n'''\n", 1)[-1].split("\n'''\n", 1)[0]
+            return f"{document}\n\nBenchmark Addition {rng.randrange(10**9)}:\n{self.paragraphs(rng, self.patch_tokens)}"
+        return self.paragraphs(rng, self.note_tokens) # C, D, E, G
+
+    def structured_answer(self, properties, rng):
+        if "same_or_better" in properties: # evaluate
+            return {"same_or_better": rng.random() < self.accept_rate}
+        if "better_version" in properties: # Best-of-N tournament comparisons
+            return {"better_version": rng.choice(("A", "B"))}
+        if "approach" in properties: # A
+            return {"approach": "Brainstorm" if rng.random() < self.brainstorm_rate else "Direct Fix"}
+        if "con_number" in properties: # 1b
+            return {"con_number": rng.randint(1, max(1, properties["con_number"].get("maximum", 1)))}
+        if "combinations" in properties: # F1-F3
+            return {"combinations": [self.words(rng, self.note_tokens // 9) for _ in range(properties["combinations"].get("maxItems", 9))]}
+        return {"pros": [self.words(rng, 15) for _ in range(3)], "cons": [f"The paper lacks {self.words(rng, 12).lower()}" for _ in range(3)]} # 1a
+
+    # Timing
+    def begin_call(self, prompt_tokens, output_tokens):
+        with self.lock:
+            self.stats["calls"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["output_tokens"] += output_tokens
+            if self.stats["in_flight"] == 0: self.stats["busy_since"] = time.perf_counter()
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+            load_seconds = 0.0 if self.loaded else self.load_seconds
+            self.loaded = True
+        return load_seconds
+
+    def end_call(self):
+        with self.lock:
+            self.stats["in_flight"] -= 1
+            if self.stats["in_flight"] == 0: self.stats["busy_seconds"] += time.perf_counter() - self.stats["busy_since"]
+
+    def busy_seconds(self):
+        # Wall time during which at least one call was in flight.
+        with self.lock:
+            open_interval = time.perf_counter() - self.stats["busy_since"] if self.stats["in_flight"] else 0.0
+            return self.stats["busy_seconds"] + open_interval
+
+    def generate(self, model=None, prompt="", system=None, options=None, stream=False, **kwargs):
+        full_prompt = f"{system or ''}\n\n{prompt}"
+        rng = random.Random(f"{self.seed}:{(options or {}).get('temperature')}:{hashlib.sha256(full_prompt.encode('utf-8')).hexdigest()}")
+        text = self.answer(prompt, rng, kwargs.get("format"))
+        num_ctx = (options or {}).get("num_ctx", 2048)
+        prompt_tokens = min(num_ctx, len(full_prompt) // CHARS_PER_TOKEN) # The server truncates to num_ctx
+        output_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+        prompt_seconds = prompt_tokens / self.prompt_tokens_per_second if self.prompt_tokens_per_second else 0.0
+        output_seconds = output_tokens / self.output_tokens_per_second if self.output_tokens_per_second else 0.0
+        load_seconds = self.begin_call(prompt_tokens, output_tokens)
+        final_chunk = {"response": "", "done": True, "prompt_eval_count": prompt_tokens, "eval_count": output_tokens,
+                       "load_duration": int(load_seconds * 1e9), "prompt_eval_duration": int(prompt_seconds * 1e9),
+                       "eval_duration": int(output_seconds * 1e9),
+                       "total_duration": int((load_seconds + self.first_token_seconds + prompt_seconds + output_seconds) * 1e9)}
+        if not stream:
+            try:
+                time.sleep(load_seconds + self.first_token_seconds + prompt_seconds + output_seconds)
+            finally:
+                self.end_call()
+            return {**final_chunk, "response": text}
+        return self.stream_chunks(text, final_chunk, load_seconds + self.first_token_seconds + prompt_seconds, output_seconds)
+
+    def embed(self, model=None, input="", **kwargs):
+        # Bag-of-words vectors over MOCK_WORDS, so texts sharing most of their words come out as near-duplicates.
+        texts = [input] if isinstance(input, str) else input
+        return {"model": model, "embeddings": [[float(text.lower().count(word)) + 0.01 for word in MOCK_WORDS] for text in texts]}
+
+    def stream_chunks(self, text, final_chunk, before_first_chunk, output_seconds):
+        chunk_chars = self.chunk_tokens * CHARS_PER_TOKEN
+        chunk_count = max(1, -(-len(text) // chunk_chars))
+        try:
+            time.sleep(before_first_chunk)
+            for index in range(chunk_count):
+                if output_seconds: time.sleep(output_seconds / chunk_count)
+                yield {"response": text[index * chunk_chars:(index + 1) * chunk_chars], "done": False}
+            yield final_chunk
+        finally:
+            self.end_call() # Also runs when the improver closes the stream early
+
+# --- Benchmark Cases ---
+def example_names():
+    prefix = "project_document - "
+    return sorted(f_name[len(prefix):-len(".txt")] for f_name in os.listdir(EXAMPLES_DIR) if f_name.startswith(prefix) and f_name.endswith(".txt"))
+
+def load_example(name):
+    with open(os.path.join(EXAMPLES_DIR, f"project_document - {name}.txt"), "r", encoding="utf-8") as f_document:
+        document = f_document.read()
+    with open(os.path.join(EXAMPLES_DIR, f"simple_config - {name}.json"), "r", encoding="utf-8") as f_config:
+        title = json.load(f_config).get("document_title", name)
+    return document, title
+
+def scale_document(document, scale, seed):
+    # Appends scale-1 copies of the paper's sections under "Part N" headings, with each paragraph's words shuffled so the
+    # copies don't read as duplicated paragraphs to the candidate screening.
+    rng = random.Random(seed)
+    parts = [document.rstrip("\n")]
+    body = [paragraph for paragraph in document.split("\n\n") if paragraph.strip() and not paragraph.startswith("TITLE:")]
+    for part in range(2, scale + 1):
+        for paragraph in body:
+            lines = paragraph.splitlines()
+            heading = f"{lines[0].rstrip(':').strip()} Part {part}:" if lines[0].rstrip().endswith(":") and len(lines[0].split()) <= 4 else None
+            words = " ".join(lines[1:] if heading else lines).split()
+            rng.shuffle(words)
+            parts.append("\n".join(line for line in (heading, " ".join(words)) if line))
+    return "\n\n".join(parts) + "\n"
+
+def build_cases(suite, only, iterations):
+    full = suite == "full"
+    cases = []
+    def add(group, name, **settings):
+        if not only or group in only:
+            cases.append({"group": group, "name": f"{group}/{name}", "example": "Baby Alpha", "iterations": iterations or 5,
+                          "document_scale": 1, "ollama_num_parallel": 1, "preseed_versions": 0, "trace_memory": False, "seed": 1,
+                          "mock": {}, **settings})
+    for example in example_names():
+        add("overhead", example, example=example, iterations=iterations or (30 if full else 10))
+    for scale in ((1, 4, 16, 64) if full else (1, 4, 16)):
+        add("size", f"x{scale}", document_scale=scale)
+    timed_llm = {"first_token_seconds": 0.02, "prompt_tokens_per_second": 20000, "output_tokens_per_second": 2000, "brainstorm_rate": 1.0}
+    for parallel in ((1, 2, 3, 4, 8) if full else (1, 2, 4)):
+        add("concurrency", f"parallel={parallel}", ollama_num_parallel=parallel, iterations=iterations or 3, mock=timed_llm)
+    for candidates in ((2, 3, 4) if full else (3,)):
+        add("synthesis", f"candidates={candidates}", ollama_num_parallel=candidates, iterations=iterations or 3, mock=timed_llm,
+            config={"synthesis_candidates": candidates})
+    for versions in ((0, 1000, 5000) if full else (0, 500)):
+        add("backups", f"versions={versions}", preseed_versions=versions, mock={"accept_rate": 1.0})
+    add("memory", "iterations", iterations=iterations or (400 if full else 100), trace_memory=True)
+    return cases
+
+def seed_backup_store(improver, run, document, versions, seed):
+    # Adds `versions` versions to the backup store, each the paper plus a different closing section (so the paper keeps
+    # its size), and leaves the last one as the document.
+    rng = random.Random(seed)
+    version_number = improver.open_backup_store(run, document)
+    previous_document = document
+    started = time.perf_counter()
+    for _ in range(versions):
+        next_document = f"{document.rstrip()}\n\nSeeded Revision {version_number + 1}:\n{MockOllamaClient().words(rng, 40)}\n"
+        improver.backup_document(run, next_document, version_number + 1, {"step": "benchmark seed"}, base_document=previous_document)
+        previous_document, version_number = next_document, version_number + 1
+    improver.save_document(run["document_path"], previous_document)
+    return time.perf_counter() - started
+
+def run_case(case, work_dir):
+    # Runs in the child process: imports the improver in work_dir and returns the case's measurements.
+    os.chdir(work_dir)
+    random.seed(case["seed"])
+    document, title = load_example(case["example"])
+    document = scale_document(document, case["document_scale"], case["seed"])
+    with open("project_document.txt", "w", encoding="utf-8") as f_document:
+        f_document.write(document)
+    with open("simple_config.json", "w", encoding="utf-8") as f_config:
+        json.dump({"document_title": title, "document_path": "project_document.txt", "gen_model": "mock",
+                   "max_iterations_simple": case["iterations"], "ollama_num_parallel": case["ollama_num_parallel"],
+                   "llm_cache_mode": "off", "iteration_pause_seconds": 0,
+                   "convergence_action": "off", **case.get("config", {})}, f_config) # Every case runs all its iterations
+
+    import_started = time.perf_counter()
+    sys.path.insert(0, REPO_DIR)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        import simple_document_improver as improver
+        improver.setup_logging()
+        library = improver.Improver(improver.load_config())
+    import_seconds = time.perf_counter() - import_started
+    improver.console_handler.setLevel(logging.CRITICAL + 1)
+    mock_client = MockOllamaClient(seed=case["seed"], **case["mock"])
+    improver.ollama_hosts[:] = [improver.new_ollama_host("mock", mock_client)]
+
+    run = library.document_run()
+    seed_seconds = seed_backup_store(improver, run, document, case["preseed_versions"], case["seed"]) if case["preseed_versions"] else 0.0
+
+    # Per-iteration timing comes from the journal's iteration markers.
+    iterations, current = [], {}
+    journal_begin_iteration, journal_end_iteration = improver.journal_begin_iteration, improver.journal_end_iteration
+    def timed_begin_iteration(run, iteration, document_content):
+        current.update(started=time.perf_counter(), busy=mock_client.busy_seconds(), document_chars=len(document_content))
+        return journal_begin_iteration(run, iteration, document_content)
+    def timed_end_iteration(run, iteration, outcome):
+        journal_end_iteration(run, iteration, outcome)
+        seconds, busy_seconds = time.perf_counter() - current["started"], mock_client.busy_seconds() - current["busy"]
+        sample = {"iteration": iteration, "outcome": outcome, "seconds": seconds, "llm_busy_seconds": busy_seconds,
+                  "overhead_seconds": max(0.0, seconds - busy_seconds), "document_chars": current["document_chars"]}
+        if case["trace_memory"]: sample["traced_kb"] = tracemalloc.get_traced_memory()[0] / 1024
+        iterations.append(sample)
+    improver.journal_begin_iteration, improver.journal_end_iteration = timed_begin_iteration, timed_end_iteration
+
+    if case["trace_memory"]: tracemalloc.start()
+    loop_started = time.perf_counter()
+    improver.start_convo_log(run)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        improver.main_improvement_loop(run)
+    improver.close_convo_log()
+    wall_seconds = time.perf_counter() - loop_started
+    traced_peak_kb = tracemalloc.get_traced_memory()[1] / 1024 if case["trace_memory"] else None
+    if case["trace_memory"]: tracemalloc.stop()
+
+    store_bytes = sum(os.path.getsize(os.path.join(run["backup_objects_dir"], f_name)) for f_name in os.listdir(run["backup_objects_dir"]))
+    result = {"import_seconds": import_seconds, "seed_seconds": seed_seconds, "wall_seconds": wall_seconds, "iterations": len(iterations),
+              "iterations_per_minute": 60 * len(iterations) / wall_seconds if wall_seconds else None,
+              "iteration_seconds": distribution(improver, [sample["seconds"] for sample in iterations]),
+              "overhead_seconds": distribution(improver, [sample["overhead_seconds"] for sample in iterations]),
+              "llm_calls": mock_client.stats["calls"], "llm_busy_seconds": mock_client.busy_seconds(),
+              "max_concurrent_calls": mock_client.stats["max_in_flight"],
+              "prompt_tokens": mock_client.stats["prompt_tokens"], "output_tokens": mock_client.stats["output_tokens"],
+              "outcomes": {outcome: sum(1 for sample in iterations if sample["outcome"] == outcome) for outcome in {sample["outcome"] for sample in iterations}},
+              "document_chars": {"start": len(document), "end": len(improver.load_document(run["document_path"], title))},
+              "backup_versions": len(run["backup_index"]), "backup_store_bytes": store_bytes,
+              "per_iteration": iterations}
+    if case["trace_memory"]:
+        traced = [sample["traced_kb"] for sample in iterations]
+        result["memory"] = {"traced_start_kb": traced[0] if traced else None, "traced_end_kb": traced[-1] if traced else None,
+                            "traced_peak_kb": traced_peak_kb, "growth_kb_per_iteration": slope(traced[len(traced) // 10:])}
+    if resource is not None:
+        result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def distribution(improver, values):
+    if not values: return {"mean": None, "p50": None, "p95": None, "max": None}
+    return {"mean": sum(values) / len(values), "p50": improver.percentile(values, 0.5), "p95": improver.percentile(values, 0.95), "max": max(values)}
+
+def slope(values):
+    # Least-squares slope of values against their index; None for fewer than two values.
+    if len(values) < 2: return None
+    mean_x, mean_y = (len(values) - 1) / 2, sum(values) / len(values)
+    return sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / sum((x - mean_x) ** 2 for x in range(len(values)))
+
+# --- Suite Runner ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_suite(cases, keep_work_dirs, timeout):
+    results = []
+    for case in cases:
+        work_dir = tempfile.mkdtemp(prefix="baby_alpha_bench_")
+        result_path = os.path.join(work_dir, "benchmark_case_result.json")
+        print(f"{case['name']:<40}", end="", flush=True)
+        try:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case), "--work-dir", work_dir, "--result", result_path],
+                                       capture_output=True, text=True, timeout=timeout)
+            if completed.returncode != 0:
+                raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}")
+            with open(result_path, "r", encoding="utf-8") as f_result:
+                result = {"case": case, **json.load(f_result)}
+            print(f"{result['iterations']:>4} it  {result['iteration_seconds']['p50'] or 0:>8.3f}s p50  "
+                  f"{result['overhead_seconds']['mean'] or 0:>8.3f}s overhead  {result['iterations_per_minute'] or 0:>8.1f} it/min")
+        except Exception as e:
+            result = {"case": case, "error": str(e)}
+            print(f"FAILED: {e}")
+        finally:
+            if keep_work_dirs: print(f"    work dir: {work_dir}")
+            else: shutil.rmtree(work_dir, ignore_errors=True)
+        results.append(result)
+    return results
+
+# Metrics compared by --compare; all are lower-is-better.
+COMPARED_METRICS = (("iteration_seconds", "p50"), ("overhead_seconds", "mean"), ("memory", "growth_kb_per_iteration"))
+
+def compare_results(baseline, results, tolerance):
+    # Returns a list of regression descriptions for cases present in both runs.
+    baseline_cases = {result["case"]["name"]: result for result in baseline.get("results", []) if "error" not in result}
+    regressions = []
+    for result in results:
+        before = baseline_cases.get(result["case"]["name"])
+        if before is None or before["case"] != result["case"] or "error" in result: continue # Only like for like
+        for group, metric in COMPARED_METRICS:
+            old_value, new_value = (before.get(group) or {}).get(metric), (result.get(group) or {}).get(metric)
+            if old_value is None or new_value is None: continue
+            # Small absolute differences are timer noise, not regressions.
+            if new_value > old_value * (1 + tolerance) and new_value - old_value > 0.005:
+                regressions.append(f"{result['case']['name']}: {group}.{metric} {old_value:.4f} -> {new_value:.4f} (+{(new_value / old_value - 1) * 100 if old_value else float('inf'):.0f}%)")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Baby Alpha improvement loop against a mock LLM.")
+    parser.add_argument("--suite", choices=("quick", "full"), default="quick", help="quick (about a minute) or full (larger sizes and longer runs).")
+    parser.add_argument("--only", help="Comma-separated case groups: overhead, size, concurrency, synthesis, backups, memory.")
+    parser.add_argument("--iterations", type=int, help="Iterations per case, overriding the suite's defaults.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results (default: benchmark_results.json).")
+    parser.add_argument("--compare", metavar="BASELINE", help="Earlier results file; exit with status 1 if any case regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown for --compare, as a fraction (default 0.25).")
+    parser.add_argument("--timeout", type=int, default=1800, help="Seconds before a case is abandoned (default 1800).")
+    parser.add_argument("--keep-work-dirs", action="store_true", help="Keep each case's work directory (document, backups, logs) for inspection.")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        case_result = run_case(json.loads(args.run_case), args.work_dir)
+        with open(args.result, "w", encoding="utf-8") as f_result:
+            json.dump(case_result, f_result)
+        raise SystemExit(0)
+
+    only_groups = {group.strip() for group in args.only.split(",")} if args.only else None
+    suite_results = run_suite(build_cases(args.suite, only_groups, args.iterations), args.keep_work_dirs, args.timeout)
+    report = {"created": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "python": platform.python_version(),
+              "platform": platform.platform(), "suite": args.suite, "results": suite_results}
+    with open(args.output, "w", encoding="utf-8") as f_output:
+        json.dump(report, f_output, indent=2)
+    print(f"Results written to '{args.output}'.")
+
+    failed = [result["case"]["name"] for result in suite_results if "error" in result]
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f_baseline:
+            regressions = compare_results(json.load(f_baseline), suite_results, args.tolerance)
+        for regression in regressions: print(f"REGRESSION {regression}")
+        if not regressions: print(f"No regressions against '{args.compare}' (tolerance {args.tolerance:.0%}).")
+        if regressions: raise SystemExit(1)
+    if failed: raise SystemExit(1)
@@ -0,0 +1,108 @@
+# convo_log_reader.py
+# Reads the compressed conversation logs written by simple_document_improver.py (logs/convo/*.jsonl.gz).
+#
+#   python convo_log_reader.py                          # every call in logs/convo, oldest first
+#   python convo_log_reader.py --session latest --step synthesis --full
+#   python convo_log_reader.py --grep "con_number.: 0" --iteration 12
+#   python convo_log_reader.py --stats                  # calls, tokens and seconds per step
+#   python convo_log_reader.py batch_runs/PTSD\ treatment/logs/convo --json > calls.jsonl
+
+import argparse
+import collections
+import datetime
+import gzip
+import json
+import os
+import re
+import zlib
+
+SEGMENT_NAME_PATTERN = re.compile(r"^convo_(.+)_(\d+)\.jsonl\.gz$")
+
+def convo_segment_paths(path, session=None):
+    # path is a convo log directory or a single segment. session: None (all), "latest", or a session id.
+    if not os.path.isdir(path): return [path]
+    segments = sorted((match.group(1), int(match.group(2)), os.path.join(path, f_name))
+                      for f_name in os.listdir(path) for match in [SEGMENT_NAME_PATTERN.match(f_name)] if match)
+    if session == "latest" and segments: session = segments[-1][0]
+    return [segment_path for segment_session, _, segment_path in segments if session is None or segment_session == session]
+
+def iter_convo_records(path, session=None):
+    # Yields the records in order. "blob" records are not yielded; instead each llm_call record gets the texts it
+    # references filled in as "system_prompt" and "document_text" (None when the call had no document).
+    blobs = {}
+    for segment_path in convo_segment_paths(path, session):
+        try:
+            with gzip.open(segment_path, "rt", encoding="utf-8") as f_segment:
+                for line in f_segment:
+                    try: record = json.loads(line)
+                    except json.JSONDecodeError: continue # Torn last line of a segment that was never closed
+                    if record.get("type") == "blob":
+                        blobs[record["sha256"]] = record["text"]; continue
+                    if record.get("type") == "llm_call":
+                        record["system_prompt"] = blobs.get(record.get("system_sha256"))
+                        record["document_text"] = blobs.get(record["document_sha256"]) if record.get("document_sha256") else None
+                    yield record
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            pass # Segment still being written, or cut short by a crash: everything up to the last flush has been read
+
+def record_matches(record, args):
+    if record.get("type") != "llm_call": return False
+    if args.step and record.get("step") != args.step: return False
+    if args.iteration is not None and record.get("iteration") != args.iteration: return False
+    if args.document and record.get("document_name") != args.document: return False
+    if args.grep and not re.search(args.grep, f"{record.get('task', '')}\n{record.get('response', '')}", flags=re.IGNORECASE): return False
+    return True
+
+def shorten(text, limit):
+    return text if limit is None or len(text) <= limit else text[:limit] + f" [... {len(text) - limit} more chars]"
+
+def print_record(record, full):
+    limit = None if full else 600
+    timestamp = datetime.datetime.fromtimestamp(record["time"]).strftime("%Y-%m-%d %H:%M:%S")
+    header = [timestamp, record.get("document_name"), f"iteration {record.get('iteration')}", f"step {record.get('step')}", f"temp {record.get('temperature')}"]
+    if record.get("prompt_eval_count") is not None: header.append(f"{record['prompt_eval_count']} -> {record.get('eval_count')} tokens")
+    if record.get("total_duration_seconds"): header.append(f"{record['total_duration_seconds']:.2f}s")
+    if record.get("note"): header.append(record["note"])
+    print(f"=== {' | '.join(str(part) for part in header)}")
+    if full and record.get("document_text") is not None:
+        print(f"--- CURRENT DOCUMENT ({record['document_sha256'][:12]}) ---\n{record['document_text']}")
+    print(f"--- TASK ---\n{shorten(record.get('task', ''), limit)}")
+    print(f"--- RESPONSE ---\n{shorten(record.get('response', ''), limit)}\n")
+
+def print_stats(records):
+    by_step = collections.defaultdict(lambda: {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0, "eval_seconds": 0.0})
+    for record in records:
+        step_stats = by_step[record.get("step")]
+        step_stats["calls"] += 1
+        step_stats["seconds"] += record.get("total_duration_seconds") or 0.0
+        step_stats["prompt_tokens"] += record.get("prompt_eval_count") or 0
+        step_stats["output_tokens"] += record.get("eval_count") or 0
+        step_stats["eval_seconds"] += record.get("eval_duration_seconds") or 0.0
+    print(f"{'step':<10}{'calls':>7}{'seconds':>10}{'prompt tok':>12}{'output tok':>12}{'tok/s':>8}")
+    for step, step_stats in sorted(by_step.items(), key=lambda item: -item[1]["seconds"]):
+        tokens_per_second = step_stats["output_tokens"] / step_stats["eval_seconds"] if step_stats["eval_seconds"] else 0.0
+        print(f"{str(step):<10}{step_stats['calls']:>7}{step_stats['seconds']:>10.1f}{step_stats['prompt_tokens']:>12}{step_stats['output_tokens']:>12}{tokens_per_second:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search and print Baby Alpha conversation logs.")
+    parser.add_argument("path", nargs="?", default=os.path.join("logs", "convo"), help="Convo log directory or a single .jsonl.gz segment (default: logs/convo).")
+    parser.add_argument("--session", help="Only this session id (the date-time part of the segment names), or 'latest'.")
+    parser.add_argument("--step", help="Only this pipeline step (1a, 1b, A, 2, C, D, E, F1, F2, F3, G, synthesis, evaluate).")
+    parser.add_argument("--iteration", type=int, help="Only this iteration.")
+    parser.add_argument("--document", help="Only this document name (the name a batch run gives it).")
+    parser.add_argument("--grep", metavar="REGEX", help="Only calls whose task or response matches (case-insensitive).")
+    parser.add_argument("--full", action="store_true", help="Print whole tasks and responses, and the document each call was given.")
+    parser.add_argument("--json", action="store_true", help="Print the matching records as JSON lines.")
+    parser.add_argument("--stats", action="store_true", help="Print calls, tokens and time per step instead of the calls.")
+    args = parser.parse_args()
+
+    matching_records = (record for record in iter_convo_records(args.path, args.session) if record_matches(record, args))
+    if args.stats:
+        print_stats(list(matching_records))
+    else:
+        for record in matching_records:
+            if args.json:
+                if not args.full: record = {key: value for key, value in record.items() if key not in ("system_prompt", "document_text")}
+                print(json.dumps(record, ensure_ascii=False))
+            else:
+                print_record(record, args.full)
@@ -2,173 +2,1451 @@
 
 import ollama
 import json
+import hashlib
+import difflib
+import collections
 import os
 import shutil 
 import time
 import datetime 
 import logging
+import argparse
+import atexit
+import gzip
+import queue
+import contextlib
 import random
+import re
+import sqlite3
+import zlib
+import threading
+import math
+import httpx
+import http.server
+import convo_log_reader
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler 
 
-# --- Pre-Config Logging Setup ---
-print("SCRIPT START: Attempting basic logging setup...\n\n")
-this_file_abs_path = os.path.abspath(__file__) # Get absolute path of this script
-project_root_dir = os.path.dirname(this_file_abs_path) # Get directory of this script
-print(f"Project Root Directory: {project_root_dir}")
-print(f"For a fresh run, you may want to delete old files/folders from:")
-print(f"  - {os.path.join(project_root_dir, 'logs')}")
-print(f"  - {os.path.join(project_root_dir, 'document_backups')}")
-print(f"  - and reset/edit {os.path.join(project_root_dir, config.get('document_path', 'project_document.txt')) if 'config' in locals() else 'project_document.txt'}\n\n")
-
+# --- Configuration ---
+# Importing this module has no side effects. The CLI (main) sets up logging, reads simple_config.json and hands it to
+# an Improver; a program that embeds the module creates the Improver itself (see Library API at the end).
+# Per-document settings (title, paths, model, temperatures, ...) are read into a document run, see build_document_run.
+# The settings applied by configure() are shared by every document this process works on.
+CONFIG_PATH = "simple_config.json"
+DEFAULT_DOCUMENT_TITLE = "Baby Alpha: Can we build a tiny basic Python autonomous agent that copies how people brainstorm, judge, and rewrite ideas on its own? Would this back-and-forth loop stop the AI from either hallucinating or just repeating its training data, and instead spark truly new ideas? Can it take ideas from the world and combine them in truly novel ways to solve a problem? What sort of code would be needed, and how would it work? And how might an open source agent like that change the world?"
 
+def load_config(config_path=CONFIG_PATH):
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            loaded_config = json.load(f)
+        logging.info(f"Successfully loaded {config_path}")
+        return loaded_config
+    except FileNotFoundError:
+        logging.warning(f"{config_path} not found. Using default settings.")
+    except json.JSONDecodeError:
+        logging.error(f"Error decoding {config_path}. Using default settings.")
+    return {}
 
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
-initial_logger = logging.getLogger("PRE_CONFIG_INIT")
-initial_logger.info("PRE_CONFIG_INIT: BasicConfig called.")
-
-# --- Configuration ---
-try:
-    with open("simple_config.json", "r", encoding="utf-8") as f: 
-        config = json.load(f)
-    initial_logger.info("Successfully loaded simple_config.json")
-except FileNotFoundError:
-    initial_logger.warning("simple_config.json not found. Using default settings.")
-    config = {}
-except json.JSONDecodeError:
-    initial_logger.error("Error decoding simple_config.json. Using default settings.")
-    config = {}
-
-DOCUMENT_FILE_PATH = config.get("document_path", "project_document.txt")
-DOCUMENT_TITLE = config.get("document_title", "Baby Alpha: Can we build a tiny basic Python autonomous agent that copies how people brainstorm, judge, and rewrite ideas on its own? Would this back-and-forth loop stop the AI from either hallucinating or just repeating its training data, and instead spark truly new ideas? Can it take ideas from the world and combine them in truly novel ways to solve a problem? What sort of code would be needed, and how would it work? And how might an open source agent like that change the world?") 
-BACKUP_DIR = "document_backups"
-LLM_MODEL = config.get("gen_model", "gemma3:12b-it-qat")
-TEMPERATURE_GENERAL = config.get("temperature_general", 0.6)
-TEMPERATURE_BRAINSTORM_MIN = config.get("temperature_brainstorm_min", 0.5) 
-TEMPERATURE_BRAINSTORM_MAX = config.get("temperature_brainstorm_max", 1.0) 
-TEMPERATURE_SYNTHESIS = config.get("temperature_synthesis", 0.5)
-MAX_ITERATIONS = config.get("max_iterations_simple", 500) 
-MAX_BACKUP_FILES = config.get("max_backup_files", 50)
-MAX_CONVO_LOG_SIZE_MB = config.get("max_convo_log_size_mb", 20)
-
-
-# --- Directory Setup ---
-try:
-    os.makedirs(BACKUP_DIR, exist_ok=True)
-    os.makedirs("logs", exist_ok=True)
-    initial_logger.info(f"Directories '{BACKUP_DIR}' and 'logs' ensured.")
-except Exception as e:
-    initial_logger.error(f"Error creating directories: {e}")
-
-# --- Full Logging Setup ---
-log_file_path = os.path.join("logs", "simple_improver.log")
-logger = logging.getLogger() 
-logger.setLevel(logging.INFO) 
-
-for handler in logger.handlers[:]: logger.removeHandler(handler)
-
-try:
-    app_log_handler = RotatingFileHandler(
-        log_file_path, 
-        maxBytes=10*1024*1024, 
-        backupCount=5, 
-        encoding='utf-8',
-        delay=True
-    )
-    app_log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] [%(module)s:%(funcName)s:%(lineno)d] %(message)s")
-    app_log_handler.setFormatter(app_log_formatter)
-    logger.addHandler(app_log_handler)
-    logging.info(f"RotatingFileHandler for main app log configured for {log_file_path}")
-except Exception as e:
-    initial_logger.error(f"Failed to create FileHandler for {log_file_path}: {e}")
+def configure(process_config):
+    # Applies the process-wide settings. Must be called before any document is worked on (Improver does this); the
+    # module applies the defaults itself at import.
+    global config, OLLAMA_NUM_PARALLEL, STREAM_LLM_RESPONSES, OLLAMA_KEEP_ALIVE, OLLAMA_HOSTS, OLLAMA_HOST_RETRY_SECONDS, OLLAMA_HOST_TIMEOUT_SECONDS, \
+        BATCH_RUNS_DIR, ITERATION_PAUSE_SECONDS, CONVO_LOG_QUEUE_SIZE, CONVO_LOG_SEGMENT_MB, \
+        TELEMETRY_RELOAD_SECONDS, TELEMETRY_PROMETHEUS_PORT, LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_SIZE_MB, \
+        LLM_CACHE_REUSE_MAX_TEMPERATURE
+    config = process_config
+    # Keep this in line with the servers' OLLAMA_NUM_PARALLEL; extra requests would only queue on the server. Applies per host.
+    OLLAMA_NUM_PARALLEL = max(1, int(config.get("ollama_num_parallel", os.environ.get("OLLAMA_NUM_PARALLEL", 1))))
+    STREAM_LLM_RESPONSES = config.get("stream_llm_responses", True) # Needed for runaway-generation detection and cancelling speculative calls
+    OLLAMA_KEEP_ALIVE = config.get("ollama_keep_alive", "30m") # Keeps the model (and its prompt cache) loaded between calls
+    OLLAMA_HOSTS = config.get("ollama_hosts") or [None] # e.g. ["http://gpu1:11434", "http://gpu2:11434"]; None is the default (OLLAMA_HOST) server
+    OLLAMA_HOST_RETRY_SECONDS = config.get("ollama_host_retry_seconds", 30) # How often a failed host is health-checked
+    OLLAMA_HOST_TIMEOUT_SECONDS = config.get("ollama_host_timeout_seconds", 600) # Longest wait for a host's next response bytes
+    BATCH_RUNS_DIR = config.get("batch_runs_dir", "batch_runs") # Batch mode gives each document its own work directory in here
+    ITERATION_PAUSE_SECONDS = config.get("iteration_pause_seconds", 1) # Pause between iterations
+    CONVO_LOG_QUEUE_SIZE = config.get("convo_log_queue_size", 256)  # Callers block (briefly) once this many records are waiting
+    CONVO_LOG_SEGMENT_MB = config.get("convo_log_segment_mb", 8)    # Uncompressed size at which a new segment is started
+    TELEMETRY_RELOAD_SECONDS = config.get("telemetry_reload_seconds", 0.5) # A load_duration above this means the model was (re)loaded
+    TELEMETRY_PROMETHEUS_PORT = config.get("telemetry_prometheus_port")    # Off unless set
+    LLM_CACHE_MODE = config.get("llm_cache_mode", "readwrite")
+    LLM_CACHE_PATH = config.get("llm_cache_path", "llm_cache.sqlite3")
+    LLM_CACHE_MAX_SIZE_MB = config.get("llm_cache_max_size_mb", 200)
+    LLM_CACHE_REUSE_MAX_TEMPERATURE = config.get("llm_cache_reuse_max_temperature", 0.5)
+    with ollama_hosts_lock: # Clients for the new hosts are created on first use
+        ollama_hosts.clear()
+        document_host_affinity.clear()
 
+# --- Logging Setup ---
+logger = logging.getLogger()
+app_log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] [%(module)s:%(funcName)s:%(lineno)d] %(message)s")
 console_handler = logging.StreamHandler()
-console_formatter = logging.Formatter("[%(levelname)s] %(message)s") 
-console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
+console_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
 
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
-
-logging.info(f"--- Simple Document Improver Session Started (Full Logging): {datetime.datetime.now()} ---")
+def setup_logging(log_dir="logs"):
+    # The main log file and the console. Called by the CLI; a program that embeds the module can keep its own logging.
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+    except Exception as e:
+        print(f"Error creating log directory '{log_dir}': {e}")
+    log_file_path = os.path.join(log_dir, "simple_improver.log")
+    logger.setLevel(logging.INFO)
+    for handler in logger.handlers[:]: logger.removeHandler(handler)
+    try:
+        app_log_handler = RotatingFileHandler(log_file_path, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8', delay=True)
+        app_log_handler.setFormatter(app_log_formatter)
+        logger.addHandler(app_log_handler)
+        logging.info(f"RotatingFileHandler for main app log configured for {log_file_path}")
+    except Exception as e:
+        print(f"Failed to create FileHandler for {log_file_path}: {e}")
+    logger.addHandler(console_handler)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+    logging.info(f"--- Simple Document Improver Session Started (Full Logging): {datetime.datetime.now()} ---")
 
 # --- Convo Log Setup ---
-convo_log_path = os.path.join("logs", "convo_simple.txt")
+# Every LLM call is logged as one JSON record in gzip-compressed segments under logs/convo/
+# (convo_<session>_<n>.jsonl.gz), written by a background thread behind a bounded queue so log I/O stays off the
+# request path. The system prompt and the document are stored once per segment as "blob" records and referenced by
+# hash, instead of being repeated in every record. Read the logs with convo_log_reader.py.
+CONVO_LOG_BATCH_RECORDS = 64 # Records written between flushes
+
+convo_log_writer_state = {"thread": None, "queue": None}
+convo_log_writer_lock = threading.Lock()
 
-def manage_convo_log_rotation():
+def open_convo_segment(run):
+    segment = run["convo_segment"]
+    if segment is not None: segment["file"].close()
+    segment_index = 1 if segment is None else segment["index"] + 1
+    segment_path = os.path.join(run["convo_log_dir"], f"convo_{run['convo_session']}_{segment_index:03d}.jsonl.gz")
+    run["convo_segment"] = {"index": segment_index, "path": segment_path, "file": gzip.open(segment_path, "ab"), "bytes": 0, "blobs": set()}
+    prune_convo_segments(run)
+    return run["convo_segment"]
+
+def prune_convo_segments(run):
+    # Oldest segments go first once the compressed total is over max_convo_log_size_mb.
     try:
-        if os.path.exists(convo_log_path):
-            if os.path.getsize(convo_log_path) > MAX_CONVO_LOG_SIZE_MB * 1024 * 1024:
-                backup_convo_path = convo_log_path + ".1"
-                if os.path.exists(backup_convo_path): os.remove(backup_convo_path)
-                os.rename(convo_log_path, backup_convo_path)
-                logging.info(f"Rotated convo_simple.txt (max size {MAX_CONVO_LOG_SIZE_MB}MB reached).")
-                with open(convo_log_path, "w", encoding="utf-8") as f_conv_new:
-                    f_conv_new.write(f"--- Simple Improver Convo Log (New after Rotation): {datetime.datetime.now()} ---\n")
+        segment_paths = sorted(os.path.join(run["convo_log_dir"], f) for f in os.listdir(run["convo_log_dir"]) if f.endswith(".jsonl.gz"))
+        total_bytes = sum(os.path.getsize(path) for path in segment_paths)
+        for path in segment_paths[:-1]:
+            if total_bytes <= run["max_convo_log_size_mb"] * 1024 * 1024: break
+            total_bytes -= os.path.getsize(path)
+            os.remove(path)
+            logging.info(f"Removed old convo log segment {path} (limit {run['max_convo_log_size_mb']}MB).")
     except Exception as e:
-        logging.error(f"Error managing convo_simple.txt rotation: {e}")
+        logging.error(f"Error pruning convo log segments: {e}")
+
+def write_convo_record(run, record, blobs):
+    segment = run["convo_segment"]
+    if segment is None or segment["bytes"] > CONVO_LOG_SEGMENT_MB * 1024 * 1024:
+        segment = open_convo_segment(run)
+    lines = [json.dumps({"type": "blob", "sha256": blob_hash, "text": text}, ensure_ascii=False)
+             for blob_hash, text in blobs.items() if blob_hash not in segment["blobs"]]
+    segment["blobs"].update(blobs)
+    lines.append(json.dumps(record, ensure_ascii=False))
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    segment["file"].write(data)
+    segment["bytes"] += len(data)
+
+def convo_log_writer(log_queue):
+    runs_written = {}
+    while True:
+        batch = [log_queue.get()]
+        while len(batch) < CONVO_LOG_BATCH_RECORDS:
+            try: batch.append(log_queue.get_nowait())
+            except queue.Empty: break
+        stopping = False
+        for item in batch:
+            if item is None: stopping = True; continue
+            run, record, blobs = item
+            try:
+                write_convo_record(run, record, blobs)
+                runs_written[run["name"]] = run
+            except Exception as e:
+                logging.error(f"Failed to write convo log record: {e}")
+        for run in runs_written.values():
+            try:
+                # A sync flush makes everything so far readable even if the process dies before the segment is closed.
+                if stopping: run["convo_segment"]["file"].close(); run["convo_segment"] = None
+                else: run["convo_segment"]["file"].flush(zlib.Z_SYNC_FLUSH)
+            except Exception as e:
+                logging.error(f"Failed to flush convo log segment: {e}")
+        if stopping:
+            return
+
+def write_convo_log(session_memory, call, llm_response_text, response_note="", final_chunk=None):
+    # call: {"step", "temperature", "options", "task", "document"} as built by ask_llm.
+    run = session_memory['run']
+    final_chunk = final_chunk or {}
+    blobs = {sha256_text(run["system_prompt"]): run["system_prompt"]}
+    if call["document"] is not None: blobs[sha256_text(call["document"])] = call["document"]
+    record = {
+        "type": "llm_call", "time": time.time(), "session": run["convo_session"], "document_name": run["name"], "model": run["llm_model"],
+        "iteration": session_memory.get('current_iteration'), "step": call["step"], "temperature": call["temperature"],
+        "num_ctx": call["options"].get("num_ctx"), "num_predict": call["options"].get("num_predict"), "note": response_note,
+        "prompt_sha256": sha256_text(call["final_prompt"]), "system_sha256": sha256_text(run["system_prompt"]),
+        "document_sha256": sha256_text(call["document"]) if call["document"] is not None else None,
+        "task": call["task"], "response": llm_response_text, "speculative": (session_memory.get('speculation') or {}).get("kind"),
+        "prompt_eval_count": final_chunk.get("prompt_eval_count"), "eval_count": final_chunk.get("eval_count"),
+        **{f"{name}_seconds": round(final_chunk[name] / 1e9, 3) for name in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration") if final_chunk.get(name)},
+    }
+    queue_convo_record(run, record, blobs)
+
+def write_con_memory_log(session_memory, con_text, similar):
+    # Records what the con memory decided about a chosen Con, so replay can take the same path without embeddings.
+    run = session_memory['run']
+    record = {
+        "type": "con_memory", "time": time.time(), "session": run["convo_session"], "document_name": run["name"],
+        "iteration": session_memory.get('current_iteration'), "con": con_text,
+        "similar": [{"similarity": round(similarity, 4), "iteration": past["iteration"], "con": past["con"], "outcome": past["outcome"]}
+                    for similarity, past in similar],
+    }
+    queue_convo_record(run, record, {})
+
+def queue_convo_record(run, record, blobs):
+    with convo_log_writer_lock:
+        if convo_log_writer_state["thread"] is None:
+            convo_log_writer_state["queue"] = queue.Queue(maxsize=CONVO_LOG_QUEUE_SIZE)
+            convo_log_writer_state["thread"] = threading.Thread(target=convo_log_writer, args=(convo_log_writer_state["queue"],), name="convo-log-writer", daemon=True)
+            convo_log_writer_state["thread"].start()
+        log_queue = convo_log_writer_state["queue"]
+    log_queue.put((run, record, blobs))
+
+def close_convo_log():
+    # Writes out everything still queued and closes the segments. Registered with atexit.
+    with convo_log_writer_lock:
+        writer_thread, convo_log_writer_state["thread"] = convo_log_writer_state["thread"], None
+        log_queue = convo_log_writer_state["queue"]
+    if writer_thread is not None:
+        log_queue.put(None)
+        writer_thread.join()
+
+atexit.register(close_convo_log)
 
 # --- LLM Interaction ---
-ollama_client = None
-try:
-    ollama_client = ollama.Client()
-    ollama_client.list()
-    logging.info("Ollama client initialized and server connection successful.")
-except Exception as e:
-    logging.critical(f"Failed to initialize Ollama client: {e}", exc_info=True)
-
-def ask_llm(prompt_text: str, session_memory: dict, temperature: float = TEMPERATURE_GENERAL):
-    if not ollama_client:
-        return "Error: Ollama client not available."
-
-    final_prompt_to_llm = (
+# One client per Ollama host in ollama_hosts. Each call goes to the healthy host with the shortest expected wait
+# (in-flight requests over its recent generation speed), except that a document sticks to the host that last served
+# it while that host has a free slot, because that host already holds the document's prompt prefix in its KV cache.
+# A host that fails a call (or doesn't answer within ollama_host_timeout_seconds) is taken out of rotation and the
+# call is retried elsewhere. A background health check asks it for its model list every ollama_host_retry_seconds,
+# and it rejoins the rotation once it answers.
+OLLAMA_HOST_SPEED_SMOOTHING = 0.3 # Weight of the latest call in a host's tokens/sec average
+OLLAMA_HOST_CONNECT_TIMEOUT_SECONDS = 10
+# Errors that mean the host (not the prompt) is the problem: unreachable, dropped connection, timeout. An
+# ollama.ResponseError only counts when it is a server-side failure (see is_ollama_host_error).
+OLLAMA_HOST_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+
+class LLMError(Exception):
+    # An LLM call that gave no usable answer: every host failed, the generation was cut off or cancelled, replay had
+    # no recorded answer, or a structured answer still didn't parse after the re-asks.
+    pass
+
+def new_ollama_host(host_url, client=None):
+    # The timeout is per read, so while a response streams in it only limits the gap between chunks.
+    if client is None:
+        client = ollama.Client(host=host_url, timeout=httpx.Timeout(OLLAMA_HOST_TIMEOUT_SECONDS, connect=OLLAMA_HOST_CONNECT_TIMEOUT_SECONDS))
+    return {"name": host_url or "default", "client": client, "in_flight": 0,
+            "tokens_per_second": None, "healthy": True, "retry_at": 0.0, "failures": 0, "probing": False}
+
+def is_ollama_host_error(error):
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500 or error.status_code < 0 # < 0: an error reported in the middle of a stream
+    return isinstance(error, OLLAMA_HOST_ERRORS)
+
+ollama_hosts = [] # Created on first use from OLLAMA_HOSTS, see ensure_ollama_hosts
+ollama_hosts_lock = threading.Lock()
+document_host_affinity = {} # run name -> host that last served it
+
+def ensure_ollama_hosts():
+    # Caller holds ollama_hosts_lock. Creating a client doesn't contact its server; the model warm-up (or the first
+    # call) finds out whether the host is up.
+    if not ollama_hosts:
+        ollama_hosts.extend(new_ollama_host(host_url) for host_url in OLLAMA_HOSTS)
+    return ollama_hosts
+
+def acquire_ollama_host(queue_name, exclude=()):
+    # Picks a host for one call and counts the call as in flight on it. Returns None if every host has been excluded.
+    with ollama_hosts_lock:
+        candidates = [host for host in ensure_ollama_hosts() if host["name"] not in exclude]
+        if not candidates: return None
+        available = [host for host in candidates if host["healthy"]]
+        if not available: # All down: try the one due back soonest rather than fail outright
+            available = [min(candidates, key=lambda host: host["retry_at"])]
+        pinned = document_host_affinity.get(queue_name)
+        if pinned in available and pinned["in_flight"] < OLLAMA_NUM_PARALLEL:
+            chosen = pinned
+        else:
+            known_speeds = [host["tokens_per_second"] for host in available if host["tokens_per_second"]]
+            default_speed = max(known_speeds) if known_speeds else 1.0 # Unmeasured hosts are assumed fast so they get tried
+            chosen = min(available, key=lambda host: (host["in_flight"] >= OLLAMA_NUM_PARALLEL,
+                                                      (host["in_flight"] + 1) / (host["tokens_per_second"] or default_speed)))
+        chosen["in_flight"] += 1
+        return chosen
+
+def release_ollama_host(host, queue_name, final_chunk=None, error=None, served=True):
+    # error: the host failed the call. served=False: the host answered but didn't serve the call (e.g. a missing model).
+    with ollama_hosts_lock:
+        back_in_rotation = error is None and not host["healthy"]
+        update_ollama_host(host, queue_name, final_chunk, error, served)
+    if back_in_rotation: grant_llm_slots_to_waiting() # Its slots are available again
+
+def update_ollama_host(host, queue_name, final_chunk, error, served):
+    # Caller holds ollama_hosts_lock.
+    host["in_flight"] -= 1
+    if error is not None:
+        host["failures"] += 1
+        host["healthy"] = False
+        host["retry_at"] = time.time() + OLLAMA_HOST_RETRY_SECONDS
+        if document_host_affinity.get(queue_name) is host: del document_host_affinity[queue_name]
+        logging.warning(f"Ollama host '{host['name']}' failed ({error}); out of rotation until it passes a health check.")
+        if not host["probing"]:
+            host["probing"] = True
+            threading.Thread(target=probe_ollama_host, args=(host,), name=f"probe-{host['name']}", daemon=True).start()
+        return
+    if not host["healthy"]:
+        logging.info(f"Ollama host '{host['name']}' is back in rotation.")
+    host["healthy"], host["failures"] = True, 0
+    if not served: return
+    document_host_affinity[queue_name] = host
+    eval_count, eval_duration = (final_chunk or {}).get("eval_count"), (final_chunk or {}).get("eval_duration")
+    if eval_count and eval_duration:
+        speed = eval_count / (eval_duration / 1e9)
+        host["tokens_per_second"] = speed if host["tokens_per_second"] is None else (
+            OLLAMA_HOST_SPEED_SMOOTHING * speed + (1 - OLLAMA_HOST_SPEED_SMOOTHING) * host["tokens_per_second"])
+
+def probe_ollama_host(host):
+    # Health check for a host out of rotation, every OLLAMA_HOST_RETRY_SECONDS until it answers. Listing the models is
+    # cheap and needs no model loaded. Stops if the host is replaced (configure) or a live call found it working.
+    while True:
+        time.sleep(max(0.0, host["retry_at"] - time.time()))
+        with ollama_hosts_lock:
+            if host["healthy"] or not any(known_host is host for known_host in ollama_hosts):
+                host["probing"] = False
+                return
+        try:
+            host["client"].list()
+        except Exception as e:
+            with ollama_hosts_lock:
+                host["retry_at"] = time.time() + OLLAMA_HOST_RETRY_SECONDS
+            logging.info(f"Ollama host '{host['name']}' failed its health check ({e}); checking again in {OLLAMA_HOST_RETRY_SECONDS}s.")
+            continue
+        with ollama_hosts_lock:
+            host["healthy"], host["failures"], host["probing"] = True, 0, False
+        logging.info(f"Ollama host '{host['name']}' passed its health check and is back in rotation.")
+        grant_llm_slots_to_waiting()
+        return
+
+def ollama_hosts_summary():
+    with ollama_hosts_lock:
+        return "Ollama hosts: " + ", ".join(
+            f"{host['name']} ({'up' if host['healthy'] else 'down'}, {host['tokens_per_second'] or 0:.1f} tok/s)" for host in ollama_hosts)
+
+# --- Model Warm-up ---
+# A generate call with an empty prompt makes Ollama load the model and return without generating anything. It is sent
+# to every host in the background when a run starts, so loading the model overlaps with reading the document and the
+# backup store instead of delaying the first real call. The model is loaded with the num_ctx the first iteration will
+# use, since a different one would make Ollama load it again. A host that can't be reached is taken out of rotation
+# just as it would be after a failed call.
+def warm_up_host(host, model, num_ctx):
+    try:
+        response = host["client"].generate(model=model, prompt="", options={"num_ctx": num_ctx}, keep_alive=OLLAMA_KEEP_ALIVE)
+    except Exception as e:
+        if is_ollama_host_error(e): release_ollama_host(host, "warm-up", error=e); return
+        release_ollama_host(host, "warm-up", served=False)
+        if isinstance(e, ollama.ResponseError) and e.status_code == 404: # The host is fine, it just doesn't have the model
+            logging.warning(f"Model '{model}' is not available on Ollama host '{host['name']}' (try 'ollama pull {model}'): {e}")
+            return
+        logging.warning(f"Warm-up of '{model}' on Ollama host '{host['name']}' failed: {e}"); return
+    release_ollama_host(host, "warm-up", served=False)
+    logging.info(f"Model '{model}' is loaded on Ollama host '{host['name']}' with num_ctx {num_ctx} (load took {(response.get('load_duration') or 0) / 1e9:.1f}s).")
+
+def warm_up_model(model, num_ctx):
+    # Returns the warm-up threads (one per host); nobody has to wait for them.
+    if LLM_CACHE_MODE == "replay": return [] # Nothing is sent to Ollama
+    with ollama_hosts_lock:
+        hosts = list(ensure_ollama_hosts())
+        for host in hosts: host["in_flight"] += 1 # So the scheduler sees the host as busy while it loads
+    warm_up_threads = [threading.Thread(target=warm_up_host, args=(host, model, num_ctx), name=f"warm-up-{host['name']}", daemon=True) for host in hosts]
+    for warm_up_thread in warm_up_threads: warm_up_thread.start()
+    return warm_up_threads
+
+# --- LLM Scheduling ---
+# At most OLLAMA_NUM_PARALLEL generate calls per healthy host are in flight. The slot count is worked out from the
+# hosts in rotation each time a slot is handed out, so a host that drops out takes its slots with it (calls already
+# running on it finish or fail over) and gives them back once it passes its health check. With every host down, one
+# host's worth of slots stays open for the calls that try the host due back soonest. Waiting calls are queued per
+# document and free slots are handed out round-robin across documents, so in batch mode a document that issues a burst
+# of calls (C/D/E, F1-F3) can't starve the others, and each document's own calls keep their order.
+llm_scheduler = {"slots_in_use": 0, "waiting": collections.OrderedDict(), "granted": set()}
+llm_scheduler_condition = threading.Condition()
+
+def llm_slot_count():
+    with ollama_hosts_lock:
+        healthy_hosts = sum(1 for host in ensure_ollama_hosts() if host["healthy"])
+    return OLLAMA_NUM_PARALLEL * max(1, healthy_hosts)
+
+def grant_llm_slots():
+    # Caller holds llm_scheduler_condition (which is always taken before ollama_hosts_lock, never after).
+    waiting = llm_scheduler["waiting"]
+    slot_count = llm_slot_count() if waiting else 0
+    while llm_scheduler["slots_in_use"] < slot_count and waiting:
+        queue_name, tickets = next(iter(waiting.items()))
+        llm_scheduler["granted"].add(tickets.popleft())
+        llm_scheduler["slots_in_use"] += 1
+        if tickets: waiting.move_to_end(queue_name) # The other documents go first next time
+        else: del waiting[queue_name]
+    llm_scheduler_condition.notify_all()
+
+def grant_llm_slots_to_waiting():
+    # For a host coming back into rotation; the caller must not hold ollama_hosts_lock.
+    with llm_scheduler_condition:
+        grant_llm_slots()
+
+@contextlib.contextmanager
+def llm_slot(queue_name):
+    ticket = object()
+    with llm_scheduler_condition:
+        llm_scheduler["waiting"].setdefault(queue_name, collections.deque()).append(ticket)
+        grant_llm_slots()
+        while ticket not in llm_scheduler["granted"]:
+            llm_scheduler_condition.wait()
+        llm_scheduler["granted"].discard(ticket)
+    try:
+        yield
+    finally:
+        with llm_scheduler_condition:
+            llm_scheduler["slots_in_use"] -= 1
+            grant_llm_slots()
+
+def build_system_prompt(document_title):
+    # Sent as the system field of every call for a document. It must stay byte-for-byte identical so it forms a reusable prompt prefix.
+    return (
         f"You are a critical AI co-author whose primary mission is to expand this research white paper as much as possible:\n--- "
-        f"'{DOCUMENT_TITLE}' ---\n  With every response, add substantial new content—"
+        f"'{document_title}' ---\n  With every response, add substantial new content—"
         f"aim for at least 400–600 fresh words per turn—and keep growing the document well past "
         f"6000 words over time. Blend proven methods from the past, cross-disciplinary insights, and bold left-field "
         f"ideas into a practical, low-cost, step-by-step solution. Justify each element with rigorous "
         f"logic and real-world analogues, devoting most of the paper to what the solution is, why it "
-        f"works, and how to implement it.\n\nTASK / QUESTION:\n{prompt_text}"
+        f"works, and how to implement it."
     )
-    logging.info(f"Sending to LLM (Temp: {temperature}):\n    prompt_text without prefix = {prompt_text[:150]}\n")
-    manage_convo_log_rotation()
+
+# --- Generation Profiles ---
+# Each pipeline step gets only the output budget it needs, and num_ctx is sized from the prompt instead of
+# always reserving number_ctx_simple. Override a profile in simple_config.json, e.g. "generation_profiles": {"notes": {"num_predict": 6144}}.
+GENERATION_PROFILES = {
+    "verdict": {"num_predict": 32},      # JSON verdicts: Brainstorm/Direct Fix, same or better, A/B
+    "pick": {"num_predict": 32},         # The chosen Con's number
+    "analysis": {"num_predict": 2048},   # Pros/Cons list and the C/D/E brainstorm lists
+    "notes": {"num_predict": 4096},      # The 9-item combination lists and the distilled ideas
+    "rewrite": {"num_predict": 16384},   # Full paper rewrites (number_pred_simple)
+    "patch": {"num_predict": 8192},      # Rewrites in "patch" edit mode: only the changed sections
+    "summary": {"num_predict": 512},     # Section summaries for the condensed paper view
+}
+REWRITE_PROFILES = ("rewrite", "patch")
+
+STEP_PROFILES = {
+    "1a": "analysis", "1b": "pick", "A": "verdict", "2": "rewrite",
+    "C": "analysis", "D": "analysis", "E": "analysis",
+    "F1": "notes", "F2": "notes", "F3": "notes", "G": "notes",
+    "synthesis": "rewrite", "evaluate": "verdict", "summary": "summary", "compare": "verdict",
+} # In "patch" edit mode steps 2 and synthesis use the "patch" profile instead
+
+# Changing num_ctx makes Ollama reload the model (and drop its prompt cache), so every call to a model uses the same
+# window: sized at the start of each iteration for the largest step (see size_context_window), snapped to a bucket no
+# smaller than number_ctx_min, and only ever grown.
+CONTEXT_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+CONTEXT_TASK_ALLOWANCE_TOKENS = 2048 # Room for a rewrite step's task text (instructions, notes) on top of the document
+context_windows = {} # model -> the num_ctx its calls use; shared by all documents, as they share the loaded model
+context_windows_lock = threading.Lock()
+
+def step_profile(run, step):
+    # Numbered repeats of a step within one iteration ("synthesis-2", "compare-3", "A-retry1") use the step's profile.
+    return run["step_profiles"].get(step) or run["step_profiles"].get(re.sub(r"(?:-(?:retry)?\d+)+$", "", step), "rewrite")
+
+def estimate_prompt_tokens(run, text):
+    return int(len(text) / run["chars_per_token_estimate"]) + 16 # + chat template overhead
+
+def grow_context_window(run, needed_ctx):
+    # The model's num_ctx, first grown to the bucket that fits needed_ctx if it is smaller.
+    bucket = next((bucket for bucket in CONTEXT_BUCKETS if bucket >= max(needed_ctx, run["num_ctx_min"])), CONTEXT_BUCKETS[-1])
+    with context_windows_lock:
+        num_ctx = context_windows[run["llm_model"]] = max(context_windows.get(run["llm_model"], 0), bucket)
+    return min(num_ctx, run["num_ctx_max"])
+
+def size_context_window(run, document):
+    # Grows the window up front to what this iteration's rewrite steps need (preamble, document and task, plus their
+    # output budget), so it doesn't switch size between the steps of the iteration.
+    rewrite_predict = max(run["generation_profiles"][step_profile(run, step)]["num_predict"] for step in ("2", "synthesis"))
+    needed_ctx = estimate_prompt_tokens(run, run["system_prompt"] + document) + CONTEXT_TASK_ALLOWANCE_TOKENS + rewrite_predict
+    return grow_context_window(run, needed_ctx)
+
+def first_context_window(run):
+    # The window the run's first iteration will size (see size_context_window), from the document file as it is now.
+    try:
+        with open(run["document_path"], "r", encoding="utf-8") as f_document:
+            document = f_document.read()
+    except OSError:
+        document = ""
+    return size_context_window(run, document)
+
+def generation_options_for_step(run, step, temperature, estimated_prompt_tokens):
+    options = {"temperature": temperature}
+    options.update(run["generation_profiles"][step_profile(run, step)])
+    needed_ctx = estimated_prompt_tokens + options["num_predict"]
+    options["num_ctx"] = grow_context_window(run, needed_ctx)
+    if needed_ctx > options["num_ctx"]:
+        # Shrink the output budget rather than let the server shift the start of the prompt out of the window.
+        options["num_predict"] = min(options["num_predict"], max(256, options["num_ctx"] - estimated_prompt_tokens))
+    return options
+
+def prompt_overflows_window(prompt_chars, options):
+    # Checked before a call: True only if the prompt can't fit num_ctx even at the chars/token ratio measured on the
+    # server's own counts (see Prompt Cache Stats). chars_per_token_estimate is deliberately pessimistic, so it is only
+    # used to pick num_ctx; before anything has been measured the call is sent and its prompt_eval_count decides.
+    with prompt_cache_stats_lock:
+        observed_chars_per_token = prompt_cache_stats["observed_chars_per_token"]
+    return observed_chars_per_token is not None and prompt_chars / observed_chars_per_token > options["num_ctx"]
+
+def record_prompt_truncation(step, estimated_prompt_tokens, options, prompt_eval_count, session_memory):
+    num_ctx = options["num_ctx"]
+    logging.warning(f"Step {step}: prompt truncated - estimated {estimated_prompt_tokens} tokens, server evaluated {prompt_eval_count}, num_ctx {num_ctx}. Raise number_ctx_simple if your VRAM allows.")
+    print(f"WARNING: Step {step} prompt (~{estimated_prompt_tokens} tokens) does not fit the {num_ctx}-token context window.")
+    session_memory.setdefault('context_truncations', []).append({
+        "iteration": session_memory.get('current_iteration'), "step": step, "estimated_prompt_tokens": estimated_prompt_tokens,
+        "prompt_eval_count": prompt_eval_count, "num_ctx": num_ctx})
+
+def check_prompt_truncation(step, estimated_prompt_tokens, options, prompt_eval_count, session_memory):
+    # The server silently cuts prompts down to num_ctx, so a prompt_eval_count that filled the whole window means part
+    # of the prompt was dropped. Returns True when truncated.
+    num_ctx = options["num_ctx"]
+    if prompt_eval_count is None: return False
+    if prompt_eval_count > estimated_prompt_tokens:
+        logging.warning(f"Step {step}: server evaluated {prompt_eval_count} prompt tokens, more than the estimated {estimated_prompt_tokens}. Consider lowering chars_per_token_estimate.")
+    if prompt_eval_count < num_ctx - 64:
+        if estimated_prompt_tokens > num_ctx:
+            logging.info(f"Step {step}: prompt estimated at {estimated_prompt_tokens} tokens fit the {num_ctx}-token window ({prompt_eval_count} evaluated).")
+        return False
+    record_prompt_truncation(step, estimated_prompt_tokens, options, prompt_eval_count, session_memory)
+    return True
+
+# --- Prompt Cache Stats ---
+# Ollama reuses the KV cache for the longest prompt prefix it has already evaluated, so every call is laid out as
+# system (fixed preamble + title) -> current document -> step task. These counters estimate what that reuse saves.
+prompt_cache_stats = {"calls": 0, "prompt_tokens_evaluated": 0, "prompt_tokens_reused": 0, "prompt_eval_seconds": 0.0, "observed_chars_per_token": None}
+prompt_cache_stats_lock = threading.Lock()
+
+def record_prompt_cache_stats(prompt_chars: int, final_chunk: dict):
+    prompt_eval_count = final_chunk.get("prompt_eval_count")
+    if not prompt_eval_count: return
+    with prompt_cache_stats_lock:
+        stats = prompt_cache_stats
+        # The least-cached calls show the real chars/token ratio; everything else is measured against it.
+        chars_per_token = prompt_chars / prompt_eval_count
+        if stats["observed_chars_per_token"] is None or chars_per_token < stats["observed_chars_per_token"]:
+            stats["observed_chars_per_token"] = chars_per_token
+        stats["calls"] += 1
+        stats["prompt_tokens_evaluated"] += prompt_eval_count
+        stats["prompt_tokens_reused"] += max(0, int(prompt_chars / stats["observed_chars_per_token"]) - prompt_eval_count)
+        stats["prompt_eval_seconds"] += (final_chunk.get("prompt_eval_duration") or 0) / 1e9
+
+def prompt_cache_summary():
+    with prompt_cache_stats_lock:
+        stats = dict(prompt_cache_stats)
+    if not stats["calls"]: return "Prompt cache: no calls recorded yet."
+    total_tokens = stats["prompt_tokens_evaluated"] + stats["prompt_tokens_reused"]
+    seconds_per_token = stats["prompt_eval_seconds"] / stats["prompt_tokens_evaluated"] if stats["prompt_tokens_evaluated"] else 0.0
+    return (f"Prompt cache: {stats['calls']} calls, {stats['prompt_tokens_evaluated']} prompt tokens evaluated "
+            f"in {stats['prompt_eval_seconds']:.1f}s, ~{stats['prompt_tokens_reused']} reused from the KV cache "
+            f"({100.0 * stats['prompt_tokens_reused'] / total_tokens if total_tokens else 0.0:.0f}%), saving ~{stats['prompt_tokens_reused'] * seconds_per_token:.1f}s of prompt evaluation.")
+
+# --- Telemetry ---
+# Every generate call's server timings are kept, tagged with document, iteration and step, so the time can be split
+# into queueing for an LLM slot, model loading, prompt evaluation and generation. Summaries are logged after each
+# iteration, an end-of-run report goes to logs/telemetry_<session>.json, and with telemetry_prometheus_port set the
+# same numbers are served in the Prometheus text format at http://127.0.0.1:<port>/metrics.
+TELEMETRY_SERVER_TIMINGS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+
+telemetry_samples = []
+telemetry_lock = threading.Lock()
+telemetry_server_state = {"server": None}
+
+def record_step_telemetry(session_memory, step, final_chunk, queue_seconds, wall_seconds, output_chars=0):
+    # final_chunk is empty when the stream was closed early; then only the wall-clock time and the output_chars
+    # streamed before the close are known.
+    run = session_memory['run']
+    sample = {"document": run["name"], "iteration": session_memory.get('current_iteration'), "step": step,
+              "queue_seconds": queue_seconds, "wall_seconds": wall_seconds, "output_chars": output_chars,
+              "prompt_eval_count": final_chunk.get("prompt_eval_count"), "eval_count": final_chunk.get("eval_count")}
+    for timing in TELEMETRY_SERVER_TIMINGS:
+        sample[timing.replace("_duration", "_seconds")] = final_chunk[timing] / 1e9 if final_chunk.get(timing) is not None else None
+    sample["reloaded"] = (sample["load_seconds"] or 0.0) > TELEMETRY_RELOAD_SECONDS
+    speculation = session_memory.get('speculation')
+    sample["speculative"] = speculation["kind"] if speculation else None
+    with telemetry_lock:
+        telemetry_samples.append(sample)
+        if speculation:
+            speculation["calls"] += 1
+            speculation["seconds"] += wall_seconds
+            # A cancelled call never sees the server's eval_count, so its output is estimated from what was streamed.
+            speculation["output_tokens"] += sample["eval_count"] if sample["eval_count"] is not None else int(output_chars / run["chars_per_token_estimate"])
+
+def percentile(values, fraction):
+    # Nearest-rank percentile; None for no values.
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def summarize_telemetry(samples):
+    seconds = lambda key: sum(sample[key] or 0.0 for sample in samples)
+    eval_seconds, prompt_eval_seconds = seconds("eval_seconds"), seconds("prompt_eval_seconds")
+    eval_tokens = sum(sample["eval_count"] or 0 for sample in samples)
+    prompt_tokens = sum(sample["prompt_eval_count"] or 0 for sample in samples)
+    latencies = [sample["wall_seconds"] for sample in samples]
+    return {"calls": len(samples), "wall_seconds": sum(latencies), "p50_seconds": percentile(latencies, 0.5), "p95_seconds": percentile(latencies, 0.95),
+            "queue_seconds": seconds("queue_seconds"), "load_seconds": seconds("load_seconds"),
+            "prompt_eval_seconds": prompt_eval_seconds, "eval_seconds": eval_seconds,
+            "prompt_tokens": prompt_tokens, "output_tokens": eval_tokens,
+            "prompt_tokens_per_second": prompt_tokens / prompt_eval_seconds if prompt_eval_seconds else None,
+            "output_tokens_per_second": eval_tokens / eval_seconds if eval_seconds else None,
+            "reloads": sum(1 for sample in samples if sample["reloaded"])}
+
+def telemetry_samples_for(document=None, iteration=None):
+    with telemetry_lock:
+        return [sample for sample in telemetry_samples
+                if (document is None or sample["document"] == document) and (iteration is None or sample["iteration"] == iteration)]
+
+def telemetry_iteration_summary(document, iteration):
+    summary = summarize_telemetry(telemetry_samples_for(document, iteration))
+    if not summary["calls"]: return f"Iteration {iteration} timing: no LLM calls."
+    return (f"Iteration {iteration} timing: {summary['calls']} LLM calls, {summary['wall_seconds']:.1f}s in calls "
+            f"(prompt eval {summary['prompt_eval_seconds']:.1f}s, generation {summary['eval_seconds']:.1f}s, model load {summary['load_seconds']:.1f}s, "
+            f"{summary['reloads']} reload(s)), {summary['queue_seconds']:.1f}s waiting for a slot.")
+
+def telemetry_report(document=None):
+    # Returns (report text, report dict) for one document, or for every document when document is None.
+    samples = telemetry_samples_for(document)
+    by_step = collections.defaultdict(list)
+    for sample in samples: by_step[sample["step"]].append(sample)
+    report = {"document": document, "session": summarize_telemetry(samples),
+              "steps": {step: summarize_telemetry(step_samples) for step, step_samples in by_step.items()},
+              "iterations": {str(iteration): summarize_telemetry([s for s in samples if s["iteration"] == iteration])
+                             for iteration in sorted({s["iteration"] for s in samples if s["iteration"] is not None})}}
+    format_rate = lambda value: f"{value:.1f}" if value else "-"
+    lines = [f"LLM telemetry{f' for {document}' if document else ''}:",
+             f"{'step':<10}{'calls':>6}{'p50 s':>8}{'p95 s':>8}{'queue s':>9}{'load s':>8}{'prompt s':>10}{'gen s':>8}{'prompt tok/s':>14}{'gen tok/s':>11}{'reloads':>9}"]
+    for step, summary in sorted(report["steps"].items(), key=lambda item: -item[1]["wall_seconds"]) + [("TOTAL", report["session"])]:
+        if not summary["calls"]: continue
+        lines.append(f"{step:<10}{summary['calls']:>6}{summary['p50_seconds']:>8.1f}{summary['p95_seconds']:>8.1f}{summary['queue_seconds']:>9.1f}"
+                     f"{summary['load_seconds']:>8.1f}{summary['prompt_eval_seconds']:>10.1f}{summary['eval_seconds']:>8.1f}"
+                     f"{format_rate(summary['prompt_tokens_per_second']):>14}{format_rate(summary['output_tokens_per_second']):>11}{summary['reloads']:>9}")
+    return "\n".join(lines), report
+
+def write_telemetry_report(run):
+    report_text, report = telemetry_report(run["name"])
+    logging.info(report_text)
+    print(report_text)
+    report_path = os.path.join(run["log_dir"], f"telemetry_{run['convo_session']}.json")
     try:
-        with open(convo_log_path, "a", encoding="utf-8") as f_convo:
-            f_convo.write(f"\n\n>>>> USER PROMPT TO LLM (Final Form) - Iteration {session_memory.get('current_iteration', 'N/A')} - {datetime.datetime.now()}:\n{final_prompt_to_llm}\n")
-    except Exception as e_convo: logging.error(f"Failed to write prompt to convo_simple.txt: {e_convo}")
+        with open(report_path, "w", encoding="utf-8") as f_report:
+            json.dump(report, f_report, indent=2)
+        logging.info(f"Telemetry report written to '{report_path}'.")
+    except Exception as e:
+        logging.error(f"Failed to write telemetry report '{report_path}': {e}")
 
+def prometheus_metrics():
+    lines = []
+    def family(name, metric_type, help_text, values):
+        lines.extend([f"# HELP baby_alpha_{name} {help_text}", f"# TYPE baby_alpha_{name} {metric_type}"])
+        for labels, value in values:
+            label_text = ",".join(f'{key}="{str(label).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, label in labels.items())
+            lines.append(f"baby_alpha_{name}{{{label_text}}} {value}")
+    by_step = collections.defaultdict(list)
+    for sample in telemetry_samples_for():
+        by_step[(sample["document"], sample["step"])].append(sample)
+    summaries = [({"document": document, "step": step}, summarize_telemetry(samples)) for (document, step), samples in sorted(by_step.items())]
+    family("llm_calls_total", "counter", "LLM generate calls.", [(labels, s["calls"]) for labels, s in summaries])
+    family("llm_seconds_total", "counter", "Seconds spent per phase of the LLM calls.",
+           [({**labels, "phase": phase}, s[f"{phase}_seconds"]) for labels, s in summaries for phase in ("queue", "load", "prompt_eval", "eval", "wall")])
+    family("llm_tokens_total", "counter", "Tokens evaluated (prompt) and generated (output).",
+           [({**labels, "kind": kind}, s[f"{kind}_tokens"]) for labels, s in summaries for kind in ("prompt", "output")])
+    family("model_reloads_total", "counter", "Calls during which the model had to be loaded.", [(labels, s["reloads"]) for labels, s in summaries])
+    family("llm_latency_seconds", "gauge", "Call latency percentiles.",
+           [({**labels, "quantile": quantile}, s[f"p{int(float(quantile) * 100)}_seconds"]) for labels, s in summaries for quantile in ("0.5", "0.95")])
+    return "\n".join(lines) + "\n"
+
+class PrometheusMetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404); return
+        body = prometheus_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes would flood the console
+
+def start_telemetry_server():
+    # Started by Improver.improve / improve_batch when telemetry_prometheus_port is set; one server per process.
+    with telemetry_lock:
+        if not TELEMETRY_PROMETHEUS_PORT or telemetry_server_state["server"] is not None: return
+        try:
+            telemetry_server_state["server"] = http.server.ThreadingHTTPServer(("127.0.0.1", int(TELEMETRY_PROMETHEUS_PORT)), PrometheusMetricsHandler)
+        except Exception as e:
+            logging.error(f"Could not start the telemetry endpoint on port {TELEMETRY_PROMETHEUS_PORT}: {e}"); return
+    threading.Thread(target=telemetry_server_state["server"].serve_forever, name="telemetry-server", daemon=True).start()
+    logging.info(f"Prometheus metrics at http://127.0.0.1:{TELEMETRY_PROMETHEUS_PORT}/metrics")
+
+# --- LLM Response Cache ---
+# Content-addressed store of LLM answers in SQLite, keyed on model + full prompt + temperature + options.
+#   "readwrite": every answer is stored; answers at or below llm_cache_reuse_max_temperature are served from the cache.
+#   "replay":    nothing is sent to Ollama; answers come from the cache (seeded from a recorded convo log), in recorded order.
+#   "off":       no caching.
+
+llm_cache_db = None
+llm_cache_lock = threading.Lock()
+replay_cursors = {} # prompt_key -> how many recorded answers for that prompt have been replayed
+
+def open_llm_cache():
+    global llm_cache_db
+    if llm_cache_db is None:
+        llm_cache_db = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        llm_cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, prompt_key TEXT, model TEXT, step TEXT, "
+            "temperature REAL, response TEXT, size INTEGER, created REAL, last_access REAL)")
+        llm_cache_db.execute("CREATE INDEX IF NOT EXISTS responses_prompt_key ON responses (prompt_key, created)")
+        llm_cache_db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        llm_cache_db.commit()
+    return llm_cache_db
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def llm_cache_keys(model, final_prompt_to_llm, options, response_format=None):
+    # prompt_key only covers what a convo log records (model + final prompt), so recordings can be replayed.
+    prompt_key = sha256_text(f"{model}\n{final_prompt_to_llm}")
+    key_fields = {"prompt_key": prompt_key, "options": options}
+    if response_format is not None: key_fields["format"] = response_format
+    key = sha256_text(json.dumps(key_fields, sort_keys=True))
+    return key, prompt_key
+
+def llm_cache_lookup(key, prompt_key, temperature):
+    if LLM_CACHE_MODE == "off": return None
+    if LLM_CACHE_MODE == "readwrite" and temperature > LLM_CACHE_REUSE_MAX_TEMPERATURE: return None
     try:
-        response = ollama_client.generate(
-            model=LLM_MODEL,
-            prompt=final_prompt_to_llm,
-            options={
-                "temperature": temperature,
-                "num_predict": config.get("number_pred_simple", 16384),
-                "num_ctx": config.get("number_ctx_simple", 32768)
-            }
-        )
-        llm_response_text = response.get("response", "").strip()
-        logging.info(f"LLM Response (first 150 chars): {llm_response_text[:150]}...")
+        with llm_cache_lock:
+            db = open_llm_cache()
+            row = db.execute("SELECT key, response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None and LLM_CACHE_MODE == "replay":
+                recorded = db.execute("SELECT key, response FROM responses WHERE prompt_key = ? ORDER BY created", (prompt_key,)).fetchall()
+                if recorded:
+                    row = recorded[min(replay_cursors.get(prompt_key, 0), len(recorded) - 1)]
+                    replay_cursors[prompt_key] = replay_cursors.get(prompt_key, 0) + 1
+            if row is None: return None
+            db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), row[0]))
+            db.commit()
+            return row[1]
+    except Exception as e:
+        logging.error(f"LLM cache lookup failed: {e}")
+        return None
+
+def llm_cache_store(key, prompt_key, model, step, temperature, response_text):
+    if LLM_CACHE_MODE != "readwrite": return
+    try:
+        with llm_cache_lock:
+            db = open_llm_cache()
+            now = time.time()
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key, prompt_key, model, step, temperature, response_text, len(response_text.encode("utf-8")), now, now))
+            evict_llm_cache(db)
+            db.commit()
+    except Exception as e:
+        logging.error(f"LLM cache store failed: {e}")
+
+def evict_llm_cache(db):
+    # Least recently used answers go first once the cache is over llm_cache_max_size_mb.
+    max_bytes = LLM_CACHE_MAX_SIZE_MB * 1024 * 1024
+    total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total_bytes <= max_bytes: return
+    evicted = 0
+    for key, size in db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+        if total_bytes <= max_bytes: break
+        db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        total_bytes -= size; evicted += 1
+    logging.info(f"LLM cache: evicted {evicted} least recently used answers (limit {LLM_CACHE_MAX_SIZE_MB}MB).")
+
+def recorded_llm_answers(log_path):
+    # Yields (final_prompt_to_llm, response_note, response_text) in recorded order from a convo log directory (its
+    # latest session), a single .jsonl.gz segment, or an old-style convo_simple.txt (its rotated ".1" file first).
+    # Con memory decisions come out the same way, keyed by con_memory_decision_prompt (see check_con_against_memory).
+    if not log_path.endswith(".txt"):
+        for record in convo_log_reader.iter_convo_records(log_path, session="latest"):
+            if record.get("type") == "llm_call":
+                yield f"{record['system_prompt']}\n\n{build_llm_prompt(record['task'], record['document_text'])}", record["note"], record["response"]
+            elif record.get("type") == "con_memory":
+                yield con_memory_decision_prompt(record["con"]), "", json.dumps(record["similar"], ensure_ascii=False)
+        return
+    entry_pattern = re.compile(r">>>> USER PROMPT TO LLM \(Final Form\)[^\n]*:\n(.*?)\n<<<< LLM RESPONSE([^\n]*):\n(.*?)(?=\n\n>>>> USER PROMPT TO LLM|\Z)", re.DOTALL)
+    for path in (log_path + ".1", log_path):
+        if not os.path.exists(path): continue
+        with open(path, "r", encoding="utf-8") as f_convo:
+            recording = f_convo.read()
+        for final_prompt_to_llm, response_note, response_text in entry_pattern.findall(recording):
+            yield final_prompt_to_llm, response_note, response_text.rstrip("\n")
+
+def import_convo_log_into_cache(log_path, model):
+    # Seeds the cache from a recorded convo log, see recorded_llm_answers.
+    imported = 0
+    try:
+        with llm_cache_lock:
+            db = open_llm_cache()
+            for final_prompt_to_llm, response_note, response_text in recorded_llm_answers(log_path):
+                if "ABORTED" in response_note or "CACHED" in response_note: continue
+                prompt_key = sha256_text(f"{model}\n{final_prompt_to_llm}")
+                imported += 1
+                db.execute("INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (sha256_text(f"recorded\n{prompt_key}\n{response_text}"), prompt_key, model, None, None,
+                            response_text, len(response_text.encode("utf-8")), time.time() + imported * 1e-6, time.time()))
+            db.commit()
+    except Exception as e:
+        logging.error(f"Could not read recording '{log_path}' for replay: {e}")
+    logging.info(f"LLM cache: imported {imported} recorded answers from '{log_path}' for replay.")
+    return imported
+
+# --- Streaming Checks ---
+# Long generations are checked every DEGENERATE_CHECK_CHARS characters while they stream in.
+DEGENERATE_CHECK_CHARS = 400
+DEGENERATE_NGRAM_WORDS = 12 # A 12-word run showing up DEGENERATE_NGRAM_REPEATS times is a loop, not prose
+DEGENERATE_NGRAM_REPEATS = 4
+ECHO_WINDOW_CHARS = 300 # Latest output this long found verbatim in the instructions = restating the prompt
+
+def normalize_whitespace(text):
+    return " ".join(text.split())
+
+def prompt_echo_reference(final_prompt_to_llm, document_title):
+    # Returns (instructions, quoted): the prompt without its ''' blocks and the title, and the ''' blocks themselves
+    # (documents, notes). Output is only an echo if it matches the instructions and isn't also in the quoted material.
+    quoted_blocks = re.findall(r"'''(.*?)'''", final_prompt_to_llm, flags=re.DOTALL)
+    instructions = re.sub(r"'''.*?'''", " ", final_prompt_to_llm, flags=re.DOTALL).replace(document_title, " ")
+    return normalize_whitespace(instructions), normalize_whitespace(" ".join(quoted_blocks))
+
+def detect_degenerate_output(text, echo_reference):
+    tail_chars = text[-200:]
+    if len(tail_chars) == 200 and len(set(tail_chars)) <= 3:
+        return "repeated character run"
+    words = text.split()
+    if len(words) >= DEGENERATE_NGRAM_WORDS * DEGENERATE_NGRAM_REPEATS:
+        last_ngram = " ".join(words[-DEGENERATE_NGRAM_WORDS:])
+        if " ".join(words).count(last_ngram) >= DEGENERATE_NGRAM_REPEATS:
+            return f"repetition loop ('{last_ngram[:60]}...' seen {DEGENERATE_NGRAM_REPEATS}+ times)"
+    tail = normalize_whitespace(text[-ECHO_WINDOW_CHARS * 2:])[-ECHO_WINDOW_CHARS:]
+    instructions, quoted = echo_reference
+    if len(tail) >= ECHO_WINDOW_CHARS and tail in instructions and tail not in quoted:
+        return "model is restating the prompt"
+    return None
+
+def generate_llm_response(ollama_client, run, prompt: str, options: dict, cancel_event=None, response_format=None):
+    # Returns (response_text, abort_reason, final_chunk). abort_reason is None unless a runaway generation was cut off
+    # or cancel_event was set; final_chunk carries the server's counters (prompt_eval_count etc.) and is empty if the
+    # stream was closed early. response_format is Ollama's format: a JSON schema the answer is constrained to, or None.
+    # A structured answer that is already complete when the output turns degenerate (the format allows trailing
+    # whitespace, so a model can pad it out to num_predict) is kept, and only the rest of the stream is dropped.
+    final_prompt_to_llm = f"{run['system_prompt']}\n\n{prompt}"
+    if not STREAM_LLM_RESPONSES:
+        response = ollama_client.generate(model=run["llm_model"], system=run["system_prompt"], prompt=prompt, options=options, keep_alive=OLLAMA_KEEP_ALIVE, format=response_format)
+        return response.get("response", ""), None, response
+
+    stream = ollama_client.generate(model=run["llm_model"], system=run["system_prompt"], prompt=prompt, options=options, keep_alive=OLLAMA_KEEP_ALIVE, format=response_format, stream=True)
+    echo_reference = None
+    final_chunk = {}
+    pieces = []
+    streamed_chars = 0
+    next_check_at = DEGENERATE_CHECK_CHARS
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                return "".join(pieces), "cancelled", final_chunk
+            if chunk.get("done"): final_chunk = chunk
+            piece = chunk.get("response", "")
+            if not piece: continue
+            pieces.append(piece)
+            streamed_chars += len(piece)
+            if streamed_chars >= next_check_at:
+                next_check_at = streamed_chars + DEGENERATE_CHECK_CHARS
+                if echo_reference is None: echo_reference = prompt_echo_reference(final_prompt_to_llm, run["document_title"])
+                abort_reason = detect_degenerate_output("".join(pieces), echo_reference)
+                if abort_reason and response_format is not None and parse_json_answer("".join(pieces)) is not None:
+                    logging.info(f"Structured answer is complete; closing the stream ({abort_reason} after it).")
+                    break
+                if abort_reason:
+                    return "".join(pieces), abort_reason, final_chunk
+    finally:
+        if hasattr(stream, "close"): stream.close()
+    return "".join(pieces), None, final_chunk
+
+def generate_on_ollama_hosts(run, prompt: str, options: dict, cancel_event=None, response_format=None):
+    # generate_llm_response on the best host for this document, moving on to the next host if one fails or doesn't
+    # have the model. Other errors (a bad request) would fail on every host, so they are raised straight away.
+    tried_hosts, missing_model_error = set(), None
+    while True:
+        host = acquire_ollama_host(run["name"], exclude=tried_hosts)
+        if host is None:
+            if missing_model_error is not None and len(tried_hosts) == len(ollama_hosts): raise missing_model_error
+            raise ConnectionError(f"every Ollama host failed ({', '.join(sorted(tried_hosts))})")
         try:
-            with open(convo_log_path, "a", encoding="utf-8") as f_convo:
-                f_convo.write(f"<<<< LLM RESPONSE:\n{llm_response_text}\n")
-        except Exception as e_convo: logging.error(f"Failed to write LLM response to convo_simple.txt: {e_convo}")
+            llm_response_text, abort_reason, final_chunk = generate_llm_response(host["client"], run, prompt, options, cancel_event=cancel_event,
+                                                                                 response_format=response_format)
+        except Exception as e:
+            if is_ollama_host_error(e):
+                release_ollama_host(host, run["name"], error=e)
+            elif isinstance(e, ollama.ResponseError) and e.status_code == 404:
+                release_ollama_host(host, run["name"], served=False)
+                logging.warning(f"Model '{run['llm_model']}' is not available on Ollama host '{host['name']}' (try 'ollama pull {run['llm_model']}'): {e}")
+                missing_model_error = e
+            else:
+                release_ollama_host(host, run["name"], served=False)
+                raise
+            tried_hosts.add(host["name"])
+            continue
+        release_ollama_host(host, run["name"], final_chunk=final_chunk)
+        return llm_response_text, abort_reason, final_chunk
+
+def build_llm_prompt(prompt_text: str, document: str = None):
+    # Shared prefix first (the document), step-specific task last, so consecutive calls share as many leading tokens as possible.
+    document_block = f"CURRENT DOCUMENT:\n'''\n{document}\n'''\n\n" if document is not None else ""
+    return f"{document_block}TASK / QUESTION:\n{prompt_text}"
+
+def ask_llm(prompt_text: str, session_memory: dict, temperature: float = None, step: str = "general", document: str = None, response_format=None):
+    # Returns the response text; raises LLMError if there is no usable answer.
+    # session_memory['run'] is the document run (see build_document_run) the call belongs to.
+    # temperature: defaults to the run's temperature_general.
+    # step: pipeline step label (see STEP_PROFILES), which picks num_predict and sizes num_ctx.
+    # document: sent ahead of the task as CURRENT DOCUMENT so calls on the same document hit the server's prompt cache.
+    # response_format: JSON schema for the answer (see Structured Output); ask_llm_structured sets it.
+    resumed_steps = session_memory.get('resumed_steps', {})
+    if step in resumed_steps:
+        logging.info(f"Resuming: using journaled output for step {step} instead of asking the LLM.")
+        return resumed_steps[step]
+
+    run = session_memory['run']
+    if temperature is None: temperature = run["temperature_general"]
+    llm_prompt = build_llm_prompt(prompt_text, document)
+    final_prompt_to_llm = f"{run['system_prompt']}\n\n{llm_prompt}"
+    estimated_prompt_tokens = estimate_prompt_tokens(run, final_prompt_to_llm)
+    options = generation_options_for_step(run, step, temperature, estimated_prompt_tokens)
+    call = {"step": step, "temperature": temperature, "options": options, "task": prompt_text, "document": document, "final_prompt": final_prompt_to_llm}
+
+    cache_key, cache_prompt_key = llm_cache_keys(run["llm_model"], final_prompt_to_llm, options, response_format)
+    cached_response_text = llm_cache_lookup(cache_key, cache_prompt_key, temperature)
+    if cached_response_text is not None:
+        logging.info(f"LLM cache hit (Step: {step}, Temp: {temperature}): {cached_response_text[:150]}...")
+        write_convo_log(session_memory, call, cached_response_text, "CACHED")
+        journal_step(session_memory, step, cached_response_text)
+        return cached_response_text
+    if LLM_CACHE_MODE == "replay":
+        logging.error(f"Replay cache miss for step {step}: {prompt_text[:150]}")
+        raise LLMError(f"No recorded answer to replay for step {step}.")
+    if step_profile(run, step) in REWRITE_PROFILES and prompt_overflows_window(len(final_prompt_to_llm), options):
+        # Known before the call: a rewrite from a truncated prompt would drop part of the document, so don't generate it.
+        record_prompt_truncation(step, estimated_prompt_tokens, options, None, session_memory)
+        raise LLMError(f"Prompt for step {step} does not fit the {options['num_ctx']}-token context window (number_ctx_simple).")
+    logging.info(f"Sending to LLM (Step: {step}, Temp: {temperature}, num_ctx: {options['num_ctx']}, num_predict: {options['num_predict']}, ~{estimated_prompt_tokens} prompt tokens):\n    prompt_text without prefix = {prompt_text[:150]}\n")
+
+    try:
+        cancel_event = (session_memory.get('speculation') or {}).get("cancel_event")
+        slot_requested_at = time.monotonic()
+        with llm_slot(run["name"]):
+            if cancel_event is not None and cancel_event.is_set():
+                raise LLMError("LLM call cancelled - speculative result no longer needed")
+            generation_started_at = time.monotonic()
+            llm_response_text, abort_reason, final_chunk = generate_on_ollama_hosts(run, llm_prompt, options, cancel_event=cancel_event,
+                                                                                    response_format=response_format)
+        record_step_telemetry(session_memory, step, final_chunk, generation_started_at - slot_requested_at, time.monotonic() - generation_started_at,
+                              output_chars=len(llm_response_text))
+        llm_response_text = llm_response_text.strip()
+        record_prompt_cache_stats(len(final_prompt_to_llm), final_chunk)
+        if check_prompt_truncation(step, estimated_prompt_tokens, options, final_chunk.get("prompt_eval_count"), session_memory) and step_profile(run, step) in REWRITE_PROFILES:
+            abort_reason = "prompt truncated, a rewrite would drop part of the document"
+        if abort_reason:
+            logging.warning(f"LLM generation aborted after {len(llm_response_text)} chars: {abort_reason}.")
+        else:
+            logging.info(f"LLM Response (first 150 chars): {llm_response_text[:150]}...")
+        write_convo_log(session_memory, call, llm_response_text, f"ABORTED: {abort_reason}" if abort_reason else "", final_chunk)
+        if abort_reason:
+            raise LLMError(f"LLM generation aborted - {abort_reason}")
+        llm_cache_store(cache_key, cache_prompt_key, run["llm_model"], step, temperature, llm_response_text)
+        journal_step(session_memory, step, llm_response_text)
         return llm_response_text
+    except LLMError:
+        raise
     except Exception as e:
         logging.error(f"Error asking LLM: {e}", exc_info=True)
-        return f"Error: LLM call failed - {e}"
+        raise LLMError(f"LLM call failed - {e}") from e
+
+def ask_llm_request(prompt_request, session_memory: dict):
+    # Returns the answer, or the LLMError if there was none, so one failed request doesn't lose the rest of a batch.
+    prompt_text, temperature, step, *document_and_output = prompt_request
+    document, output = (document_and_output + [None, None])[:2]
+    try:
+        if output is not None:
+            return ask_llm_structured(prompt_text, session_memory, output, temperature=temperature, step=step, document=document)
+        return ask_llm(prompt_text, session_memory, temperature=temperature, step=step, document=document)
+    except LLMError as e:
+        return e
+
+def ask_llm_batch(prompt_requests, session_memory: dict):
+    # Runs independent (prompt_text, temperature, step[, document[, output]]) requests concurrently, bounded by the
+    # LLM slots; output makes it a structured request (see ask_llm_structured). Results come back in the same order
+    # as prompt_requests, with an LLMError in place of each request that failed.
+    slot_count = llm_slot_count()
+    if len(prompt_requests) <= 1 or slot_count <= 1:
+        return [ask_llm_request(prompt_request, session_memory) for prompt_request in prompt_requests]
+    with ThreadPoolExecutor(max_workers=min(len(prompt_requests), slot_count), thread_name_prefix=f"{session_memory['run']['name']}-llm") as executor:
+        futures = [executor.submit(ask_llm_request, prompt_request, session_memory) for prompt_request in prompt_requests]
+        return [future.result() for future in futures]
+
+def random_brainstorm_temperature(run):
+    return random.randint(int(run["temperature_brainstorm_min"] * 10), int(run["temperature_brainstorm_max"] * 10)) * 0.1
+
+# --- Structured Output ---
+# The steps whose answers steer the loop (1a pros/cons, 1b the Con to fix, A the approach, the evaluation, the
+# F1-F3 combinations and the synthesis tournament) answer in JSON. The schema goes to Ollama as the call's format,
+# so the model is constrained to it, and the answer is parsed into a typed value. An answer that still doesn't fit
+# is asked for again with the problem named, up to STRUCTURED_OUTPUT_ATTEMPTS times, then the step fails with an
+# LLMError instead of quietly taking a default branch. Each output spec is {"schema", "example", "parse"}; parse gets
+# the JSON object and returns the value or raises ValueError.
+STRUCTURED_OUTPUT_ATTEMPTS = 2
+COMBINATIONS_PER_LOT = 9
+
+def parse_json_answer(text):
+    # The JSON object in an answer, or None while there isn't a complete one. Also finds it inside a ```json fence or
+    # stray text, for servers and recordings that didn't apply the format.
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start: return None
+    try: answer = json.loads(text[start:end + 1])
+    except json.JSONDecodeError: return None
+    return answer if isinstance(answer, dict) else None
+
+def answer_field(answer, field, expected_type):
+    value = answer.get(field)
+    if not isinstance(value, expected_type) or (expected_type is int and isinstance(value, bool)):
+        raise ValueError(f"'{field}' is missing or is not a {expected_type.__name__}")
+    return value
+
+def answer_strings(answer, field):
+    values = answer_field(answer, field, list)
+    if not all(isinstance(value, str) for value in values): raise ValueError(f"'{field}' must be a list of strings")
+    return [value.strip() for value in values if value.strip()]
+
+def parse_pros_cons(answer):
+    pros_cons = {"pros": answer_strings(answer, "pros"), "cons": answer_strings(answer, "cons")}
+    if not pros_cons["cons"]: raise ValueError("no Cons were listed")
+    return pros_cons
+
+def pick_con_output(con_count):
+    # Step 1b answers with the number of a Con from the 1a list; 0 means none of them is actionable.
+    def parse_con_number(answer):
+        con_number = answer_field(answer, "con_number", int)
+        if not 0 <= con_number <= con_count: raise ValueError(f"'con_number' must be from 0 to {con_count}")
+        return con_number
+    return {"schema": {"type": "object", "properties": {"con_number": {"type": "integer", "minimum": 0, "maximum": con_count}}, "required": ["con_number"]},
+            "example": '{"con_number": 2}', "parse": parse_con_number}
+
+def parse_choice(field, choices):
+    def parse(answer):
+        value = answer_field(answer, field, str).strip()
+        matches = [choice for choice in choices if choice.lower() == value.lower()]
+        if not matches: raise ValueError(f"'{field}' must be one of {', '.join(choices)}")
+        return matches[0]
+    return parse
+
+def parse_combinations(answer):
+    combinations = answer_strings(answer, "combinations")
+    if len(combinations) != COMBINATIONS_PER_LOT: raise ValueError(f"expected {COMBINATIONS_PER_LOT} combinations, got {len(combinations)}")
+    return combinations
+
+PROS_CONS_OUTPUT = {
+    "schema": {"type": "object", "properties": {"pros": {"type": "array", "items": {"type": "string"}},
+                                                "cons": {"type": "array", "items": {"type": "string"}, "minItems": 1}}, "required": ["pros", "cons"]},
+    "example": '{"pros": ["<Pro 1>", "<Pro 2>"], "cons": ["<Con 1>", "<Con 2>", "<Con 3>"]}', "parse": parse_pros_cons}
+APPROACH_OUTPUT = {
+    "schema": {"type": "object", "properties": {"approach": {"type": "string", "enum": ["Brainstorm", "Direct Fix"]}}, "required": ["approach"]},
+    "example": '{"approach": "Brainstorm"} or {"approach": "Direct Fix"}', "parse": parse_choice("approach", ("Brainstorm", "Direct Fix"))}
+EVALUATION_OUTPUT = {
+    "schema": {"type": "object", "properties": {"same_or_better": {"type": "boolean"}}, "required": ["same_or_better"]},
+    "example": '{"same_or_better": true} or {"same_or_better": false}', "parse": lambda answer: answer_field(answer, "same_or_better", bool)}
+COMPARISON_OUTPUT = {
+    "schema": {"type": "object", "properties": {"better_version": {"type": "string", "enum": ["A", "B"]}}, "required": ["better_version"]},
+    "example": '{"better_version": "A"} or {"better_version": "B"}', "parse": parse_choice("better_version", ("A", "B"))}
+COMBINATIONS_OUTPUT = {
+    "schema": {"type": "object", "properties": {"combinations": {"type": "array", "items": {"type": "string"},
+                                                                 "minItems": COMBINATIONS_PER_LOT, "maxItems": COMBINATIONS_PER_LOT}}, "required": ["combinations"]},
+    "example": '{"combinations": ["<combination 1>", "<combination 2>", ...]}', "parse": parse_combinations}
+
+def ask_llm_structured(prompt_text, session_memory, output, temperature=None, step="general", document=None):
+    # ask_llm for a structured answer (see above). Returns the parsed value; raises LLMError if there is none.
+    # Re-asks are journaled and cached under their own step labels ("A-retry1"), which use the step's profile.
+    instruction = f"\n\nRespond with JSON only, in this form: {output['example']}"
+    attempt_prompt, attempt_step = prompt_text + instruction, step
+    for attempt in range(1, STRUCTURED_OUTPUT_ATTEMPTS + 1):
+        response_text = ask_llm(attempt_prompt, session_memory, temperature=temperature, step=attempt_step, document=document,
+                                response_format=output["schema"])
+        answer = parse_json_answer(response_text)
+        try:
+            if answer is None: raise ValueError("the answer is not a JSON object")
+            return output["parse"](answer)
+        except ValueError as e:
+            problem = str(e)
+        logging.warning(f"Unusable answer for step {step} (attempt {attempt} of {STRUCTURED_OUTPUT_ATTEMPTS}): {problem}. Answer: {response_text[:150]}")
+        attempt_prompt = (f"{prompt_text}\n\nYOUR PREVIOUS ANSWER COULD NOT BE USED ({problem}):\n'''\n{response_text[:500]}\n'''"
+                          f"{instruction}")
+        attempt_step = f"{step}-retry{attempt}"
+    raise LLMError(f"No usable answer for step {step} after {STRUCTURED_OUTPUT_ATTEMPTS} attempts: {problem}")
+
+def combinations_text(past_number, combinations):
+    # One F1-F3 lot as the step G notes show it, each combination labelled with the ideas it combines.
+    return "".join(f"- [Past {past_number}]+[Concept {index // 3 + 1}]+[Left-Field {index % 3 + 1}]: {combination}\n"
+                   for index, combination in enumerate(combinations))
+
+def pros_cons_text(pros_cons):
+    # The 1a answer as the notes and prompts show it. Cons are numbered for step 1b.
+    return ("PROS:\n" + "".join(f"- {pro}\n" for pro in pros_cons["pros"]) +
+            "CONS:\n" + "".join(f"{number}. {con}\n" for number, con in enumerate(pros_cons["cons"], 1)))
+
+# --- Document Sections ---
+# The paper is handled as a list of sections split at heading lines ("Abstract:", "## 2. Method", "**Conclusion**").
+# In "patch" edit mode the rewrite steps return only the sections they change or add, which are spliced back in,
+# so output tokens scale with the edit rather than with the whole paper.
+SECTION_HEADING_PATTERN = re.compile(r"^(?:#{1,6}\s+\S.*|\*\*[^*\n]{2,120}\*\*:?|TITLE:.*)\s*$")
+COLON_HEADING_PATTERN = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s+)?([A-Z][^\n.!?:]{0,80}):\s*$") # "Abstract:", "3. Main Body:"
+HEADING_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "of", "on", "or", "the", "to", "vs", "with"}
+SECTION_PATCH_FORMAT = (
+    "SECTION PATCH FORMAT - return each changed or new section as one block, and nothing outside the blocks:\n"
+    "@@@ REPLACE: <exact heading line of an existing section>\n"
+    "<the complete new text of that section, starting with its heading line>\n"
+    "@@@ END\n"
+    "@@@ INSERT AFTER: <exact heading line of the existing section it should follow>\n"
+    "<the complete text of the new section, starting with its own new heading line>\n"
+    "@@@ END\n"
+    "Do not return sections you did not change."
+)
+PATCH_BLOCK_PATTERN = re.compile(r"^@@@ (REPLACE|INSERT AFTER):[ \t]*(.*?)[ \t]*\n(.*?)^@@@ END[ \t]*$", re.DOTALL | re.MULTILINE)
+
+def is_section_heading(line):
+    stripped = line.strip()
+    if not stripped or len(stripped.split()) > 12: return False
+    if SECTION_HEADING_PATTERN.match(stripped): return True
+    # Plain "Heading:" lines must be short and title-cased, so "The steps are as follows:" stays body text.
+    colon_heading = COLON_HEADING_PATTERN.match(stripped)
+    if not colon_heading: return False
+    words = colon_heading.group(1).split()
+    return len(words) <= 6 and all(word[0].isupper() or word[0].isdigit() or word.lower() in HEADING_MINOR_WORDS for word in words)
+
+def section_key(heading):
+    # "## 2. Method:" / "**Method**" / "Method:" all map to "method".
+    key = re.sub(r"^[#*\s]+|[*:\s]+$", "", heading.strip())
+    key = re.sub(r"^\d+(?:\.\d+)*\.?\s+", "", key)
+    return normalize_whitespace(key).lower()
+
+def split_document_sections(document):
+    # Returns [{"heading": str, "text": str}]; joining the "text" values gives back the document exactly.
+    # Text before the first heading is a section with an empty heading.
+    sections = [{"heading": "", "text": ""}]
+    for line in document.splitlines(keepends=True):
+        if is_section_heading(line):
+            sections.append({"heading": line.strip(), "text": line})
+        else:
+            sections[-1]["text"] += line
+    return sections if sections[0]["text"] else sections[1:]
+
+def join_document_sections(sections):
+    return "".join(section["text"] for section in sections)
+
+def section_headings_list(document):
+    return "\n".join(f"- {section['heading']}" for section in split_document_sections(document) if section["heading"])
+
+def find_section_index(sections, heading):
+    wanted = section_key(heading)
+    return next((index for index, section in enumerate(sections) if section["heading"] and section_key(section["heading"]) == wanted), None)
+
+def apply_section_patches(document, patch_response):
+    # Returns (patched_document, applied_count, problems). patched_document is None if no patch block could be applied.
+    sections = split_document_sections(document)
+    applied_count, problems = 0, []
+    for operation, target_heading, new_text in PATCH_BLOCK_PATTERN.findall(patch_response):
+        index = find_section_index(sections, target_heading)
+        if index is None:
+            problems.append(f"{operation} target '{target_heading}' not found"); continue
+        new_section = {"heading": "", "text": new_text.strip("\n") + "\n\n"}
+        new_lines = new_text.strip("\n").splitlines()
+        if new_lines and is_section_heading(new_lines[0]):
+            new_section["heading"] = new_lines[0].strip()
+        if operation == "REPLACE":
+            if not new_section["heading"]: # Body only: keep the original heading line
+                new_section = {"heading": sections[index]["heading"], "text": sections[index]["text"].splitlines(keepends=True)[0] + new_section["text"]}
+            sections[index] = new_section
+        else:
+            if not sections[index]["text"].endswith("\n\n"): sections[index]["text"] = sections[index]["text"].rstrip("\n") + "\n\n"
+            sections.insert(index + 1, new_section)
+        applied_count += 1
+    if not applied_count: return None, 0, problems or ["no patch blocks found"]
+    return join_document_sections(sections).rstrip("\n") + "\n", applied_count, problems
+
+def apply_llm_rewrite(run, document, llm_response_text):
+    # Turns a rewrite step's answer into the new full document. Returns (new_document or None, note for the logs).
+    if run["document_edit_mode"] == "patch" and "@@@ " in llm_response_text:
+        patched_document, applied_count, problems = apply_section_patches(document, llm_response_text)
+        note = f"{applied_count} section patch(es) applied" + (f"; skipped: {'; '.join(problems)}" if problems else "")
+        return patched_document, note
+    # Full-text answer (full mode, or the model ignored the patch format); only accept it if it looks like a whole paper.
+    if len(llm_response_text.strip()) > 0.5 * len(document.strip()):
+        return llm_response_text, "full text"
+    return None, "answer is neither a section patch nor a full paper"
+
+# --- Candidate Screening ---
+# Cheap local checks that run before the LLM evaluation, so obviously broken candidates never cost an LLM call.
+# The thresholds are the run's screen_* settings (see build_document_run).
+
+def document_paragraphs(document):
+    return [normalize_whitespace(paragraph) for paragraph in re.split(r"\n\s*\n", document) if paragraph.strip()]
+
+def matching_word_count(original_words, candidate_words):
+    return sum(block.size for block in difflib.SequenceMatcher(None, original_words, candidate_words, autojunk=False).get_matching_blocks())
+
+def document_similarity(original, candidate):
+    # Word-level similarity (0-1, like SequenceMatcher.ratio). Unchanged paragraphs are matched first, which keeps
+    # this fast on long papers (word-level difflib over the whole text is quadratic); each edited paragraph is then
+    # compared word by word with the most alike paragraph it replaced, so a rewrite that touches every paragraph
+    # still scores as mostly the same paper.
+    original_paragraphs, candidate_paragraphs = document_paragraphs(original), document_paragraphs(candidate)
+    total_words = sum(len(paragraph.split()) for paragraph in original_paragraphs + candidate_paragraphs)
+    if not total_words: return 1.0
+    matched_words = 0
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, original_paragraphs, candidate_paragraphs, autojunk=False).get_opcodes():
+        if tag == "equal":
+            matched_words += sum(len(paragraph.split()) for paragraph in original_paragraphs[i1:i2])
+        elif tag == "replace":
+            replaced = [paragraph.split() for paragraph in original_paragraphs[i1:i2]]
+            for candidate_words in (paragraph.split() for paragraph in candidate_paragraphs[j1:j2]):
+                if not replaced: break
+                candidate_set = set(candidate_words)
+                best = max(range(len(replaced)), key=lambda index: len(candidate_set.intersection(replaced[index])))
+                matched_words += matching_word_count(replaced.pop(best), candidate_words)
+    return 2.0 * matched_words / total_words
+
+def screen_candidate(run, original, candidate):
+    # Returns a list of rejection reasons; empty means the candidate should go on to the LLM evaluation.
+    reasons = []
+    original_words, candidate_words = len(original.split()), len(candidate.split())
+    length_ratio = candidate_words / max(1, original_words)
+    if length_ratio < run["screen_min_length_ratio"]: reasons.append(f"shrank to {length_ratio:.0%} of the original length")
+    if length_ratio > run["screen_max_length_ratio"]: reasons.append(f"grew to {length_ratio:.1f}x the original length")
+    candidate_keys = {section_key(section["heading"]) for section in split_document_sections(candidate) if section["heading"]}
+    lost_headings = [section["heading"] for section in split_document_sections(original) if section["heading"] and section_key(section["heading"]) not in candidate_keys]
+    if len(lost_headings) > run["screen_max_lost_sections"]: reasons.append(f"lost sections: {', '.join(lost_headings)}")
+    # Paragraphs (of any real length) that now appear more often than they did in the original.
+    original_counts = collections.Counter(paragraph for paragraph in document_paragraphs(original) if len(paragraph) > 80)
+    candidate_counts = collections.Counter(paragraph for paragraph in document_paragraphs(candidate) if len(paragraph) > 80)
+    duplicated = sum(count - max(1, original_counts[paragraph]) for paragraph, count in candidate_counts.items() if count > max(1, original_counts[paragraph]))
+    if duplicated: reasons.append(f"{duplicated} duplicated paragraph(s)")
+    similarity = document_similarity(original, candidate)
+    if similarity < run["screen_min_similarity"]: reasons.append(f"only {similarity:.0%} similar to the original")
+    if similarity > run["screen_max_similarity"]: reasons.append("no meaningful change from the original")
+    return reasons
+
+def compact_section_diff(original, candidate):
+    # The changed, added and removed sections of candidate, for an evaluation prompt that already holds the original.
+    # Returns None when a section diff would not be smaller than the candidate itself.
+    original_sections = {section_key(section["heading"]): section for section in split_document_sections(original)}
+    candidate_sections = split_document_sections(candidate)
+    candidate_keys = {section_key(section["heading"]) for section in candidate_sections}
+    diff_parts = []
+    for section in candidate_sections:
+        original_section = original_sections.get(section_key(section["heading"]))
+        if original_section is not None and normalize_whitespace(original_section["text"]) == normalize_whitespace(section["text"]):
+            continue
+        label = f"REVISED SECTION '{section['heading'] or '(opening text)'}'" if original_section is not None else f"NEW SECTION '{section['heading']}'"
+        diff_parts.append(f"{label}:\n'''\n{section['text'].strip()}\n'''")
+    removed = [section["heading"] for key, section in original_sections.items() if section["heading"] and key not in candidate_keys]
+    if removed: diff_parts.append(f"REMOVED SECTIONS: {', '.join(removed)}")
+    diff_text = "\n\n".join(diff_parts)
+    return diff_text if diff_parts and len(diff_text) < len(candidate) else None
+
+# --- Context View ---
+# The steps that only read the paper (the 1a critique and the step A decision) get a condensed view once it is long:
+# every section's heading with a short LLM summary, plus the section the chosen Con is about in full. Summaries are
+# kept per section content hash in <document>_summaries.jsonl next to the backups, so after a patch only the changed
+# sections are summarized again and the view stays about the same size however long the paper grows. The rewrite
+# and evaluation steps still get the full text, which they edit or judge.
+SECTION_SUMMARY_TEMPERATURE = 0.2 # Low, so the LLM response cache can reuse summaries too
+CONTEXT_VIEW_NOTE = ("[Condensed view of the paper: each section is given as its heading and a summary. "
+                     "Sections marked FULL TEXT are given verbatim.]")
+FOCUS_STOPWORDS = {"about", "after", "also", "being", "between", "could", "does", "from", "have", "into", "lacks", "more", "most",
+                   "need", "needs", "paper", "should", "section", "than", "that", "their", "there", "these", "this", "what",
+                   "which", "while", "with", "would"}
+
+def load_section_summaries(run):
+    if run["section_summaries"] is not None: return run["section_summaries"]
+    run["section_summaries"] = {}
+    if os.path.exists(run["section_summaries_path"]):
+        try:
+            with open(run["section_summaries_path"], "r", encoding="utf-8") as f_summaries:
+                for line in f_summaries:
+                    try: record = json.loads(line)
+                    except json.JSONDecodeError: continue # Torn last line
+                    run["section_summaries"][record["sha256"]] = record["summary"]
+        except Exception as e:
+            logging.error(f"Could not read section summaries '{run['section_summaries_path']}': {e}")
+    return run["section_summaries"]
+
+def store_section_summary(run, section_hash, summary):
+    run["section_summaries"][section_hash] = summary
+    try:
+        with open(run["section_summaries_path"], "a", encoding="utf-8") as f_summaries:
+            f_summaries.write(json.dumps({"sha256": section_hash, "summary": summary, "time": time.time()}, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logging.error(f"Could not save a section summary to '{run['section_summaries_path']}': {e}")
+
+def summarize_sections(session_memory, sections):
+    # Returns {section hash: summary} for the sections long enough to be worth summarizing, asking the LLM only for
+    # hashes not summarized before. A section whose summary fails is left out, so it is shown in full.
+    run = session_memory['run']
+    summaries = load_section_summaries(run)
+    wanted = {sha256_text(section["text"]): section for section in sections if len(section["text"].split()) >= run["section_summary_min_words"]}
+    missing = [(section_hash, section) for section_hash, section in wanted.items() if section_hash not in summaries]
+    if missing:
+        logging.info(f"Summarizing {len(missing)} new or changed section(s) for the condensed paper view.")
+        # Summaries are resumed from their own store, not from the step journal (one journal entry per step name).
+        summary_memory = {**session_memory, 'resumed_steps': {}}
+        responses = ask_llm_batch([(
+            f"Summarize this section of the research paper '{run['document_title']}' in at most {run['section_summary_words']} words. "
+            f"Keep its key claims, proposed methods, numbers and named concepts. Respond with the summary only.\n\n"
+            f"SECTION:\n'''\n{section['text'].strip()}\n'''", SECTION_SUMMARY_TEMPERATURE, "summary") for _, section in missing], summary_memory)
+        for (section_hash, _), response in zip(missing, responses):
+            if isinstance(response, LLMError) or not response.strip():
+                logging.warning(f"Section summary failed ({str(response)[:100]}); the section is shown in full.")
+            else:
+                store_section_summary(run, section_hash, response.strip())
+    return {section_hash: summaries[section_hash] for section_hash in wanted if section_hash in summaries}
+
+def focus_words(text):
+    return {word for word in re.findall(r"[a-z][a-z'-]{3,}", text.lower()) if word not in FOCUS_STOPWORDS}
+
+def find_focus_section(sections, focus_text):
+    # Index of the section that shares the most words with focus_text (heading words count three times), or None.
+    wanted = focus_words(focus_text)
+    scores = [3 * len(wanted & focus_words(section["heading"])) + len(wanted & focus_words(section["text"])) for section in sections]
+    best_score = max(scores, default=0)
+    return scores.index(best_score) if best_score > 0 else None
+
+def document_context_view(session_memory, document, focus_text=None):
+    # The paper as the read-only steps should see it: in full while it is short, otherwise condensed (see above).
+    run = session_memory['run']
+    if len(document.split()) < run["context_view_min_words"]: return document
+    sections = split_document_sections(document)
+    summaries = summarize_sections(session_memory, sections)
+    focus_index = find_focus_section(sections, focus_text) if focus_text else None
+    view_parts = [CONTEXT_VIEW_NOTE]
+    for index, section in enumerate(sections):
+        summary = summaries.get(sha256_text(section["text"]))
+        if index == focus_index or summary is None:
+            view_parts.append(f"{'[FULL TEXT] ' if index == focus_index else ''}{section['text'].strip()}")
+        else:
+            view_parts.append(f"{section['heading'] or '(untitled opening)'}\n(summary) {summary}")
+    context_view = "\n\n".join(view_parts)
+    focus_note = f" (full text of: {sections[focus_index]['heading'] or 'the opening'})" if focus_index is not None else ""
+    logging.info(f"Condensed paper view: {len(context_view.split())} words instead of {len(document.split())}{focus_note}.")
+    return context_view
+
+def ask_llm_on_context_view(prompt_text, document, session_memory, output, focus_text=None, **kwargs):
+    # ask_llm_structured with the context view of document, built in the calling thread (it may need summary calls).
+    return ask_llm_structured(prompt_text, session_memory, output, document=document_context_view(session_memory, document, focus_text), **kwargs)
+
+# --- Best-of-N Synthesis ---
+# With synthesis_candidates above 1, the final synthesis is asked for that many times at once from the same NOTES, at
+# temperatures spread across the brainstorm range. Candidates that fail or don't pass the local screening drop out,
+# and the rest meet in a knockout tournament of pairwise comparisons, each sent as the two versions' section diffs
+# against the CURRENT DOCUMENT. Only the winner goes on to the usual evaluation, so one set of notes gets
+# several tries at an accepted improvement.
+def usable_synthesis(run, original_document, synthesis_response):
+    # The full document a synthesis answer produces, or None if it doesn't give a usable one.
+    patched_version, synthesis_note = apply_llm_rewrite(run, original_document, synthesis_response)
+    logging.info(f"Synthesis result: {synthesis_note}.")
+    if patched_version is None or len(patched_version.strip()) < 100: return None
+    return patched_version
+
+def synthesis_candidate_temperatures(run):
+    count, low, high = run["synthesis_candidates"], run["temperature_brainstorm_min"], run["temperature_brainstorm_max"]
+    return [round(low + (high - low) * index / (count - 1), 2) for index in range(count)]
+
+def candidate_comparison_prompt(original_document, identified_problem, candidate_a, candidate_b):
+    def version_block(label, candidate):
+        changes_text = compact_section_diff(original_document, candidate)
+        if changes_text is not None:
+            return f"VERSION {label} - CHANGES (sections not listed are identical to the CURRENT DOCUMENT):\n{changes_text}"
+        return f"VERSION {label} - FULL TEXT:\n'''\n{candidate}\n'''"
+    return (f"IDENTIFIED PROBLEM:\n'''\n{identified_problem}\n'''\n\n"
+            f"{version_block('A', candidate_a)}\n\n{version_block('B', candidate_b)}\n\n"
+            f"COMPARISON TASK: Versions A and B are two revisions of the CURRENT DOCUMENT that try to address the IDENTIFIED PROBLEM.\n"
+            f"Which one is the better research paper: it addresses the problem more convincingly, adds more depth and more novel, actionable ideas, and stays coherent?")
+
+def best_synthesis_candidate(session_memory, synthesis_prompt_text):
+    # Returns the tournament winner, or None if no candidate produced a usable document.
+    run = session_memory['run']
+    original_document = session_memory['original_document_for_iteration']
+    temperatures = synthesis_candidate_temperatures(run)
+    print(f"\n{'='*5} FINAL SYNTHESIS STEP!!! Asking LLM: Synthesize {len(temperatures)} candidate papers for this iteration (temperatures {', '.join(map(str, temperatures))}). {'='*5}")
+    responses = ask_llm_batch([(synthesis_prompt_text, temperature, "synthesis" if index == 0 else f"synthesis-{index + 1}", original_document)
+                               for index, temperature in enumerate(temperatures)], session_memory)
+    usable, contenders = [], []
+    for index, response in enumerate(responses):
+        if isinstance(response, LLMError):
+            logging.info(f"Synthesis candidate {index + 1} dropped: {response}"); continue
+        candidate = usable_synthesis(run, original_document, response)
+        if candidate is None:
+            logging.info(f"Synthesis candidate {index + 1} dropped: no usable document."); continue
+        usable.append(candidate)
+        screen_reasons = screen_candidate(run, original_document, candidate)
+        if screen_reasons:
+            logging.info(f"Synthesis candidate {index + 1} dropped by pre-screening: {'; '.join(screen_reasons)}."); continue
+        contenders.append((index + 1, candidate))
+    if not usable: return None
+    if not contenders: return usable[0] # The regular pre-screening rejects it and logs why
+    logging.info(f"Synthesis candidates in the tournament: {', '.join(str(number) for number, _ in contenders)}.")
+
+    comparison_count = 0
+    while len(contenders) > 1:
+        pairs = [(contenders[position], contenders[position + 1]) for position in range(0, len(contenders) - 1, 2)]
+        comparison_requests = []
+        for (_, candidate_a), (_, candidate_b) in pairs:
+            comparison_count += 1
+            comparison_requests.append((candidate_comparison_prompt(original_document, session_memory['identified_problem'], candidate_a, candidate_b),
+                                        run['temperature_general'], f"compare-{comparison_count}", original_document, COMPARISON_OUTPUT))
+        print(f"\n{'='*5} TOURNAMENT ROUND!!! Asking LLM: Compare {len(pairs)} pair(s) of synthesis candidates. {'='*5}")
+        verdicts = ask_llm_batch(comparison_requests, session_memory)
+        winners = []
+        for ((number_a, candidate_a), (number_b, candidate_b)), verdict in zip(pairs, verdicts):
+            if isinstance(verdict, LLMError): logging.warning(f"No usable verdict comparing candidates {number_a} and {number_b} ({verdict}); keeping {number_a}.")
+            winners.append((number_b, candidate_b) if verdict == "B" else (number_a, candidate_a))
+            logging.info(f"Tournament: candidate {number_a} vs {number_b} -> {winners[-1][0]}.")
+        contenders = winners + contenders[2 * len(pairs):] # An odd one out goes through to the next round
+    print(f"Synthesis candidate {contenders[0][0]} won the tournament.")
+    logging.info(f"Synthesis candidate {contenders[0][0]} won the tournament ({comparison_count} comparison(s)).")
+    return contenders[0][1]
 
 # --- Document Handling ---
-def load_document(file_path):
+def load_document(file_path, document_title):
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
     except FileNotFoundError:
         logging.warning(f"Document '{file_path}' not found. Creating a default one.")
-        default_content = f"TITLE: {DOCUMENT_TITLE}\n\nAbstract:\nAIs are known for being exceptionally inefficient at coming up with plausible and valid novel ideas. They are either just wrong and hallucinating or they are sticking to the strict consistency of their training data. But what if we could get it using human processes to generate ideas, save the best, and improve the ideas over and over autonomously? This document will explore the concept and potential of an AI agent designed to iteratively refine research papers and brainstorm novel solutions to complex problems.\n\nIntroduction:\nHuman beings have processes they use to solve problems. Businesses use these processes to help their teams of workers solve problems. Currently, LLMs require a human being to type in the prompts for the LLM. But more and more people are building autonomous agents that can work on something without human intervention, the Agent going through step by step to accomplish a goal. What if the goal is novel research? How could we make a super basic Python agent that iteratively improves any problem areas of a research paper with brainstorming, like putting 2 and 2 together to get something totally new? What would it look like? How would it work? What sort of libraries should it use and how should it be set up? And based on that, what sort of things could it accomplish and how could it impact the world?"
+        default_content = f"TITLE: {document_title}\n\nAbstract:\nAIs are known for being exceptionally inefficient at coming up with plausible and valid novel ideas. They are either just wrong and hallucinating or they are sticking to the strict consistency of their training data. But what if we could get it using human processes to generate ideas, save the best, and improve the ideas over and over autonomously? This document will explore the concept and potential of an AI agent designed to iteratively refine research papers and brainstorm novel solutions to complex problems.\n\nIntroduction:\nHuman beings have processes they use to solve problems. Businesses use these processes to help their teams of workers solve problems. Currently, LLMs require a human being to type in the prompts for the LLM. But more and more people are building autonomous agents that can work on something without human intervention, the Agent going through step by step to accomplish a goal. What if the goal is novel research? How could we make a super basic Python agent that iteratively improves any problem areas of a research paper with brainstorming, like putting 2 and 2 together to get something totally new? What would it look like? How would it work? What sort of libraries should it use and how should it be set up? And based on that, what sort of things could it accomplish and how could it impact the world?"
         if save_document(file_path, default_content): return default_content
-        else: return f"Error: Could not create default document at {file_path}."
+        logging.error(f"Could not create default document at {file_path}."); return None
     except Exception as e:
-        logging.error(f"Error loading document '{file_path}': {e}"); return f"Error loading document: {e}"
+        logging.error(f"Error loading document '{file_path}': {e}"); return None
 
 def save_document(file_path, content):
     try:
@@ -176,84 +1454,555 @@ def save_document(file_path, content):
         logging.info(f"Document saved to '{file_path}'."); return True
     except Exception as e: logging.error(f"Error saving document '{file_path}': {e}"); return False
 
-def manage_backups(file_path):
+# --- Backup Store ---
+# Every accepted version is kept in <document>_versions/ next to the other backups: zlib-compressed objects named by
+# the hash of the version they produce, plus index.jsonl with one line per version (version, time, sha256, the step
+# that accepted it). Most versions are stored as a line delta against the version before them; every
+# backup_full_snapshot_every versions (and whenever the predecessor doesn't match) a full copy is stored instead, so
+# rebuilding any version applies at most that many deltas. Nothing is ever deleted, and startup reads the index
+# instead of listing the directory.
+def load_backup_index(run):
+    if not os.path.exists(run["backup_index_path"]): return []
+    backup_index = []
     try:
-        backups = sorted(
-            [os.path.join(BACKUP_DIR, f) for f in os.listdir(BACKUP_DIR) if f.startswith(os.path.splitext(os.path.basename(file_path))[0] + "_v")],
-            key=os.path.getmtime
-        )
-        while len(backups) >= MAX_BACKUP_FILES: 
-            oldest_backup = backups.pop(0)
-            os.remove(oldest_backup)
-            logging.info(f"Removed oldest backup: {oldest_backup} (limit {MAX_BACKUP_FILES}).")
-    except Exception as e: logging.error(f"Error managing backups: {e}")
-
-def backup_document(file_path, version_counter):
-    manage_backups(file_path)
-    base_filename = os.path.basename(file_path)
-    name_part, ext_part = os.path.splitext(base_filename)
-    backup_file_name = f"{name_part}_v{version_counter}{ext_part if ext_part else '.txt'}"
-    backup_full_path = os.path.join(BACKUP_DIR, backup_file_name)
+        with open(run["backup_index_path"], "r", encoding="utf-8") as f_index:
+            for line in f_index:
+                try: backup_index.append(json.loads(line))
+                except json.JSONDecodeError: logging.warning("Ignoring a torn record at the end of the backup index.")
+    except Exception as e:
+        logging.error(f"Could not read backup index '{run['backup_index_path']}': {e}")
+    return backup_index
+
+def legacy_backup_version(run):
+    # Highest N among the <document>_vN.txt full-copy backups written before the backup store existed.
+    version_numbers = []
+    try:
+        for f_name in os.listdir(run["backup_dir"]):
+            legacy_match = re.match(re.escape(os.path.splitext(os.path.basename(run["document_path"]))[0]) + r"_v(\d+)\.", f_name)
+            if legacy_match: version_numbers.append(int(legacy_match.group(1)))
+    except Exception as e: logging.error(f"Could not scan for old backups: {e}")
+    return max(version_numbers, default=None)
+
+def encode_line_delta(base_document, document):
+    # Lines of document as ["=", start, end] (copy base lines start:end) and ["+", [lines]] (new lines) operations.
+    base_lines, lines = base_document.splitlines(keepends=True), document.splitlines(keepends=True)
+    operations = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+        if tag == "equal": operations.append(["=", i1, i2])
+        elif j2 > j1: operations.append(["+", lines[j1:j2]])
+    return json.dumps(operations, ensure_ascii=False)
+
+def apply_line_delta(base_document, delta):
+    base_lines = base_document.splitlines(keepends=True)
+    return "".join("".join(base_lines[operation[1]:operation[2]]) if operation[0] == "=" else "".join(operation[1]) for operation in json.loads(delta))
+
+def write_backup_object(run, object_name, text):
+    object_path = os.path.join(run["backup_objects_dir"], object_name)
+    if os.path.exists(object_path): return # Same content already stored
+    with open(object_path + ".tmp", "wb") as f_object:
+        f_object.write(zlib.compress(text.encode("utf-8"), 9))
+        f_object.flush()
+        os.fsync(f_object.fileno())
+    os.replace(object_path + ".tmp", object_path)
+
+def read_backup_object(run, object_name):
+    with open(os.path.join(run["backup_objects_dir"], object_name), "rb") as f_object:
+        return zlib.decompress(f_object.read()).decode("utf-8")
+
+def backup_document(run, document_content, version_number, step_info, base_document=None):
+    # Adds document_content to the store as version_number; step_info (dict) records what accepted it.
+    # base_document is the version before it, if the caller has it, which lets the version be stored as a delta.
+    backup_index = run["backup_index"]
+    document_hash = sha256_text(document_content)
+    record = {"version": version_number, "time": time.time(), "sha256": document_hash, **step_info}
+    try:
+        os.makedirs(run["backup_objects_dir"], exist_ok=True)
+        previous = backup_index[-1] if backup_index else None
+        same_content = next((r for r in reversed(backup_index) if r["sha256"] == document_hash), None)
+        if same_content is not None:
+            record.update(object=same_content["object"], base_version=same_content.get("base_version"), chain=same_content["chain"])
+        elif (previous is not None and base_document is not None and previous["sha256"] == sha256_text(base_document)
+              and previous["chain"] + 1 < run["backup_full_snapshot_every"]):
+            record.update(object=f"{document_hash}.{previous['sha256'][:16]}.delta.z", base_version=previous["version"], chain=previous["chain"] + 1)
+            write_backup_object(run, record["object"], encode_line_delta(base_document, document_content))
+        else:
+            record.update(object=f"{document_hash}.full.z", base_version=None, chain=0)
+            write_backup_object(run, record["object"], document_content)
+        with open(run["backup_index_path"], "a", encoding="utf-8") as f_index:
+            f_index.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f_index.flush()
+            os.fsync(f_index.fileno())
+        backup_index.append(record)
+        logging.info(f"Backup created: version {version_number} ({'full copy' if record['chain'] == 0 else 'delta'}, {record['object']}).")
+        return True
+    except Exception as e:
+        logging.error(f"Error backing up version {version_number} of '{run['document_path']}': {e}")
+        return False
+
+def reconstruct_version(run, version_number):
+    # Returns the text of a stored version, or None if it isn't in the store (or fails its hash check).
+    records_by_version = {record["version"]: record for record in run["backup_index"]}
+    chain = []
+    record = records_by_version.get(version_number)
+    while record is not None:
+        chain.append(record)
+        if record["object"].endswith(".full.z"): break
+        record = records_by_version.get(record["base_version"])
+    if not chain or not chain[-1]["object"].endswith(".full.z"):
+        logging.error(f"Version {version_number} is not in the backup store (or its full copy is missing)."); return None
+    try:
+        document_content = read_backup_object(run, chain[-1]["object"])
+        for record in reversed(chain[:-1]):
+            document_content = apply_line_delta(document_content, read_backup_object(run, record["object"]))
+    except Exception as e:
+        logging.error(f"Could not rebuild version {version_number}: {e}"); return None
+    if sha256_text(document_content) != chain[0]["sha256"]:
+        logging.error(f"Rebuilt version {version_number} does not match its recorded hash."); return None
+    return document_content
+
+def open_backup_store(run, document_content):
+    # Loads the index into the run and makes sure the document as it is now is the latest version. Returns that version.
+    run["backup_index"] = load_backup_index(run)
+    if run["backup_index"]:
+        version_number = run["backup_index"][-1]["version"]
+        if run["backup_index"][-1]["sha256"] == sha256_text(document_content): return version_number
+        step_info = {"step": "external edit"} # The document file was changed outside the loop since the last version
+    else:
+        legacy_version = legacy_backup_version(run)
+        version_number = -1 if legacy_version is None else legacy_version # Keep numbering clear of the old _vN files
+        step_info = {"step": "initial"}
+    backup_document(run, document_content, version_number + 1, step_info)
+    return version_number + 1
+
+# --- Step Journal ---
+# Every finished step's output is appended to a journal next to the backups, so an iteration interrupted by a crash
+# or an Ollama restart resumes at its first unfinished step instead of starting over. The journal only ever holds the
+# current iteration: it is reset when the next one starts, because by then the document file is the checkpoint.
+# Each document run has its own journal (run["journal_path"]); journal_fsync_every sets the records per fsync, and each
+# record is still flushed to the OS straight away.
+def journal_write(run, record, force_sync=False):
+    journal_state, journal_path = run["journal_state"], run["journal_path"]
+    with run["journal_lock"]:
+        try:
+            if journal_state["file"] is None:
+                journal_state["file"] = open(journal_path, "a", encoding="utf-8")
+            f_journal = journal_state["file"]
+            f_journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f_journal.flush()
+            journal_state["unsynced_records"] += 1
+            if force_sync or journal_state["unsynced_records"] >= run["journal_fsync_every"]:
+                os.fsync(f_journal.fileno())
+                journal_state["unsynced_records"] = 0
+        except Exception as e:
+            logging.error(f"Failed to write step journal '{journal_path}': {e}")
+
+def journal_begin_iteration(run, iteration, document_content):
+    journal_state = run["journal_state"]
+    with run["journal_lock"]:
+        try:
+            if journal_state["file"] is not None: journal_state["file"].close()
+            journal_state["file"] = open(run["journal_path"], "w", encoding="utf-8")
+            journal_state["unsynced_records"] = 0
+        except Exception as e:
+            logging.error(f"Failed to reset step journal '{run['journal_path']}': {e}")
+    journal_write(run, {"type": "iteration_start", "iteration": iteration, "doc_hash": sha256_text(document_content), "time": time.time()}, force_sync=True)
+
+def journal_end_iteration(run, iteration, outcome):
+    journal_write(run, {"type": "iteration_end", "iteration": iteration, "outcome": outcome, "time": time.time()}, force_sync=True)
+
+def journal_step(session_memory, step, output):
+    speculation = session_memory.get('speculation')
+    if speculation is not None: # Journaled only if the speculative result gets used (see adopt_speculation)
+        speculation["steps"].append((step, output)); return
+    journal_write(session_memory['run'], {"type": "step", "iteration": session_memory.get('current_iteration'), "step": step, "output": output})
+
+def load_journal_for_resume(run, document_content):
+    # Returns {step: output} for an unfinished iteration that started from this exact document, else {}.
+    journal_path = run["journal_path"]
+    if not os.path.exists(journal_path): return {}
+    records = []
+    try:
+        with open(journal_path, "r", encoding="utf-8") as f_journal:
+            for line in f_journal:
+                try: records.append(json.loads(line))
+                except json.JSONDecodeError: logging.warning("Ignoring a torn record at the end of the step journal.")
+    except Exception as e:
+        logging.error(f"Could not read step journal '{journal_path}': {e}"); return {}
+    if not records or records[0].get("type") != "iteration_start" or any(r.get("type") == "iteration_end" for r in records):
+        return {}
+    if records[0].get("doc_hash") != sha256_text(document_content):
+        logging.info("Step journal belongs to a different document version. Not resuming from it.")
+        return {}
+    return {r["step"]: r["output"] for r in records if r.get("type") == "step"}
+
+# --- Speculative Execution ---
+# With speculative_execution on, work that depends on a pending verdict starts before the verdict arrives: the first
+# step of both paths (step 2 and the C/D/E brainstorm) while step A decides between them, and the next iteration's
+# 1a critique on the candidate while it is evaluated. This only helps when the server has LLM slots to spare. The
+# result that turns out not to be needed is cancelled: a call still waiting for a slot never runs, and a streaming
+# call stops at its next chunk. Speculative calls are journaled only once their result is used. The time and tokens
+# spent on discarded work are reported at the end of the session.
+def new_speculation_stats():
+    return {"started": 0, "used": 0, "discarded": 0, "used_seconds": 0.0, "hidden_seconds": 0.0,
+            "wasted_calls": 0, "wasted_seconds": 0.0, "wasted_output_tokens": 0}
+
+def start_speculation(session_memory, kind, work, *args, **kwargs):
+    # Runs work(*args, session_memory=..., **kwargs) (ask_llm, ask_llm_batch, ...) in the background on a copy of
+    # session_memory and returns the speculation handle for adopt_speculation / discard_speculation.
+    run = session_memory['run']
+    speculation = {"kind": kind, "cancel_event": threading.Event(), "steps": [], "calls": 0, "seconds": 0.0,
+                   "output_tokens": 0, "started_at": time.monotonic(), "future": None}
+    if run["speculation_executor"] is None:
+        run["speculation_executor"] = ThreadPoolExecutor(max_workers=3, thread_name_prefix=f"{run['name']}-llm-speculative")
+    speculation["future"] = run["speculation_executor"].submit(work, *args, session_memory={**session_memory, 'speculation': speculation}, **kwargs)
+    with telemetry_lock: run["speculation_stats"]["started"] += 1
+    logging.info(f"Speculatively started: {kind}.")
+    return speculation
+
+def adopt_speculation(session_memory, speculation):
+    # Waits for a speculation whose result is needed after all and returns that result.
+    # Raises the work's LLMError if it failed.
+    waited_from = time.monotonic()
+    try:
+        return speculation["future"].result()
+    finally:
+        for step, output in speculation["steps"]:
+            journal_step(session_memory, step, output)
+        stats = session_memory['run']["speculation_stats"]
+        with telemetry_lock:
+            stats["used"] += 1
+            stats["used_seconds"] += speculation["seconds"]
+            stats["hidden_seconds"] += waited_from - speculation["started_at"] # Time it ran before the pipeline needed it
+        logging.info(f"Using speculative result: {speculation['kind']} (waited {time.monotonic() - waited_from:.1f}s for it).")
+
+def discard_speculation(run, speculation):
+    # Cancels a speculation that is no longer needed. Its cost is counted once its calls have stopped.
+    if speculation is None: return
+    speculation["cancel_event"].set()
+    def count_waste(_):
+        with telemetry_lock:
+            stats = run["speculation_stats"]
+            stats["discarded"] += 1
+            stats["wasted_calls"] += speculation["calls"]
+            stats["wasted_seconds"] += speculation["seconds"]
+            stats["wasted_output_tokens"] += speculation["output_tokens"]
+    speculation["future"].add_done_callback(count_waste)
+    logging.info(f"Discarding speculative work: {speculation['kind']}.")
+
+def finish_speculations(run):
+    # Waits for cancelled speculative calls to stop, so their cost is in the stats.
+    if run["speculation_executor"] is not None:
+        run["speculation_executor"].shutdown(wait=True)
+        run["speculation_executor"] = None
+
+def speculation_summary(run):
+    with telemetry_lock:
+        stats = dict(run["speculation_stats"])
+    return (f"Speculative execution: {stats['started']} started, {stats['used']} used (ran {stats['hidden_seconds']:.1f}s ahead of need), "
+            f"{stats['discarded']} discarded. Wasted: {stats['wasted_calls']} LLM call(s), {stats['wasted_seconds']:.1f}s of generation, "
+            f"{stats['wasted_output_tokens']} output tokens.")
+
+# --- Con Memory ---
+# Every chosen Con is remembered with how its iteration ended, as an embedding in <document>_con_memory.jsonl next to
+# the backups. When step 1b picks a Con that is nearly the same (cosine similarity of at least con_memory_similarity)
+# as one already worked on, 1b is asked again with the closest past Cons listed as already tried; if the second pick is
+# a repeat too, the iteration is skipped instead of running the whole brainstorm and synthesis on an old problem.
+# The memory is small (one entry per iteration), so a brute-force search in plain Python is fast enough.
+# Every check is logged as a "con_memory" record in the convo log, which is what replay mode goes by.
+CON_OUTCOME_NOTES = {"accepted": "addressed - the revision was accepted", "reverted": "tried - the revision was rejected"}
+CON_MEMORY_RECALL = 5 # Past Cons listed as already tried when 1b is asked again
+
+def embed_texts(run, texts):
+    # Embeddings for texts from the host pool, or None if they could not be made (e.g. the model isn't pulled).
+    with llm_slot(run["name"]):
+        host = acquire_ollama_host(run["name"])
+        if host is None: return None
+        try:
+            response = host["client"].embed(model=run["con_memory_model"], input=texts, keep_alive=OLLAMA_KEEP_ALIVE)
+        except Exception as e:
+            if is_ollama_host_error(e):
+                release_ollama_host(host, run["name"], error=e)
+                logging.warning(f"Embedding call failed on host '{host['name']}': {e}"); return None
+            release_ollama_host(host, run["name"], served=False)
+            logging.warning(f"Embedding with '{run['con_memory_model']}' failed: {e}"); return None
+        release_ollama_host(host, run["name"], served=False)
+    return [normalize_vector(embedding) for embedding in response["embeddings"]]
+
+def normalize_vector(vector):
+    length = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / length for value in vector]
+
+def load_con_memory(run):
+    if run["con_memory"] is not None: return run["con_memory"]
+    run["con_memory"] = []
+    if os.path.exists(run["con_memory_path"]):
+        try:
+            with open(run["con_memory_path"], "r", encoding="utf-8") as f_memory:
+                for line in f_memory:
+                    try: record = json.loads(line)
+                    except json.JSONDecodeError: continue # Torn last line
+                    if record.get("model") == run["con_memory_model"]: # Vectors from another model aren't comparable
+                        record["embedding"] = normalize_vector(record["embedding"])
+                        run["con_memory"].append(record)
+        except Exception as e:
+            logging.error(f"Could not read con memory '{run['con_memory_path']}': {e}")
+    return run["con_memory"]
+
+def similar_past_cons(run, embedding, limit=CON_MEMORY_RECALL):
+    # [(similarity, record)] for the most similar remembered Cons, most similar first.
+    scored = [(sum(a * b for a, b in zip(embedding, record["embedding"])), record) for record in load_con_memory(run)]
+    return sorted(scored, key=lambda item: item[0], reverse=True)[:limit]
+
+def con_memory_decision_prompt(con_text):
+    # What a recorded con memory decision is filed under in the replay cache.
+    return f"CON MEMORY CHECK:\n{con_text}"
+
+def check_con_against_memory(session_memory, con_text):
+    # Embeds the chosen Con and returns the similar past Cons if it repeats one, else []. Turns itself off for the
+    # rest of the run if embeddings can't be made. Each decision goes to the convo log, and replay follows those
+    # instead of embedding (the embeddings aren't recorded).
+    run = session_memory['run']
+    session_memory['con_embedding'] = None
+    if not run["con_memory_enabled"]: return []
+    if LLM_CACHE_MODE == "replay":
+        prompt_key = sha256_text(f"{run['llm_model']}\n{con_memory_decision_prompt(con_text)}")
+        recorded_decision = llm_cache_lookup(prompt_key, prompt_key, 0.0)
+        if recorded_decision is None:
+            logging.warning(f"Replay: no recorded con memory decision for this Con, treating it as new: {con_text[:150]}")
+            return []
+        similar = [(past["similarity"], past) for past in json.loads(recorded_decision)]
+    else:
+        embeddings = embed_texts(run, [con_text])
+        if embeddings is None:
+            logging.warning(f"Con memory is off for this run: no embeddings from '{run['con_memory_model']}' (is it pulled? 'ollama pull {run['con_memory_model']}').")
+            run["con_memory_enabled"] = False
+            return []
+        session_memory['con_embedding'] = embeddings[0]
+        similar = similar_past_cons(run, embeddings[0])
+        if not similar or similar[0][0] < run["con_memory_similarity"]: similar = []
+    write_con_memory_log(session_memory, con_text, similar)
+    if similar:
+        logging.info(f"Chosen Con repeats one from iteration {similar[0][1]['iteration']} (similarity {similar[0][0]:.2f}, {similar[0][1]['outcome']}): {similar[0][1]['con']}")
+    return similar
+
+def already_tried_note(similar):
+    return ("\n\nALREADY TRIED: these problems were worked on in earlier iterations. Do NOT pick any of them, or a rewording of them; "
+            "pick the number of a different Con from your list, or 0 if none is left:\n" +
+            "".join(f"- {record['con']} ({CON_OUTCOME_NOTES.get(record['outcome'], 'tried - no usable revision')})\n" for _, record in similar))
+
+def remember_con(session_memory, outcome):
+    # Adds this iteration's chosen Con and its outcome to the con memory.
+    run = session_memory['run']
+    if session_memory.get('con_embedding') is None: return
+    record = {"time": time.time(), "iteration": session_memory.get('current_iteration'), "con": session_memory['identified_problem'],
+              "outcome": outcome, "model": run["con_memory_model"], "embedding": session_memory['con_embedding']}
+    load_con_memory(run).append(record)
+    session_memory['con_embedding'] = None
     try:
-        if not os.path.exists(file_path): logging.error(f"Cannot backup, source '{file_path}' missing."); return False
-        shutil.copy2(file_path, backup_full_path)
-        logging.info(f"Backup created: '{backup_full_path}'"); return True
-    except Exception as e: logging.error(f"Error creating backup for '{file_path}': {e}"); return False
+        with open(run["con_memory_path"], "a", encoding="utf-8") as f_memory:
+            f_memory.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logging.error(f"Could not save to con memory '{run['con_memory_path']}': {e}")
+
+# --- Convergence ---
+# Watches the last convergence_window iterations for a plateau: too few accepted versions, or a paper that has
+# neither changed nor grown much since the start of the window. On a plateau the loop first drops to Direct Fix only
+# (no step A, no brainstorm), and stops if the next full window plateaus as well ("reduce_then_stop"); "reduce" and
+# "stop" take only one of those actions, "off" never acts. The reasons are logged.
+CONVERGENCE_ACTIONS = ("reduce_then_stop", "reduce", "stop", "off")
+
+def new_convergence_state():
+    return {"history": [], "effort": "full"}
+
+def plateau_reasons(run, document):
+    # Returns why the last window counts as a plateau, or [] if it doesn't (or isn't full yet).
+    history = run["convergence"]["history"][-run["convergence_window"]:]
+    if len(history) < run["convergence_window"]: return []
+    acceptance_rate = sum(entry["outcome"] == "accepted" for entry in history) / len(history)
+    change = 1.0 - document_similarity(history[0]["document_before"], document)
+    growth = len(document.split()) / max(1, len(history[0]["document_before"].split())) - 1.0
+    if acceptance_rate < run["convergence_min_acceptance"]:
+        return [f"only {acceptance_rate:.0%} of the last {len(history)} iterations were accepted (threshold {run['convergence_min_acceptance']:.0%})"]
+    if change < run["convergence_min_change"] and growth < run["convergence_min_growth"]:
+        return [f"the paper changed {change:.1%} over the last {len(history)} iterations (threshold {run['convergence_min_change']:.1%})",
+                f"and grew {growth:+.1%} (threshold {run['convergence_min_growth']:.1%})"]
+    return []
+
+def iteration_converged(run, iteration, outcome, original, document):
+    # Records how an iteration ended; returns True if the loop should stop. May lower the effort level instead.
+    state = run["convergence"]
+    if run["convergence_action"] == "off": return False
+    state["history"].append({"iteration": iteration, "outcome": outcome, "document_before": original})
+    del state["history"][:-run["convergence_window"]]
+    reasons = plateau_reasons(run, document)
+    if not reasons: return False
+    if run["convergence_action"] in ("reduce_then_stop", "reduce") and state["effort"] == "full":
+        state["effort"], state["history"] = "direct_fix", []
+        logging.info(f"Convergence: {' '.join(reasons)}. Switching to Direct Fix only from iteration {iteration + 1}.")
+        print(f"Convergence: improvements have slowed ({' '.join(reasons)}). Using Direct Fix only from now on.")
+        return False
+    if run["convergence_action"] == "reduce": return False
+    logging.info(f"Convergence: {' '.join(reasons)}. Stopping after iteration {iteration}.")
+    print(f"Process Complete! The paper has stopped improving ({' '.join(reasons)}).")
+    return True
+
+# --- Document Runs ---
+# A run holds everything that belongs to one document: its settings from a simple_config-style dict, its paths and
+# its step journal. Nothing else is kept per document, so one process can improve several documents at once.
+def resolve_run_path(work_dir, path):
+    return os.path.normpath(os.path.join(work_dir, path))
+
+def build_document_run(doc_config, work_dir=".", name=None):
+    document_path = resolve_run_path(work_dir, doc_config.get("document_path", "project_document.txt"))
+    document_title = doc_config.get("document_title", DEFAULT_DOCUMENT_TITLE)
+    backup_dir = resolve_run_path(work_dir, "document_backups")
+    backup_versions_dir = os.path.join(backup_dir, os.path.splitext(os.path.basename(document_path))[0] + "_versions")
+    log_dir = resolve_run_path(work_dir, "logs")
+    convo_log_dir = os.path.join(log_dir, "convo")
+    document_edit_mode = doc_config.get("document_edit_mode", "patch") # "patch": rewrites return only changed sections; "full": whole paper
+    generation_profiles = {profile_name: dict(profile) for profile_name, profile in GENERATION_PROFILES.items()}
+    generation_profiles["rewrite"]["num_predict"] = doc_config.get("number_pred_simple", 16384)
+    for profile_name, profile_overrides in doc_config.get("generation_profiles", {}).items():
+        generation_profiles.setdefault(profile_name, {}).update(profile_overrides)
+    step_profiles = dict(STEP_PROFILES)
+    if document_edit_mode == "patch":
+        step_profiles.update({"2": "patch", "synthesis": "patch"})
+    run = {
+        "name": name or os.path.splitext(os.path.basename(document_path))[0],
+        "document_path": document_path,
+        "document_title": document_title,
+        "system_prompt": build_system_prompt(document_title),
+        "llm_model": doc_config.get("gen_model", "gemma3:12b-it-qat"),
+        "temperature_general": doc_config.get("temperature_general", 0.6),
+        "temperature_brainstorm_min": doc_config.get("temperature_brainstorm_min", 0.5),
+        "temperature_brainstorm_max": doc_config.get("temperature_brainstorm_max", 1.0),
+        "temperature_synthesis": doc_config.get("temperature_synthesis", 0.5),
+        "max_iterations": doc_config.get("max_iterations_simple", 500),
+        "synthesis_candidates": max(1, int(doc_config.get("synthesis_candidates", 1))), # Above 1: best-of-N synthesis
+        "backup_full_snapshot_every": max(1, doc_config.get("backup_full_snapshot_every", 20)),
+        "max_convo_log_size_mb": doc_config.get("max_convo_log_size_mb", 20),
+        "document_edit_mode": document_edit_mode,
+        "generation_profiles": generation_profiles,
+        "step_profiles": step_profiles,
+        "num_ctx_min": doc_config.get("number_ctx_min", 8192),
+        "num_ctx_max": doc_config.get("number_ctx_simple", 32768),
+        "chars_per_token_estimate": doc_config.get("chars_per_token_estimate", 3.0), # Deliberately low so the estimate errs on the large side
+        "screen_min_length_ratio": doc_config.get("screen_min_length_ratio", 0.9),   # Candidate/original word count; the paper is meant to grow
+        "screen_max_length_ratio": doc_config.get("screen_max_length_ratio", 3.0),
+        "screen_max_lost_sections": doc_config.get("screen_max_lost_sections", 1),   # Allows one renamed or merged heading
+        "screen_min_similarity": doc_config.get("screen_min_similarity", 0.3),       # Below this the rewrite has drifted away from the paper
+        "screen_max_similarity": doc_config.get("screen_max_similarity", 0.999),     # Above this nothing meaningful changed
+        "backup_dir": backup_dir,
+        "backup_index_path": os.path.join(backup_versions_dir, "index.jsonl"),
+        "backup_objects_dir": backup_versions_dir,
+        "backup_index": [],
+        "log_dir": log_dir,
+        "convo_log_dir": convo_log_dir,
+        "convo_session": None,
+        "convo_segment": None, # Only touched by the convo log writer thread
+        "replay_log_path": resolve_run_path(work_dir, doc_config["llm_replay_log"]) if "llm_replay_log" in doc_config else convo_log_dir,
+        "section_summaries_path": os.path.join(backup_dir, os.path.splitext(os.path.basename(document_path))[0] + "_summaries.jsonl"),
+        "section_summaries": None, # Loaded on first use
+        "context_view_min_words": doc_config.get("context_view_min_words", 2500),     # Shorter papers are always sent in full
+        "section_summary_min_words": doc_config.get("section_summary_min_words", 120), # Shorter sections are shown in full
+        "section_summary_words": doc_config.get("section_summary_words", 80),
+        "speculative_execution": doc_config.get("speculative_execution", False),
+        "speculation_executor": None, # Started on first use
+        "speculation_stats": new_speculation_stats(),
+        "con_memory_enabled": doc_config.get("con_memory", True),
+        "con_memory_model": doc_config.get("con_memory_model", "nomic-embed-text"),
+        "con_memory_similarity": doc_config.get("con_memory_similarity", 0.9),
+        "con_memory_path": os.path.join(backup_dir, os.path.splitext(os.path.basename(document_path))[0] + "_con_memory.jsonl"),
+        "con_memory": None, # Loaded on first use
+        "convergence_action": doc_config.get("convergence_action", "reduce_then_stop"),
+        "convergence_window": max(1, doc_config.get("convergence_window", 10)),
+        "convergence_min_acceptance": doc_config.get("convergence_min_acceptance", 0.2), # Share of the window's iterations accepted
+        "convergence_min_change": doc_config.get("convergence_min_change", 0.02),         # 1 - similarity of the paper across the window
+        "convergence_min_growth": doc_config.get("convergence_min_growth", 0.02),         # Word count growth across the window
+        "convergence": new_convergence_state(),
+        "journal_path": os.path.join(backup_dir, os.path.splitext(os.path.basename(document_path))[0] + "_journal.jsonl"),
+        "journal_fsync_every": doc_config.get("journal_fsync_every", 4),
+        "journal_state": {"file": None, "unsynced_records": 0},
+        "journal_lock": threading.Lock(),
+    }
+    try:
+        os.makedirs(backup_dir, exist_ok=True)
+        os.makedirs(convo_log_dir, exist_ok=True)
+    except Exception as e:
+        logging.error(f"Error creating directories for '{document_path}': {e}")
+    return run
+
+def start_convo_log(run):
+    # Every session writes its own convo log segments. In replay mode the previous session is imported into the cache first.
+    if LLM_CACHE_MODE == "replay":
+        import_convo_log_into_cache(run["replay_log_path"], run["llm_model"])
+    run["convo_session"] = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
 # --- Main Loop ---
-def main_improvement_loop():
-    if not ollama_client:
-        print("Ollama client not available. Exiting."); logging.critical("Ollama client not available."); return
+def finish_iteration(session_memory, outcome, document_content):
+    # Bookkeeping for every way an iteration ends, failed ones included: the chosen Con's outcome, closing the step
+    # journal, the per-iteration logs and the convergence monitor. Returns True if the loop should stop.
+    run, iteration = session_memory['run'], session_memory['current_iteration']
+    if outcome != "duplicate_con": remember_con(session_memory, outcome) # A duplicate's Con is already remembered
+    journal_end_iteration(run, iteration, outcome)
+    logging.info(prompt_cache_summary())
+    logging.info(telemetry_iteration_summary(run["name"], iteration))
+    return iteration_converged(run, iteration, outcome, session_memory['original_document_for_iteration'], document_content)
 
-    document_content = load_document(DOCUMENT_FILE_PATH)
-    if "Error:" in document_content: print(f"Could not load/create document: {document_content}"); logging.critical(f"Load/create error: {document_content}"); return
+def main_improvement_loop(run):
+    document_content = load_document(run['document_path'], run['document_title'])
+    if document_content is None: print(f"Could not load/create document '{run['document_path']}'."); logging.critical(f"Could not load/create document '{run['document_path']}'."); return
         
-    version_number = 0
-    try:
-        existing_backups = [f for f in os.listdir(BACKUP_DIR) if f.startswith(os.path.splitext(os.path.basename(DOCUMENT_FILE_PATH))[0] + "_v")]
-        if existing_backups:
-            version_numbers = []
-            for f_name in existing_backups:
-                try: 
-                    v_str = f_name.split('_v')[1].split('.')[0]
-                    version_numbers.append(int(v_str))
-                except (IndexError, ValueError):
-                    logging.warning(f"Could not parse version from backup filename: {f_name}")
-            if version_numbers:
-                version_number = max(version_numbers)
-                logging.info(f"Resuming version numbering from: {version_number}")
-    except Exception as e: logging.error(f"Could not determine last backup version: {e}. Starting from 0.")
-
-    session_memory = {} 
-
-    for i in range(MAX_ITERATIONS):
+    version_number = open_backup_store(run, document_content)
+    logging.info(f"Current document is version {version_number} ({len(run['backup_index'])} versions in the backup store).")
+
+    session_memory = {'run': run}
+    if run['speculative_execution'] and OLLAMA_NUM_PARALLEL * len(OLLAMA_HOSTS) < 2:
+        logging.warning("speculative_execution needs more than one LLM slot (ollama_num_parallel); running without it.")
+        run['speculative_execution'] = False
+    if run['convergence_action'] not in CONVERGENCE_ACTIONS:
+        logging.warning(f"Unknown convergence_action '{run['convergence_action']}'; using 'reduce_then_stop'.")
+        run['convergence_action'] = "reduce_then_stop"
+    pending_critique = None # Speculative 1a for the next iteration, started on the candidate during evaluation
+    resumed_steps = load_journal_for_resume(run, document_content)
+    if resumed_steps:
+        logging.info(f"Resuming interrupted iteration from the step journal ({len(resumed_steps)} finished steps: {', '.join(resumed_steps)}).")
+        print(f"Resuming interrupted iteration: {len(resumed_steps)} steps already done ({', '.join(resumed_steps)}).")
+
+    for i in range(run['max_iterations']):
         current_iter_num_for_log = i + 1
-        logging.info(f"\n--- Iteration {current_iter_num_for_log} / {MAX_ITERATIONS} ---")
-        print(f"\n\n{'='*10} ITERATION {current_iter_num_for_log} / {MAX_ITERATIONS} {'='*10}")
+        logging.info(f"\n--- Iteration {current_iter_num_for_log} / {run['max_iterations']} ---")
+        print(f"\n\n{'='*10} ITERATION {current_iter_num_for_log} / {run['max_iterations']} {'='*10}")
         
         session_memory['current_iteration'] = current_iter_num_for_log
         session_memory['original_document_for_iteration'] = document_content 
+        session_memory['resumed_steps'] = resumed_steps
+        resumed_steps = {}
+        if not session_memory['resumed_steps']: # A resumed iteration keeps appending to its existing journal
+            journal_begin_iteration(run, current_iter_num_for_log, document_content)
+        logging.info(f"Context window for this iteration: {size_context_window(run, document_content)} tokens.")
         accumulated_notes_for_synthesis = "" 
 
         # 1a. Get Pros and Cons
         prompt1a_procon = (
-            f"Critically analyze the current comprehensive, extensively detailed, and thorough research white paper titled '{DOCUMENT_TITLE}'. "
-            f"Your task is to provide structured feedback. Please format your response as follows:\n"
-            f"PROS:\n"
-            f"- [Pro 1]\n"
-            f"- [Pro 2]\n"
-            f"- [Pro 3 (if applicable)]\n\n" # Reduced to 3-3 for brevity, can be 3-5
-            f"CONS:\n"
-            f"- [Con 1 - specific weakness or area for improvement]\n"
-            f"- [Con 2 - specific weakness or area for improvement]\n"
-            f"- [Con 3 (if applicable) - specific weakness or area for improvement]\n\n"
-            f"Focus on identifying actionable Cons. Do not state 'No Cons' in this step; strive to find areas for improvement.\n\n"
-            f"CURRENT DOCUMENT:\n'''\n{document_content}\n'''"
+            f"Critically analyze the current comprehensive, extensively detailed, and thorough research white paper titled '{run['document_title']}'. "
+            f"Your task is to provide structured feedback: 2-3 Pros, and 2-3 Cons that each name a specific weakness or area for improvement. "
+            f"Focus on identifying actionable Cons. Do not state 'No Cons' in this step; strive to find areas for improvement."
         )
         print(f"\n{'='*5} STEP 1a!!! Asking LLM: List Pros and Cons {'='*5}")
-        response_procon = ask_llm(prompt1a_procon, session_memory, temperature=TEMPERATURE_GENERAL)
-        if "Error:" in response_procon: logging.error(f"LLM Error listing pros/cons: {response_procon}"); break
-        
+        try:
+            if pending_critique is not None and pending_critique["document"] == document_content:
+                pros_and_cons = adopt_speculation(session_memory, pending_critique)
+            else:
+                discard_speculation(run, pending_critique) # The candidate it was started on was not accepted
+                pros_and_cons = ask_llm_on_context_view(prompt1a_procon, document_content, session_memory, PROS_CONS_OUTPUT, temperature=run['temperature_general'], step="1a")
+        except LLMError as e:
+            logging.error(f"LLM Error listing pros/cons: {e}"); break
+        finally:
+            pending_critique = None
+
+        response_procon = pros_cons_text(pros_and_cons)
+        session_memory['pros_and_cons'] = pros_and_cons
         session_memory['pros_and_cons_list'] = response_procon
         accumulated_notes_for_synthesis += f"\n\n--- Notes for Iteration {current_iter_num_for_log} ---\nPros and Cons Analysis:\n{response_procon}\n"
         logging.info(f"LLM Pros/Cons Analysis:\n{response_procon}")
@@ -261,121 +2010,158 @@ def main_improvement_loop():
 
         # 1b. Pick the most critical Con to fix
         prompt1b_pick_con = (
-            f"From the list of 'Cons' you just provided for the paper '{DOCUMENT_TITLE}':\n"
+            f"From the list of 'Cons' you just provided for the paper '{run['document_title']}':\n"
             f"'''\n{session_memory['pros_and_cons_list']}\n'''\n" 
-            f"tell me Which ONE of these Cons is the single most critical or impactful one to address next to improve the paper? "
-            f"If, after reviewing your own list, you genuinely believe there are NO actionable 'Cons' that can be reasonably addressed from that list, " 
-            f"then and ONLY then, respond with the exact phrase 'No Actionable Cons Found'. "
-            f"Otherwise, please state ONLY the chosen 'Con' you will focus on."
+            f"tell me Which ONE of these Cons is the single most critical or impactful one to address next to improve the paper? Give its number. "
+            f"If, after reviewing your own list, you genuinely believe there are NO actionable 'Cons' that can be reasonably addressed from that list, "
+            f"then and ONLY then, give the number 0."
         )
+        con_number_output = pick_con_output(len(pros_and_cons["cons"]))
         print(f"\n{'='*5} STEP 1b!!! Asking LLM: Pick most critical Con to fix {'='*5}")
-        chosen_con_to_fix = ask_llm(prompt1b_pick_con, session_memory, temperature=TEMPERATURE_GENERAL)
-        if "Error:" in chosen_con_to_fix: logging.error(f"LLM Error picking con: {chosen_con_to_fix}"); break
-        
-        if "no actionable cons found" in chosen_con_to_fix.strip().lower() and len(chosen_con_to_fix.strip()) < 30: # More specific check
+        try: con_number = ask_llm_structured(prompt1b_pick_con, session_memory, con_number_output, temperature=run['temperature_general'], step="1b")
+        except LLMError as e: logging.error(f"LLM Error picking con: {e}"); break
+
+        if con_number == 0:
             logging.info("LLM indicated no actionable cons found to pick from. Document considered complete by this strategy.")
             print("Process Complete! LLM found no actionable Cons to pick.")
             break
-            
-        session_memory['identified_problem'] = chosen_con_to_fix 
+        chosen_con_to_fix = pros_and_cons["cons"][con_number - 1]
+
+        # Don't spend an iteration on a Con that has already been worked on: ask once more with the past ones listed
+        similar_cons = check_con_against_memory(session_memory, chosen_con_to_fix)
+        if similar_cons:
+            print(f"\n{'='*5} STEP 1b (again)!!! Chosen Con was already tried; asking LLM for a different one {'='*5}")
+            try: con_number = ask_llm_structured(prompt1b_pick_con + already_tried_note(similar_cons), session_memory, con_number_output, temperature=run['temperature_general'], step="1b-2")
+            except LLMError as e: logging.error(f"LLM Error picking con: {e}"); break
+            if con_number == 0:
+                logging.info("LLM found no actionable cons besides ones already tried. Document considered complete by this strategy.")
+                print("Process Complete! LLM found no actionable Cons that haven't been tried.")
+                break
+            chosen_con_to_fix = pros_and_cons["cons"][con_number - 1]
+            if check_con_against_memory(session_memory, chosen_con_to_fix):
+                logging.info("The second pick repeats an earlier Con as well. Skipping this iteration.")
+                print("LLM picked an already-tried Con again. Skipping this iteration.")
+                if finish_iteration(session_memory, "duplicate_con", document_content): break
+                time.sleep(ITERATION_PAUSE_SECONDS); continue
+
+        session_memory['identified_problem'] = chosen_con_to_fix
         logging.info(f"Identified problem (chosen Con): {session_memory['identified_problem']}")
         print(f"LLM chose problem to fix: {session_memory['identified_problem'][:100]}...")
         accumulated_notes_for_synthesis += f"\nChosen Problem to Address: {session_memory['identified_problem']}\n"
 
+        # The first step of each path is prepared before step A, so speculative mode can start both while A decides.
+        # Step 2 (Direct Fix path)
+        if run['document_edit_mode'] == "patch":
+            fix_return_instruction = (f"5. CRITICAL: Return ONLY the sections you revised or added, in the SECTION PATCH FORMAT below. Do not include meta-commentary.\n"
+                                      f"{SECTION_PATCH_FORMAT}\nEXISTING SECTION HEADINGS:\n{section_headings_list(document_content)}")
+        else:
+            fix_return_instruction = "5. CRITICAL: Return ONLY the full text of the newly revised and integrated comprehensive, extensively detailed, and thorough research white paper. Do not include meta-commentary."
+        prompt2_fix = (f"For the comprehensive, extensively detailed, and thorough research white paper titled '{run['document_title']}'.\n"
+                       f"The specific problem to fix is: '{session_memory['identified_problem']}'\n\n"
+                       f"1. Please adjust only the 'targeted section' or sections that are specifically referenced or implied by the 'identified problem'. "
+                       f"This might involve expanding existing paragraphs within that targeteg section, adding new paragraphs within or directly after that 'targeted section', or subtly rephrasing parts of that 'targeted section' for clarity and depth based on any straight forward obvious fixes.\n"
+                       f"2. While focusing on the 'targeted section', ensure the entire document remains COHERENT and well-structured (Abstract, Introduction, Main Body, Conclusion). You may need to make minor adjustments to surrounding text for flow.\n"
+                       f"3. It's okay to significantly alter or evolve previous ideas within the 'targeted section' of the 'ORIGINAL DOCUMENT CONTENT' if the new straight forward obvious fixes offer a demonstrably better approach to achieving the paper's goals, especially concerning the 'KEY PROBLEM IDENTIFIED'. Do not be afraid to replace weaker prior content within that 'targeted section' with stronger new material from the straight forward obvious fixes.\n"
+                       f"4. Aim to grow the overall size and detail of the paper if the new information genuinely adds value and depth, particularly within and around the revised 'targeted section'.\n"
+                       f"{fix_return_instruction}\n"
+                       f"The paper to revise is the CURRENT DOCUMENT above.")
+        # Steps C, D, E (Brainstorm path) - independent of each other, so they run as one concurrent batch
+        prompt_past = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step C
+                       f"list 3 distinct examples of past analogous problems (which are similar to the identified problem) and the proven methods used to fix the past problems.")
+        prompt_cross = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step D
+                        f"list 3 cross-disciplinary insights or concepts (which are analogous to the concept involving the identified problem) and include how those cross-disciplinary concepts are tackling their similar problems.")
+        prompt_left = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step E
+                       f"suggest 3 bold 'left-field' analogous ideas that could lead to a solution for the identified problem.")
+        brainstorm_requests = [
+            (prompt_past, random_brainstorm_temperature(run), "C"),
+            (prompt_cross, random_brainstorm_temperature(run), "D"),
+            (prompt_left, random_brainstorm_temperature(run), "E"),
+        ]
+        reduced_effort = run['convergence']['effort'] == "direct_fix" # Set by the convergence monitor once improvements slow down
+        path_speculations = {}
+        if run['speculative_execution'] and not reduced_effort and "A" not in session_memory['resumed_steps']:
+            path_speculations = {
+                "Direct Fix": start_speculation(session_memory, "step 2 (Direct Fix path)", ask_llm, prompt2_fix,
+                                                temperature=run['temperature_synthesis'], step="2", document=document_content),
+                "Brainstorm": start_speculation(session_memory, "steps C/D/E (Brainstorm path)", ask_llm_batch, brainstorm_requests),
+            }
+
         # BRAINSTORMING? STEP A: Should we brainstorm to fix this con?
         prompt_should_brainstorm = (
             f"For the identified problem: '{session_memory['identified_problem']}'.\n"
             f"Is a common knowledge rewrite of the document likely to easily address this, "
             f"or would in-depth exhaustive brainstorming of diverse and novel ideas be more beneficial for a breakthrough or truly innovative solution? "
             f"Consider if the problem requires common knowledge fixes or truly novel thinking. "
-            f"Respond ONLY with 'Brainstorm' or 'Direct Fix'."
+            f"Answer 'Brainstorm' or 'Direct Fix'."
         )
-        print(f"\n{'='*5} BRAINSTORMING? STEP A!!! Asking LLM: Brainstorm or Direct Fix for '{session_memory['identified_problem'][:50]}...'? {'='*5}")
-        decision_on_approach = ask_llm(prompt_should_brainstorm, session_memory, temperature=TEMPERATURE_GENERAL)
-        if "Error:" in decision_on_approach: logging.error(f"LLM Error deciding approach: {decision_on_approach}"); continue
+        if reduced_effort:
+            print(f"\n{'='*5} Skipping STEP A: improvements have slowed, so the convergence monitor allows Direct Fix only {'='*5}")
+            session_memory['approach'] = "Direct Fix"
+        else:
+            print(f"\n{'='*5} BRAINSTORMING? STEP A!!! Asking LLM: Brainstorm or Direct Fix for '{session_memory['identified_problem'][:50]}...'? {'='*5}")
+            try:
+                session_memory['approach'] = ask_llm_on_context_view(prompt_should_brainstorm, document_content, session_memory, APPROACH_OUTPUT, focus_text=session_memory['identified_problem'],
+                                                                     temperature=run['temperature_general'], step="A")
+            except LLMError as e:
+                logging.error(f"LLM Error deciding approach: {e}")
+                for speculation in path_speculations.values(): discard_speculation(run, speculation)
+                if finish_iteration(session_memory, "approach_failed", document_content): break
+                time.sleep(ITERATION_PAUSE_SECONDS); continue
 
-        if "direct fix" in decision_on_approach.strip().lower():
+        discard_speculation(run, path_speculations.pop("Brainstorm" if session_memory['approach'] == "Direct Fix" else "Direct Fix", None))
+        if session_memory['approach'] == "Direct Fix":
             print("LLM chose Direct Fix approach.")
             accumulated_notes_for_synthesis += "\nApproach Chosen: Direct Fix.\n"
-            # Step 2 (Direct Fix)
-            prompt2_fix = (f"For the comprehensive, extensively detailed, and thorough research white paper titled '{DOCUMENT_TITLE}'.\n"
-                           f"The specific problem to fix is: '{session_memory['identified_problem']}'\n\n"
-                           f"1. Please adjust only the 'targeted section' or sections that are specifically referenced or implied by the 'identified problem'. "
-                           f"This might involve expanding existing paragraphs within that targeteg section, adding new paragraphs within or directly after that 'targeted section', or subtly rephrasing parts of that 'targeted section' for clarity and depth based on any straight forward obvious fixes.\n"
-                           f"2. While focusing on the 'targeted section', ensure the entire document remains COHERENT and well-structured (Abstract, Introduction, Main Body, Conclusion). You may need to make minor adjustments to surrounding text for flow.\n"
-                           f"3. It's okay to significantly alter or evolve previous ideas within the 'targeted section' of the 'ORIGINAL DOCUMENT CONTENT' if the new straight forward obvious fixes offer a demonstrably better approach to achieving the paper's goals, especially concerning the 'KEY PROBLEM IDENTIFIED'. Do not be afraid to replace weaker prior content within that 'targeted section' with stronger new material from the straight forward obvious fixes.\n"
-                           f"4. Aim to grow the overall size and detail of the paper if the new information genuinely adds value and depth, particularly within and around the revised 'targeted section'.\n"
-                           f"5. CRITICAL: Return ONLY the full text of the newly revised and integrated comprehensive, extensively detailed, and thorough research white paper. Do not include meta-commentary."
-                           f"PAPER TO REVISE:\n'''\n{document_content}\n'''")
             print(f"\n{'='*5} STEP 2 (Direct Fix Path)!!! Asking LLM: Attempt to fix problem '{session_memory['identified_problem'][:50]}...' directly. {'='*5}")
-            directly_fixed_version = ask_llm(prompt2_fix, session_memory, temperature=TEMPERATURE_SYNTHESIS)
-            
-            if "Error:" not in directly_fixed_version and len(directly_fixed_version.strip()) > 0.5 * len(document_content.strip()):
-                accumulated_notes_for_synthesis += f"\nDirect Fix Attempt Content:\n'''\n{directly_fixed_version}\n'''\n"
-                print("LLM provided a direct fix attempt. It will be included in synthesis notes.")
+            try:
+                if path_speculations:
+                    directly_fixed_version = adopt_speculation(session_memory, path_speculations["Direct Fix"])
+                else:
+                    directly_fixed_version = ask_llm(prompt2_fix, session_memory, temperature=run['temperature_synthesis'], step="2", document=document_content)
+                fix_applied_version, fix_note = apply_llm_rewrite(run, document_content, directly_fixed_version)
+            except LLMError as e:
+                directly_fixed_version, fix_applied_version, fix_note = "", None, f"LLM call failed: {e}"
+
+            if fix_applied_version is not None:
+                # In patch mode the notes carry just the revised sections, not a second copy of the whole paper.
+                accumulated_notes_for_synthesis += f"\nDirect Fix Attempt Content ({fix_note}):\n'''\n{directly_fixed_version}\n'''\n"
+                print(f"LLM provided a direct fix attempt ({fix_note}). It will be included in synthesis notes.")
             else:
-                logging.warning(f"Direct fix failed or result too short. Notes will reflect this. LLM_Fix_Response: '{directly_fixed_version[:100]}...'")
+                logging.warning(f"Direct fix failed or result unusable ({fix_note}). Notes will reflect this. LLM_Fix_Response: '{directly_fixed_version[:100]}...'")
                 print("LLM direct fix attempt failed or was too short.")
                 accumulated_notes_for_synthesis += f"\nDirect Fix Attempt for '{session_memory['identified_problem']}': Failed or insufficient.\n"
         
-        else: # Assumed "Brainstorm" or if LLM didn't say "Direct Fix" clearly
-            print("LLM chose Brainstorm approach (or default).")
+        else:
+            print("LLM chose Brainstorm approach.")
             accumulated_notes_for_synthesis += "\nApproach Chosen: Brainstorming.\n"
-            # Steps C, D, E (Brainstorming)
-            prompt_past = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step C
-                           f"list 3 distinct examples of past analogous problems (which are similar to the identified problem) and the proven methods used to fix the past problems.")
-            print(f"\n{'='*5} STEP C (Brainstorm)!!! Asking LLM: Past analogies. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['brainstorm_past'] = ask_llm(prompt_past, session_memory, temperature=random_temp)
-            if "Error:" not in session_memory['brainstorm_past']:
-                print(f"\n{'='*5} STEP C (Brainstorm)!!! Past analogies. SUCCESS {'='*5}")
-
-            prompt_cross = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step D
-                            f"list 3 cross-disciplinary insights or concepts (which are analogous to the concept involving the identified problem) and include how those cross-disciplinary concepts are tackling their similar problems.")
-            print(f"\n{'='*5} STEP D (Brainstorm)!!! Asking LLM: Cross-field concepts. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['brainstorm_cross_field'] = ask_llm(prompt_cross, session_memory, temperature=random_temp)
-            if "Error:" not in session_memory['brainstorm_cross_field']:
-                print(f"\n{'='*5} STEP D (Brainstorm)!!! Cross-field concepts. SUCCESS {'='*5}")
-
-
-            prompt_left = (f"Using brainstorming to help solve this identified problem: '{session_memory['identified_problem']}', " # Step E
-                           f"suggest 3 bold 'left-field' analogous ideas that could lead to a solution for the identified problem.")
-            print(f"\n{'='*5} STEP E (Brainstorm)!!! Asking LLM: Left-field ideas. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['brainstorm_left_field'] = ask_llm(prompt_left, session_memory, temperature=random_temp)
-            if "Error:" not in session_memory['brainstorm_left_field']:
-                print(f"\n{'='*5} STEP E (Brainstorm)!!! Left-field ideas. SUCCESS {'='*5}")
-            
-            # Step F1: Combine brainstormed ideas
+            print(f"\n{'='*5} STEPS C, D, E (Brainstorm)!!! Asking LLM: Past analogies, Cross-field concepts, Left-field ideas. {'='*5}")
+            (session_memory['brainstorm_past'],
+             session_memory['brainstorm_cross_field'],
+             session_memory['brainstorm_left_field']) = (adopt_speculation(session_memory, path_speculations["Brainstorm"]) if path_speculations
+                                                         else ask_llm_batch(brainstorm_requests, session_memory))
+            for brainstorm_key, brainstorm_label in (('brainstorm_past', "STEP C (Brainstorm)!!! Past analogies."),
+                                                     ('brainstorm_cross_field', "STEP D (Brainstorm)!!! Cross-field concepts."),
+                                                     ('brainstorm_left_field', "STEP E (Brainstorm)!!! Left-field ideas.")):
+                if isinstance(session_memory[brainstorm_key], LLMError):
+                    logging.error(f"LLM Error in {brainstorm_label} {session_memory[brainstorm_key]}")
+                    session_memory[brainstorm_key] = "(not available - the LLM call failed)"
+                else:
+                    print(f"\n{'='*5} {brainstorm_label} SUCCESS {'='*5}")
+
+            # Steps F1, F2, F3: Combine brainstormed ideas - the three lots only depend on C/D/E, so they run as a second batch
             prompt_combo1 = ( # Renamed variable for clarity
                 f"From all the brainstorming notes create 9 combinations. "
                 f"For each combination, write out in 3 sentences about what the combination is, and what it means "
                 f"in relation to the identified problem: '{session_memory['identified_problem']}', "
                 f"The list will only use the first (number 1) of the Past Analogies, "
                 f"then first, second, or third of the Cross-Field Concepts then first, second, or third of the Left-Field Ideas.\n\n"
-                f"Complete the following list:\n"
-
-                f"- [Past 1]+[Concept 1]+[Left-Field 1]:\n"
-                f"- [Past 1]+[Concept 1]+[Left-Field 2]:\n"
-                f"- [Past 1]+[Concept 1]+[Left-Field 3]:\n"
-                f"- [Past 1]+[Concept 2]+[Left-Field 1]:\n"
-                f"- [Past 1]+[Concept 2]+[Left-Field 2]:\n"
-                f"- [Past 1]+[Concept 2]+[Left-Field 3]:\n"
-                f"- [Past 1]+[Concept 3]+[Left-Field 1]:\n"
-                f"- [Past 1]+[Concept 3]+[Left-Field 2]:\n"
-                f"- [Past 1]+[Concept 3]+[Left-Field 3]:\n"
-
+                f"Give the 9 combinations in this order: [Past 1]+[Concept 1]+[Left-Field 1], [Past 1]+[Concept 1]+[Left-Field 2], [Past 1]+[Concept 1]+[Left-Field 3], "
+                f"[Past 1]+[Concept 2]+[Left-Field 1], and so on up to [Past 1]+[Concept 3]+[Left-Field 3].\n\n"
                 f"BRAINSTORMING NOTES DUMP:\n'''\n"
                 f"Past Analogies: {session_memory.get('brainstorm_past', 'N/A')}\n"
                 f"Cross-Field Concepts: {session_memory.get('brainstorm_cross_field', 'N/A')}\n"
                 f"Left-Field Ideas: {session_memory.get('brainstorm_left_field', 'N/A')}\n"
                 f"'''")
-            print(f"\n{'='*5} STEP F (Brainstorm)!!! Asking LLM: Synthesize best ideas from brainstorm. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['combo1'] = ask_llm(prompt_combo1, session_memory, temperature=random_temp) 
-            if "Error:" not in session_memory['combo1']: 
-                print(f"\n{'='*5} STEP F combo1 (Brainstorm)!!! SUCCESS {'='*5}")
 
             # Step F2: Combine brainstormed ideas
             prompt_combo2 = ( # Renamed variable for clarity
@@ -384,28 +2170,13 @@ def main_improvement_loop():
                 f"in relation to the identified problem: '{session_memory['identified_problem']}', "
                 f"The list will only use the second (number 2) of the Past Analogies, "
                 f"then first, second, or third of the Cross-Field Concepts then first, second, or third of the Left-Field Ideas.\n\n"
-                f"Complete the following list:\n"
-
-                f"- [Past 2]+[Concept 1]+[Left-Field 1]:\n"
-                f"- [Past 2]+[Concept 1]+[Left-Field 2]:\n"
-                f"- [Past 2]+[Concept 1]+[Left-Field 3]:\n"
-                f"- [Past 2]+[Concept 2]+[Left-Field 1]:\n"
-                f"- [Past 2]+[Concept 2]+[Left-Field 2]:\n"
-                f"- [Past 2]+[Concept 2]+[Left-Field 3]:\n"
-                f"- [Past 2]+[Concept 3]+[Left-Field 1]:\n"
-                f"- [Past 2]+[Concept 3]+[Left-Field 2]:\n"
-                f"- [Past 2]+[Concept 3]+[Left-Field 3]:\n"
-
+                f"Give the 9 combinations in this order: [Past 2]+[Concept 1]+[Left-Field 1], [Past 2]+[Concept 1]+[Left-Field 2], [Past 2]+[Concept 1]+[Left-Field 3], "
+                f"[Past 2]+[Concept 2]+[Left-Field 1], and so on up to [Past 2]+[Concept 3]+[Left-Field 3].\n\n"
                 f"BRAINSTORMING NOTES DUMP:\n'''\n"
                 f"Past Analogies: {session_memory.get('brainstorm_past', 'N/A')}\n"
                 f"Cross-Field Concepts: {session_memory.get('brainstorm_cross_field', 'N/A')}\n"
                 f"Left-Field Ideas: {session_memory.get('brainstorm_left_field', 'N/A')}\n"
                 f"'''")
-            print(f"\n{'='*5} STEP F (Brainstorm)!!! Asking LLM: Synthesize best ideas from brainstorm. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['combo2'] = ask_llm(prompt_combo2, session_memory, temperature=random_temp) 
-            if "Error:" not in session_memory['combo2']: 
-                print(f"\n{'='*5} STEP F combo2 (Brainstorm)!!! SUCCESS {'='*5}")
 
             # Step F3: Combine brainstormed ideas
             prompt_combo3 = ( # Renamed variable for clarity
@@ -414,28 +2185,28 @@ def main_improvement_loop():
                 f"in relation to the identified problem: '{session_memory['identified_problem']}', "
                 f"The list will only use the third (number 3) of the Past Analogies, "
                 f"then first, second, or third of the Cross-Field Concepts then first, second, or third of the Left-Field Ideas.\n\n"
-                f"Complete the following list:\n"
-
-                f"- [Past 3]+[Concept 1]+[Left-Field 1]:\n"
-                f"- [Past 3]+[Concept 1]+[Left-Field 2]:\n"
-                f"- [Past 3]+[Concept 1]+[Left-Field 3]:\n"
-                f"- [Past 3]+[Concept 2]+[Left-Field 1]:\n"
-                f"- [Past 3]+[Concept 2]+[Left-Field 2]:\n"
-                f"- [Past 3]+[Concept 2]+[Left-Field 3]:\n"
-                f"- [Past 3]+[Concept 3]+[Left-Field 1]:\n"
-                f"- [Past 3]+[Concept 3]+[Left-Field 2]:\n"
-                f"- [Past 3]+[Concept 3]+[Left-Field 3]:\n"
-
+                f"Give the 9 combinations in this order: [Past 3]+[Concept 1]+[Left-Field 1], [Past 3]+[Concept 1]+[Left-Field 2], [Past 3]+[Concept 1]+[Left-Field 3], "
+                f"[Past 3]+[Concept 2]+[Left-Field 1], and so on up to [Past 3]+[Concept 3]+[Left-Field 3].\n\n"
                 f"BRAINSTORMING NOTES DUMP:\n'''\n"
                 f"Past Analogies: {session_memory.get('brainstorm_past', 'N/A')}\n"
                 f"Cross-Field Concepts: {session_memory.get('brainstorm_cross_field', 'N/A')}\n"
                 f"Left-Field Ideas: {session_memory.get('brainstorm_left_field', 'N/A')}\n"
                 f"'''")
-            print(f"\n{'='*5} STEP F (Brainstorm)!!! Asking LLM: Synthesize best ideas from brainstorm. {'='*5}")
-            random_temp = random.randint(int(TEMPERATURE_BRAINSTORM_MIN * 10), int(TEMPERATURE_BRAINSTORM_MAX * 10)) * 0.1
-            session_memory['combo3'] = ask_llm(prompt_combo3, session_memory, temperature=random_temp) 
-            if "Error:" not in session_memory['combo3']: 
-                print(f"\n{'='*5} STEP F combo3 (Brainstorm)!!! SUCCESS {'='*5}")
+            print(f"\n{'='*5} STEPS F1, F2, F3 (Brainstorm)!!! Asking LLM: Combine brainstormed ideas. {'='*5}")
+            (session_memory['combo1'],
+             session_memory['combo2'],
+             session_memory['combo3']) = ask_llm_batch([
+                (prompt_combo1, random_brainstorm_temperature(run), "F1", None, COMBINATIONS_OUTPUT),
+                (prompt_combo2, random_brainstorm_temperature(run), "F2", None, COMBINATIONS_OUTPUT),
+                (prompt_combo3, random_brainstorm_temperature(run), "F3", None, COMBINATIONS_OUTPUT),
+            ], session_memory)
+            for past_number, combo_key in enumerate(('combo1', 'combo2', 'combo3'), 1):
+                if isinstance(session_memory[combo_key], LLMError):
+                    logging.error(f"LLM Error in STEP F {combo_key}: {session_memory[combo_key]}")
+                    session_memory[combo_key] = "(not available - the LLM call failed)"
+                else:
+                    session_memory[combo_key] = combinations_text(past_number, session_memory[combo_key])
+                    print(f"\n{'='*5} STEP F {combo_key} (Brainstorm)!!! SUCCESS {'='*5}")
 
 
             # Step G: Combine brainstormed ideas
@@ -450,13 +2221,15 @@ def main_improvement_loop():
                 f"{session_memory['combo3']}\n"
                 f"'''")
             print(f"\n{'='*5} STEP F (Brainstorm)!!! Asking LLM: Synthesize best ideas from brainstorm. {'='*5}")
-            session_memory['best_synthesized_brainstorm_ideas'] = ask_llm(prompt_best4_from_brainstorm, session_memory, temperature=TEMPERATURE_GENERAL) 
-            if "Error:" not in session_memory['best_synthesized_brainstorm_ideas']: 
+            try:
+                session_memory['best_synthesized_brainstorm_ideas'] = ask_llm(prompt_best4_from_brainstorm, session_memory, temperature=run['temperature_general'], step="G")
+            except LLMError as e:
+                logging.error(f"LLM Error synthesizing brainstorm ideas: {e}")
+            else:
                 accumulated_notes_for_synthesis += f"\nSynthesized Novel Ideas from Brainstorm:\n{session_memory['best_synthesized_brainstorm_ideas']}\n"
             
         # Final Synthesis Step for this iteration (common to both paths)
         synthesis_prompt_text = (
-            f"ORIGINAL DOCUMENT\n'''\n{session_memory['original_document_for_iteration']}\n'''\n\n"
             f"IDENTIFIED PROBLEM\n'''\n{session_memory['identified_problem']}\n'''\n\n"
             f"NOTES\n'''\n{accumulated_notes_for_synthesis}\n'''\n\n"
             "INSTRUCTIONS:\n"
@@ -465,41 +2238,78 @@ def main_improvement_loop():
             "3. Integrate those insights into the located section(s): expand paragraphs, add new ones, or rephrase for clarity and depth.\n"
             "4. Replace weaker material in the affected section(s) with stronger content from NOTES whenever that better serves the paper’s goals.\n"
             "5. Keep the whole paper coherent and well-structured (Abstract, Introduction, Body, Conclusion); tweak nearby text as needed for flow.\n"
-            "6. Return **only** the full revised paper (preferably longer than the ORIGINAL DOCUMENT). Do not include meta-commentary."
+            + ("6. Return **only** the revised or added sections (together preferably making the paper longer than the CURRENT DOCUMENT), in the SECTION PATCH FORMAT below. Do not include meta-commentary.\n"
+               f"{SECTION_PATCH_FORMAT}\nEXISTING SECTION HEADINGS:\n{section_headings_list(session_memory['original_document_for_iteration'])}"
+               if run['document_edit_mode'] == "patch" else
+               "6. Return **only** the full revised paper (preferably longer than the CURRENT DOCUMENT). Do not include meta-commentary.")
         )
-        print(f"\n{'='*5} FINAL SYNTHESIS STEP!!! Asking LLM: Synthesize final paper for this iteration. {'='*5}")
-        final_synthesized_version = ask_llm(synthesis_prompt_text, session_memory, temperature=TEMPERATURE_SYNTHESIS)
+        if run['synthesis_candidates'] > 1:
+            final_synthesized_version = best_synthesis_candidate(session_memory, synthesis_prompt_text)
+        else:
+            print(f"\n{'='*5} FINAL SYNTHESIS STEP!!! Asking LLM: Synthesize final paper for this iteration. {'='*5}")
+            try:
+                synthesis_response = ask_llm(synthesis_prompt_text, session_memory, temperature=run['temperature_synthesis'], step="synthesis", document=session_memory['original_document_for_iteration'])
+            except LLMError as e:
+                logging.error(f"LLM Error synthesizing: {e}")
+                final_synthesized_version = None
+            else:
+                final_synthesized_version = usable_synthesis(run, session_memory['original_document_for_iteration'], synthesis_response)
 
-        if "Error:" in final_synthesized_version or len(final_synthesized_version.strip()) < 100 : 
-            logging.error(f"LLM failed to synthesize or produced too short output: '{final_synthesized_version[:100]}...'. Keeping document as it was at start of iteration.")
+        if final_synthesized_version is None:
+            logging.error("LLM failed to synthesize or produced too short output. Keeping document as it was at start of iteration.")
             print("LLM synthesis failed or too short. Document for this iteration remains unchanged.")
             document_content = session_memory['original_document_for_iteration'] 
-            time.sleep(1); continue 
-
-        # Evaluate this final_synthesized_version
-        prompt_evaluate = (
-            f"IDENTIFIED PROBLEM:\n'''\n{session_memory.get('identified_problem','N/A')}\n'''\n\n"
-            f"ORIGINAL DOCUMENT:\n'''\n{session_memory['original_document_for_iteration']}\n'''\n\n"
-            f"NEW SYNTHESIZED VERSION (full text after attempting to address the problem and integrate new ideas):\n'''\n{final_synthesized_version}\n'''\n\n" 
-            f"EVALUATION TASK: Compare the ORIGINAL DOCUMENT with the NEW SYNTHESIZED VERSION.\n"
-            f"Answer this question: Is the 'NEW SYNTHESIZED VERSION', about the same or a better research paper than the ORIGINAL DOCUMENT? \n"
-            f"If the NEW version is about the same or better, respond 'Yes'.\n"
-            f"If the NEW version is worse or has introduced significant issues (i.e., it has DEGRADED), respond 'No'.\n"
-
-            f"Respond ONLY with one word, 'Yes' (same or better) or 'No' (degraded)."
-        )
-        print(f"\n{'='*5} EVALUATION STEP!!! Asking LLM: Evaluate synthesized version (Yes/No). {'='*5}")
-        response_evaluate = ask_llm(prompt_evaluate, session_memory, temperature=TEMPERATURE_GENERAL)
+            if finish_iteration(session_memory, "synthesis_failed", document_content): break
+            time.sleep(ITERATION_PAUSE_SECONDS); continue 
 
-        if "Error:" in response_evaluate: logging.error(f"LLM Error evaluating: {response_evaluate}"); continue
+        # Screen this final_synthesized_version locally before paying for an LLM evaluation
+        screen_reasons = screen_candidate(run, session_memory['original_document_for_iteration'], final_synthesized_version)
+        if screen_reasons:
+            logging.info(f"Pre-screening rejected the synthesized version without an LLM evaluation: {'; '.join(screen_reasons)}.")
+            print(f"Pre-screening rejected the synthesized version: {'; '.join(screen_reasons)}.")
+            candidate_accepted = False
+        else:
+            # Evaluate this final_synthesized_version. The original is already the CURRENT DOCUMENT prefix, so only
+            # the changed sections are sent where possible instead of a second full copy of the paper.
+            changes_text = compact_section_diff(session_memory['original_document_for_iteration'], final_synthesized_version)
+            if changes_text is not None:
+                new_version_block = f"CHANGES IN THE NEW SYNTHESIZED VERSION (sections not listed are identical to the CURRENT DOCUMENT):\n{changes_text}\n\n"
+            else:
+                new_version_block = f"NEW SYNTHESIZED VERSION (full text after attempting to address the problem and integrate new ideas):\n'''\n{final_synthesized_version}\n'''\n\n"
+            prompt_evaluate = (
+                f"IDENTIFIED PROBLEM:\n'''\n{session_memory.get('identified_problem','N/A')}\n'''\n\n"
+                f"{new_version_block}"
+                f"EVALUATION TASK: Compare the CURRENT DOCUMENT (the original) with the NEW SYNTHESIZED VERSION.\n"
+                f"Answer this question: Is the 'NEW SYNTHESIZED VERSION', about the same or a better research paper than the CURRENT DOCUMENT? \n"
+                f"If the NEW version is about the same or better, answer same_or_better true.\n"
+                f"If the NEW version is worse or has introduced significant issues (i.e., it has DEGRADED), answer same_or_better false."
+            )
+            print(f"\n{'='*5} EVALUATION STEP!!! Asking LLM: Evaluate synthesized version (same or better?). {'='*5}")
+            if run['speculative_execution'] and current_iter_num_for_log < run['max_iterations']:
+                # If the candidate is accepted, the next iteration's 1a on it is already under way.
+                next_iteration_memory = {**session_memory, 'resumed_steps': {}, 'current_iteration': current_iter_num_for_log + 1}
+                pending_critique = start_speculation(next_iteration_memory, "next iteration's step 1a on the candidate", ask_llm_on_context_view,
+                                                     prompt1a_procon, final_synthesized_version, output=PROS_CONS_OUTPUT, temperature=run['temperature_general'], step="1a")
+                pending_critique["document"] = final_synthesized_version
+            try:
+                candidate_accepted = ask_llm_structured(prompt_evaluate, session_memory, EVALUATION_OUTPUT, temperature=run['temperature_general'], step="evaluate",
+                                                        document=session_memory['original_document_for_iteration'])
+            except LLMError as e:
+                logging.error(f"LLM Error evaluating: {e}")
+                discard_speculation(run, pending_critique); pending_critique = None
+                if finish_iteration(session_memory, "evaluation_failed", document_content): break
+                time.sleep(ITERATION_PAUSE_SECONDS); continue
+            if not candidate_accepted:
+                discard_speculation(run, pending_critique); pending_critique = None
 
-        if response_evaluate.strip().lower() == "yes":
+        if candidate_accepted:
             logging.info("LLM confirms synthesized version is an improvement. Updating document.")
             print("LLM: Synthesized version IS an improvement. Updating.")
-            version_number += 1
-            if backup_document(DOCUMENT_FILE_PATH, version_number):
+            accepted_by = {"step": "evaluate", "iteration": current_iter_num_for_log, "approach": session_memory['approach']}
+            if backup_document(run, final_synthesized_version, version_number + 1, accepted_by, base_document=session_memory['original_document_for_iteration']):
+                version_number += 1
                 document_content = final_synthesized_version 
-                if not save_document(DOCUMENT_FILE_PATH, document_content):
+                if not save_document(run['document_path'], document_content):
                     logging.error("Failed to save synthesized document! Next iteration might use old content.")
             else:
                 logging.warning("Failed to backup document. Not overwriting. Continuing with content from start of this iteration.")
@@ -508,26 +2318,165 @@ def main_improvement_loop():
             logging.info("LLM deems synthesized version not an improvement. Reverting to document state from start of this iteration.")
             print("LLM: Synthesized version IS NOT an improvement. Reverting for this iteration.")
             document_content = session_memory['original_document_for_iteration'] 
-            save_document(DOCUMENT_FILE_PATH, document_content) 
+            save_document(run['document_path'], document_content) 
 
-        time.sleep(1) 
+        iteration_outcome = "accepted" if document_content != session_memory['original_document_for_iteration'] else "reverted"
+        if finish_iteration(session_memory, iteration_outcome, document_content): break
+        time.sleep(ITERATION_PAUSE_SECONDS) 
     
     # Check if loop finished due to max iterations
-    if 'current_iter_num_for_log' in locals() and current_iter_num_for_log == MAX_ITERATIONS : 
-        logging.info(f"Reached maximum iterations ({MAX_ITERATIONS}). Stopping.")
-        print(f"Reached maximum iterations ({MAX_ITERATIONS}). Final document saved as '{DOCUMENT_FILE_PATH}'.")
+    if 'current_iter_num_for_log' in locals() and current_iter_num_for_log == run['max_iterations'] : 
+        logging.info(f"Reached maximum iterations ({run['max_iterations']}). Stopping.")
+        print(f"Reached maximum iterations ({run['max_iterations']}). Final document saved as '{run['document_path']}'.")
 
-    save_document(DOCUMENT_FILE_PATH, document_content) 
+    discard_speculation(run, pending_critique)
+    finish_speculations(run)
+    save_document(run['document_path'], document_content) 
+    logging.info(prompt_cache_summary())
+    logging.info(ollama_hosts_summary())
+    print(prompt_cache_summary())
+    write_telemetry_report(run)
+    if run['speculative_execution']:
+        logging.info(speculation_summary(run)); print(speculation_summary(run))
     logging.info(f"--- Simple Document Improver Session Ended: {datetime.datetime.now()} ---")
     print(f"--- Simple Document Improver Session Ended: {datetime.datetime.now()} ---")
 
 
-if __name__ == "__main__":
+# --- Batch Mode ---
+# Several documents, each from its own simple_config-style file, are improved at the same time against one Ollama
+# server: one pipeline thread per document, all sharing the LLM slots, which are handed out round-robin across the
+# documents (see llm_slot). Whenever one document is parsing, saving or waiting on a sequential step, the others keep
+# the server busy. Each document works in BATCH_RUNS_DIR/<name>/ with its own document, logs, backups and journal.
+def batch_document_name(config_path):
+    # "Examples/simple_config - PTSD treatment.json" -> "PTSD treatment"
+    config_stem = os.path.splitext(os.path.basename(config_path))[0]
+    return re.sub(r"^simple_config\s*-?\s*", "", config_stem) or config_stem
+
+def prepare_batch_run(config_path):
+    with open(config_path, "r", encoding="utf-8") as f:
+        doc_config = json.load(f)
+    name = batch_document_name(config_path)
+    run = build_document_run(doc_config, os.path.join(BATCH_RUNS_DIR, name), name)
+    if not os.path.exists(run["document_path"]):
+        # First run: start from the document that sits next to the config ("project_document - PTSD treatment.txt"), if any.
+        document_stem, document_ext = os.path.splitext(os.path.basename(run["document_path"]))
+        seed_path = os.path.join(os.path.dirname(config_path), f"{document_stem} - {name}{document_ext}")
+        if os.path.exists(seed_path):
+            shutil.copy2(seed_path, run["document_path"])
+            logging.info(f"Batch: seeded '{run['document_path']}' from '{seed_path}'.")
+    return run
+
+def attach_document_log(run):
+    # Gives the document its own simple_improver.log with the records of its pipeline thread and its ask_llm_batch workers.
+    document_log_handler = RotatingFileHandler(os.path.join(run["log_dir"], "simple_improver.log"), maxBytes=10*1024*1024, backupCount=5, encoding='utf-8', delay=True)
+    document_log_handler.setFormatter(app_log_formatter)
+    document_log_handler.addFilter(lambda record: record.threadName == run["name"] or record.threadName.startswith(run["name"] + "-llm"))
+    logger.addHandler(document_log_handler)
+    return document_log_handler
+
+def run_batch(config_paths):
     try:
-        os.makedirs("logs", exist_ok=True)
-        with open(os.path.join("logs", "convo_simple.txt"), "w", encoding="utf-8") as f_conv: 
-            f_conv.write(f"--- Simple Improver Convo Log Started: {datetime.datetime.now()} ---\n")
+        runs = [prepare_batch_run(config_path) for config_path in config_paths]
     except Exception as e:
-        print(f"ERROR: Failed to initialize convo_simple.txt: {e}")
+        print(f"Could not load batch configs: {e}"); logging.critical(f"Could not load batch configs: {e}"); return
+    duplicate_names = {run["name"] for run in runs if [other["name"] for other in runs].count(run["name"]) > 1}
+    if duplicate_names:
+        print(f"Batch configs must have distinct names; duplicated: {', '.join(sorted(duplicate_names))}"); return
+    console_handler.setFormatter(logging.Formatter("[%(levelname)s] [%(threadName)s] %(message)s"))
+    first_windows = [(run["llm_model"], first_context_window(run)) for run in runs]
+    for model in sorted({run["llm_model"] for run in runs}):
+        warm_up_model(model, max(num_ctx for window_model, num_ctx in first_windows if window_model == model)) # Loads while the documents and backups are read
+    logging.info(f"Batch: improving {len(runs)} documents ({', '.join(run['name'] for run in runs)}) with {llm_slot_count()} LLM slot(s) on {len(ollama_hosts)} Ollama host(s).")
+    pipelines = []
+    for run in runs:
+        start_convo_log(run)
+        pipeline_thread = threading.Thread(target=main_improvement_loop, args=(run,), name=run["name"])
+        pipelines.append((pipeline_thread, attach_document_log(run)))
+        pipeline_thread.start()
+    for pipeline_thread, document_log_handler in pipelines:
+        pipeline_thread.join()
+        logger.removeHandler(document_log_handler)
+        document_log_handler.close()
+    logging.info(prompt_cache_summary())
+    batch_report_text, _ = telemetry_report()
+    logging.info(batch_report_text)
+    print(batch_report_text)
+    print(f"--- Batch finished: {len(runs)} documents. Results are in '{BATCH_RUNS_DIR}'. ---")
+
+
+# --- Library API ---
+#   import simple_document_improver as sdi
+#   improver = sdi.Improver({"ollama_num_parallel": 2})
+#   run = improver.improve({"document_path": "paper.txt", "document_title": "...", "max_iterations_simple": 5})
+# The Ollama hosts, LLM slots, response cache and logs are shared by the whole process, so the settings of the most
+# recently created Improver are the ones in effect. Logging is left to the caller (setup_logging() gives the CLI's).
+class Improver:
+    def __init__(self, config=None):
+        self.config = dict(config or {})
+        configure(self.config)
+
+    def document_run(self, doc_config=None, work_dir=".", name=None):
+        # Without doc_config the document settings come from the Improver's own config, as with simple_config.json.
+        return build_document_run(self.config if doc_config is None else doc_config, work_dir, name)
 
-    main_improvement_loop()
\ No newline at end of file
+    def improve(self, doc_config=None, work_dir=".", name=None):
+        # Runs the improvement loop on one document and returns its run (document_path, backups, logs, stats).
+        run = self.document_run(doc_config, work_dir, name)
+        start_telemetry_server()
+        warm_up_model(run["llm_model"], first_context_window(run)) # Loads while the document and backups are read
+        start_convo_log(run)
+        main_improvement_loop(run)
+        close_convo_log()
+        return run
+
+    def improve_batch(self, config_paths):
+        start_telemetry_server()
+        run_batch(config_paths)
+        close_convo_log()
+
+    def export_version(self, version, output_path=None, doc_config=None):
+        # Writes version N of the document from the backup store to a file. Returns the path, or None if it failed.
+        run = self.document_run(doc_config)
+        run["backup_index"] = load_backup_index(run)
+        exported_content = reconstruct_version(run, version)
+        if exported_content is None:
+            logging.error(f"Version {version} could not be rebuilt from '{run['backup_index_path']}'.")
+            return None
+        document_stem, document_ext = os.path.splitext(os.path.basename(run["document_path"]))
+        export_path = output_path or f"{document_stem}_v{version}{document_ext or '.txt'}"
+        return export_path if save_document(export_path, exported_content) else None
+
+configure({}) # Defaults until an Improver applies its config
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Iteratively improve a research paper with a local Ollama model.")
+    parser.add_argument("--config", default=CONFIG_PATH, help=f"Settings file (default: {CONFIG_PATH}).")
+    parser.add_argument("--batch", nargs="+", metavar="CONFIG",
+                        help="Improve several documents at once, one simple_config-style JSON file each (e.g. Examples/simple_config*.json).")
+    parser.add_argument("--export-version", type=int, metavar="N", help="Write version N of the document from the backup store to a file, then exit.")
+    parser.add_argument("--output", metavar="PATH", help="File for --export-version (default: <document>_v<N>.txt in the current directory).")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    improver = Improver(load_config(args.config))
+    if args.export_version is not None:
+        export_path = improver.export_version(args.export_version, args.output)
+        if export_path is None:
+            raise SystemExit(f"Version {args.export_version} could not be exported.")
+        print(f"Version {args.export_version} written to '{export_path}'.")
+        return
+    project_root_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Project Root Directory: {project_root_dir}")
+    print("For a fresh run, you may want to delete old files/folders from:")
+    print(f"  - {os.path.join(project_root_dir, 'logs')}")
+    print(f"  - {os.path.join(project_root_dir, 'document_backups')}")
+    print(f"  - and reset/edit {os.path.join(project_root_dir, improver.config.get('document_path', 'project_document.txt'))}\n\n")
+    if args.batch:
+        improver.improve_batch(args.batch)
+    else:
+        improver.improve()
+
+
+if __name__ == "__main__":
+    main()
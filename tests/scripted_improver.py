@@ -0,0 +1,79 @@
+# A scripted stand-in for the Ollama server and a harness that runs the whole improvement loop against it in a
+# temporary work directory. Used by the tests that need a full run (test_replay, test_main_loop).
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+CONS = ["The paper lacks a worked example.", "The evaluation plan is missing.", "Related work is thin."]
+PAPER = ("Abstract:\n" + "A small agent that brainstorms, judges and rewrites its own ideas. " * 8 + "\n\n"
+         "Method:\n" + "The loop critiques the paper, picks one weakness and revises the text around it. " * 8 + "\n")
+
+class ScriptedOllamaClient:
+    # Stands in for ollama.Client: the same Cons every iteration, so the con memory keeps seeing repeats, and
+    # one-hot embeddings per Con, so a repeated Con has similarity 1.0 and different Cons almost 0.
+    def __init__(self):
+        self.rewrites = 0
+
+    def list(self):
+        return {"models": [{"model": "scripted"}]}
+
+    def embed(self, model=None, input="", **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        return {"embeddings": [[float(text == con) for con in CONS] + [0.1] for text in texts]}
+
+    def answer(self, prompt, response_format):
+        if isinstance(response_format, dict):
+            properties = response_format["properties"]
+            if "pros" in properties: return json.dumps({"pros": ["The goal is clear."], "cons": CONS})
+            if "con_number" in properties:
+                already_tried = prompt.split("ALREADY TRIED", 1)[1] if "ALREADY TRIED" in prompt else ""
+                return json.dumps({"con_number": next((index + 1 for index, con in enumerate(CONS) if con not in already_tried), 1)})
+            if "approach" in properties: return json.dumps({"approach": "Direct Fix"})
+            if "same_or_better" in properties: return json.dumps({"same_or_better": True})
+            if "better_version" in properties: return json.dumps({"better_version": "A"})
+            return json.dumps({"combinations": [f"Combination {index}." for index in range(sdi.COMBINATIONS_PER_LOT)]})
+        if "EXISTING SECTION HEADINGS:" in prompt:
+            self.rewrites += 1
+            return (f"@@@ INSERT AFTER: Method:\nRevision {self.rewrites}:\n"
+                    + f"Revision {self.rewrites} adds a worked example, an evaluation plan and more related work. " * 4 + "\n@@@ END")
+        return "Some notes on the chosen problem."
+
+    def generate(self, model=None, prompt="", system=None, options=None, stream=False, format=None, **kwargs):
+        text = self.answer(prompt, format)
+        final_chunk = {"response": "", "done": True, "prompt_eval_count": len(prompt) // 4, "eval_count": len(text) // 4 + 1, "eval_duration": 10**8}
+        if not stream: return {**final_chunk, "response": text}
+        return iter([{"response": text, "done": False}, final_chunk])
+
+class ScriptedRunTestCase(unittest.TestCase):
+    # Each test gets a temporary base directory; improve() runs the loop on a fresh copy of PAPER in a work directory in it.
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.addCleanup(self.reset_improver)
+
+    def reset_improver(self):
+        if sdi.llm_cache_db is not None: sdi.llm_cache_db.close()
+        sdi.llm_cache_db = None
+        sdi.replay_cursors.clear()
+        sdi.configure({})
+
+    def improve(self, work_name, process_config, doc_config, client=None):
+        # Returns (final document, run).
+        self.reset_improver()
+        work_dir = os.path.join(self.base_dir, work_name)
+        os.makedirs(work_dir)
+        with open(os.path.join(work_dir, "paper.txt"), "w", encoding="utf-8") as f_paper:
+            f_paper.write(PAPER)
+        improver = sdi.Improver({"iteration_pause_seconds": 0, "llm_cache_path": os.path.join(work_dir, "cache.sqlite3"), **process_config})
+        sdi.ollama_hosts[:] = [sdi.new_ollama_host("scripted", client or ScriptedOllamaClient())]
+        run = improver.improve({"document_path": "paper.txt", "document_title": "Scripted paper", "gen_model": "scripted",
+                                "max_iterations_simple": 5, "convergence_action": "off", **doc_config}, work_dir=work_dir)
+        with open(run["document_path"], "r", encoding="utf-8") as f_paper:
+            return f_paper.read(), run
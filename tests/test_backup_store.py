@@ -0,0 +1,74 @@
+# Storing accepted versions as full copies and line deltas, and rebuilding them from the backup store.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+def paper_version(version_number):
+    # Each version rewrites one paragraph and adds another, so consecutive versions differ by a few lines.
+    paragraphs = [f"Paragraph {index} of the stub paper." for index in range(12)]
+    paragraphs[version_number % 12] = f"Paragraph {version_number % 12}, rewritten in version {version_number}."
+    paragraphs += [f"Added in version {added}." for added in range(1, version_number + 1)]
+    return "TITLE: Stub\n\n" + "\n\n".join(paragraphs) + "\n"
+
+class BackupStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.backup_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.backup_dir)
+        self.run_state = self.new_run()
+
+    def new_run(self):
+        versions_dir = os.path.join(self.backup_dir, "paper_versions")
+        return {"document_path": os.path.join(self.backup_dir, "paper.txt"), "backup_dir": self.backup_dir,
+                "backup_objects_dir": versions_dir, "backup_index_path": os.path.join(versions_dir, "index.jsonl"),
+                "backup_full_snapshot_every": 4}
+
+    def store_versions(self, count):
+        self.assertEqual(sdi.open_backup_store(self.run_state, paper_version(0)), 0)
+        for version_number in range(1, count):
+            self.assertTrue(sdi.backup_document(self.run_state, paper_version(version_number), version_number,
+                                                {"step": "A"}, base_document=paper_version(version_number - 1)))
+
+    def test_every_version_rebuilds_exactly(self):
+        self.store_versions(10)
+        for version_number in range(10):
+            self.assertEqual(sdi.reconstruct_version(self.run_state, version_number), paper_version(version_number))
+
+    def test_deltas_are_capped_by_full_snapshots(self):
+        self.store_versions(10)
+        chains = [record["chain"] for record in self.run_state["backup_index"]]
+        self.assertEqual(chains, [0, 1, 2, 3, 0, 1, 2, 3, 0, 1])
+        self.assertTrue(self.run_state["backup_index"][1]["object"].endswith(".delta.z"))
+
+    def test_missing_base_document_stores_a_full_copy(self):
+        self.store_versions(2)
+        sdi.backup_document(self.run_state, paper_version(2), 2, {"step": "A"})
+        self.assertEqual(self.run_state["backup_index"][-1]["chain"], 0)
+        self.assertEqual(sdi.reconstruct_version(self.run_state, 2), paper_version(2))
+
+    def test_reopening_reads_the_index_and_records_external_edits(self):
+        self.store_versions(3)
+        reopened_run = self.new_run()
+        self.assertEqual(sdi.open_backup_store(reopened_run, paper_version(2)), 2)
+        self.assertEqual(len(reopened_run["backup_index"]), 3)
+        self.assertEqual(sdi.open_backup_store(reopened_run, "Edited by hand.\n"), 3)
+        self.assertEqual(reopened_run["backup_index"][-1]["step"], "external edit")
+        self.assertEqual(sdi.reconstruct_version(reopened_run, 1), paper_version(1))
+
+    def test_corrupted_object_fails_the_hash_check(self):
+        self.store_versions(2)
+        delta_record = self.run_state["backup_index"][1]
+        sdi.write_backup_object(self.run_state, "tampered", sdi.encode_line_delta(paper_version(0), paper_version(3)))
+        os.replace(os.path.join(self.run_state["backup_objects_dir"], "tampered"),
+                   os.path.join(self.run_state["backup_objects_dir"], delta_record["object"]))
+        self.assertIsNone(sdi.reconstruct_version(self.run_state, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Sizing num_ctx from the prompt estimate and deciding from the server's counts when a prompt was truncated.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+class CountingClient:
+    # Answers every call with a fixed patch and reports the prompt as prompt_eval_count tokens.
+    def __init__(self, prompt_eval_count):
+        self.prompt_eval_count, self.calls = prompt_eval_count, 0
+
+    def generate(self, stream=False, **kwargs):
+        self.calls += 1
+        final_chunk = {"response": "", "done": True, "prompt_eval_count": self.prompt_eval_count, "eval_count": 10, "eval_duration": 10**8}
+        return iter([{"response": "@@@ REPLACE: Abstract:\nAbstract:\nBetter.\n@@@ END", "done": False}, final_chunk])
+
+class ContextWindowTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        self.addCleanup(sdi.close_convo_log) # Before the directory goes
+        self.addCleanup(sdi.configure, {})
+        sdi.configure({"llm_cache_mode": "off"})
+        self.forget_measurements()
+        self.addCleanup(self.forget_measurements)
+        run = sdi.build_document_run({"gen_model": "ctx-test", "number_ctx_min": 2048, "number_ctx_simple": 4096}, work_dir=work_dir)
+        self.session_memory = {"run": run}
+        self.document = "Abstract:\n" + "word " * 3000 # ~5000 tokens by the 3.0 chars/token estimate, ~3750 at 4.0
+
+    def forget_measurements(self):
+        sdi.context_windows.clear()
+        with sdi.prompt_cache_stats_lock: sdi.prompt_cache_stats["observed_chars_per_token"] = None
+
+    def ask_rewrite(self, client):
+        sdi.ollama_hosts[:] = [sdi.new_ollama_host("counting", client)]
+        return sdi.ask_llm("Rewrite the paper.", self.session_memory, step="synthesis", document=self.document)
+
+    def test_window_only_grows_and_stays_within_the_maximum(self):
+        run = self.session_memory["run"]
+        self.assertEqual(sdi.grow_context_window(run, 100), 2048)
+        self.assertEqual(sdi.grow_context_window(run, 3000), 4096)
+        self.assertEqual(sdi.grow_context_window(run, 100), 4096)
+        self.assertEqual(sdi.grow_context_window(run, 50000), 4096)
+
+    def test_estimate_above_the_window_is_not_truncation_by_itself(self):
+        client = CountingClient(prompt_eval_count=3800)
+        self.assertIn("@@@ REPLACE", self.ask_rewrite(client))
+        self.assertEqual(client.calls, 1)
+        self.assertNotIn('context_truncations', self.session_memory)
+
+    def test_server_count_filling_the_window_rejects_the_rewrite(self):
+        with self.assertRaises(sdi.LLMError):
+            self.ask_rewrite(CountingClient(prompt_eval_count=4096))
+        self.assertEqual(self.session_memory['context_truncations'][0]["prompt_eval_count"], 4096)
+
+    def test_rewrite_that_cannot_fit_at_the_measured_ratio_is_not_sent(self):
+        with sdi.prompt_cache_stats_lock: sdi.prompt_cache_stats["observed_chars_per_token"] = 3.5
+        client = CountingClient(prompt_eval_count=4096)
+        with self.assertRaises(sdi.LLMError):
+            self.ask_rewrite(client)
+        self.assertEqual(client.calls, 0)
+        self.assertIsNone(self.session_memory['context_truncations'][0]["prompt_eval_count"])
+
+if __name__ == "__main__":
+    unittest.main()
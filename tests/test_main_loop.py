@@ -0,0 +1,47 @@
+# How the improvement loop ends iterations whose LLM steps fail.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scripted_improver import PAPER, ScriptedOllamaClient, ScriptedRunTestCase
+
+class FailingStepClient(ScriptedOllamaClient):
+    # Answers one structured step with JSON its parser rejects every time, so that step fails after its re-asks.
+    def __init__(self, failing_field):
+        super().__init__()
+        self.failing_field = failing_field
+
+    def answer(self, prompt, response_format):
+        if isinstance(response_format, dict) and self.failing_field in response_format["properties"]:
+            return json.dumps({self.failing_field: "unclear"})
+        return super().answer(prompt, response_format)
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f_jsonl:
+        return [json.loads(line) for line in f_jsonl]
+
+class FailedIterationTest(ScriptedRunTestCase):
+    def improve_with_failing(self, failing_field, outcome):
+        document, run = self.improve(failing_field, {}, {"convergence_action": "stop", "convergence_window": 2},
+                                     client=FailingStepClient(failing_field))
+        self.assertEqual(document, PAPER)
+        last_journal_record = read_jsonl(run["journal_path"])[-1]
+        self.assertEqual((last_journal_record["type"], last_journal_record["outcome"]), ("iteration_end", outcome))
+        self.assertEqual([record["outcome"] for record in read_jsonl(run["con_memory_path"])], [outcome, outcome])
+        # Two failed iterations fill the convergence window, so the run stops there instead of using all five.
+        self.assertEqual([entry["outcome"] for entry in run["convergence"]["history"]], [outcome, outcome])
+
+    def test_failed_approach_step_closes_the_iteration(self):
+        self.improve_with_failing("approach", "approach_failed")
+
+    def test_failed_evaluation_closes_the_iteration(self):
+        self.improve_with_failing("same_or_better", "evaluation_failed")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+# Routing and failover over a pool of Ollama hosts, against stub servers built on http.server.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # Answers /api/generate the way its server's "mode" says, and /api/tags (the health check) unless the mode is "down".
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.mode == "down": return self.send_json(500, {"error": "server is down"})
+        self.send_json(200, {"models": [{"model": "stub"}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.generate_calls += 1
+        mode = self.server.mode
+        if mode == "hang": time.sleep(5); return
+        if mode in ("error", "down"): return self.send_json(500, {"error": "model runner crashed"})
+        if mode == "missing": return self.send_json(404, {"error": "model 'stub' not found"})
+        if mode == "bad": return self.send_json(400, {"error": "invalid options"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for piece in ("answer from ", self.server.name):
+            self.wfile.write((json.dumps({"model": "stub", "response": piece, "done": False}) + "\n").encode("utf-8"))
+        self.wfile.write((json.dumps({"model": "stub", "response": "", "done": True, "prompt_eval_count": 20,
+                                      "eval_count": 4, "eval_duration": 10**8}) + "\n").encode("utf-8"))
+
+def start_stub_server(name, mode="ok"):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    server.daemon_threads = True
+    server.name, server.mode, server.generate_calls = name, mode, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def server_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def unused_port_url():
+    with socket.socket() as probe_socket:
+        probe_socket.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{probe_socket.getsockname()[1]}"
+
+class OllamaHostPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server_a, self.server_b = start_stub_server("A"), start_stub_server("B")
+        self.use_hosts([server_url(self.server_a), server_url(self.server_b)])
+
+    def tearDown(self):
+        for server in (self.server_a, self.server_b):
+            server.shutdown(); server.server_close()
+        sdi.configure({})
+
+    def use_hosts(self, host_urls):
+        sdi.configure({"ollama_hosts": host_urls, "ollama_host_retry_seconds": 0.2, "ollama_host_timeout_seconds": 1})
+
+    def generate(self, document_name="paper"):
+        run = {"name": document_name, "llm_model": "stub", "system_prompt": "You are a co-author.", "document_title": "Stub paper"}
+        text, abort_reason, final_chunk = sdi.generate_on_ollama_hosts(run, "TASK / QUESTION:\nSay something.", {"num_ctx": 2048})
+        self.assertIsNone(abort_reason)
+        return text
+
+    def host(self, server):
+        with sdi.ollama_hosts_lock:
+            return next(host for host in sdi.ensure_ollama_hosts() if host["name"] == server_url(server))
+
+    def test_fails_over_from_a_server_error(self):
+        self.server_a.mode = "error"
+        self.assertEqual(self.generate(), "answer from B")
+        self.assertFalse(self.host(self.server_a)["healthy"])
+        self.assertTrue(self.host(self.server_b)["healthy"])
+
+    def test_fails_over_from_an_unreachable_host(self):
+        self.use_hosts([unused_port_url(), server_url(self.server_b)])
+        self.assertEqual(self.generate(), "answer from B")
+
+    def test_fails_over_from_a_hanging_host(self):
+        self.server_a.mode = "hang"
+        started_at = time.monotonic()
+        self.assertEqual(self.generate(), "answer from B")
+        self.assertLess(time.monotonic() - started_at, 4)
+        self.assertFalse(self.host(self.server_a)["healthy"])
+
+    def test_bad_request_is_not_a_host_failure(self):
+        self.server_a.mode = "bad"
+        with self.assertRaises(ollama.ResponseError):
+            self.generate()
+        self.assertEqual(self.server_b.generate_calls, 0)
+        self.assertTrue(self.host(self.server_a)["healthy"])
+
+    def test_missing_model_moves_on_without_marking_the_host_down(self):
+        self.server_a.mode = "missing"
+        self.assertEqual(self.generate(), "answer from B")
+        self.assertTrue(self.host(self.server_a)["healthy"])
+
+    def test_missing_model_on_every_host_raises_the_404(self):
+        self.server_a.mode = self.server_b.mode = "missing"
+        with self.assertRaises(ollama.ResponseError) as raised:
+            self.generate()
+        self.assertEqual(raised.exception.status_code, 404)
+
+    def test_failed_host_rejoins_after_passing_a_health_check(self):
+        self.server_a.mode = "down"
+        self.assertEqual(self.generate("first paper"), "answer from B")
+        self.assertEqual(self.generate("second paper"), "answer from B") # No live calls while A is out of rotation
+        self.assertEqual(self.server_a.generate_calls, 1)
+        self.server_a.mode = "ok"
+        deadline = time.monotonic() + 3
+        while not self.host(self.server_a)["healthy"] and time.monotonic() < deadline: time.sleep(0.05)
+        self.assertTrue(self.host(self.server_a)["healthy"])
+        self.assertEqual(self.generate("third paper"), "answer from A")
+
+    def test_document_sticks_to_the_host_that_served_it(self):
+        self.server_a.mode = "error"
+        self.assertEqual(self.generate(), "answer from B")
+        host_a = self.host(self.server_a)
+        with sdi.ollama_hosts_lock: host_a["healthy"] = True # As if it had passed its health check
+        self.server_a.mode = "ok"
+        self.assertEqual(self.generate(), "answer from B") # B holds this paper's prompt prefix
+        self.assertEqual(self.generate("another paper"), "answer from A")
+
+    def test_new_document_goes_to_the_faster_host(self):
+        host_a, host_b = self.host(self.server_a), self.host(self.server_b)
+        host_a["tokens_per_second"], host_b["tokens_per_second"] = 10.0, 100.0
+        self.assertEqual(self.generate(), "answer from B")
+        self.assertGreater(host_b["tokens_per_second"], 0)
+
+    def test_slots_shrink_while_a_host_is_out_of_rotation(self):
+        self.assertEqual(sdi.llm_slot_count(), 2)
+        self.server_a.mode = "down"
+        self.assertEqual(self.generate(), "answer from B")
+        self.assertEqual(sdi.llm_slot_count(), 1)
+        second_admitted = threading.Event()
+        def take_second_slot():
+            with sdi.llm_slot("second paper"): second_admitted.set()
+        with sdi.llm_slot("first paper"):
+            threading.Thread(target=take_second_slot, daemon=True).start()
+            self.assertFalse(second_admitted.wait(0.5)) # B alone can only serve one call at a time
+            self.server_a.mode = "ok"
+            self.assertTrue(second_admitted.wait(3)) # A passed its health check and brought its slot back
+        self.assertEqual(sdi.llm_slot_count(), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+# Recording a session with con memory on and replaying it from the convo log with no Ollama server.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import convo_log_reader
+from scripted_improver import ScriptedRunTestCase
+
+class ReplayTest(ScriptedRunTestCase):
+    def test_replay_follows_the_recorded_con_memory_decisions(self):
+        recorded_document, recorded_run = self.improve("record", {"llm_cache_mode": "readwrite"}, {})
+        recorded_steps = [record.get("step") for record in convo_log_reader.iter_convo_records(recorded_run["convo_log_dir"])]
+        self.assertGreaterEqual(recorded_steps.count("1b-2"), 2) # Con memory sent the run down the already-tried path
+
+        replayed_document, replayed_run = self.improve("replay", {"llm_cache_mode": "replay"}, {"llm_replay_log": recorded_run["convo_log_dir"]})
+        self.assertEqual(replayed_document, recorded_document)
+        self.assertEqual(len(replayed_run["backup_index"]), len(recorded_run["backup_index"]))
+        replayed_steps = [record.get("step") for record in convo_log_reader.iter_convo_records(replayed_run["convo_log_dir"])]
+        self.assertEqual(replayed_steps, recorded_steps)
+
+if __name__ == "__main__":
+    unittest.main()
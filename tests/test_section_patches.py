@@ -0,0 +1,74 @@
+# Splitting a paper into sections and splicing "patch" mode answers back into it.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+PAPER = (
+    "TITLE: A Stub Paper\n"
+    "\n"
+    "Abstract:\n"
+    "We study stubs.\n"
+    "\n"
+    "## 1. Method\n"
+    "The steps are as follows:\n"
+    "First, build a stub.\n"
+    "\n"
+    "**Conclusion**\n"
+    "Stubs work.\n"
+)
+
+class SectionSplitTest(unittest.TestCase):
+    def test_sections_join_back_to_the_document(self):
+        sections = sdi.split_document_sections(PAPER)
+        self.assertEqual([section["heading"] for section in sections], ["TITLE: A Stub Paper", "Abstract:", "## 1. Method", "**Conclusion**"])
+        self.assertEqual(sdi.join_document_sections(sections), PAPER)
+
+    def test_text_before_the_first_heading_is_its_own_section(self):
+        sections = sdi.split_document_sections("Preamble line.\n\n" + PAPER)
+        self.assertEqual(sections[0], {"heading": "", "text": "Preamble line.\n\n"})
+
+    def test_heading_styles_share_a_key(self):
+        for heading in ("## 2. Method:", "**Method**", "Method:", "# method"):
+            self.assertEqual(sdi.section_key(heading), "method")
+
+class SectionPatchTest(unittest.TestCase):
+    def test_replace_swaps_only_the_target_section(self):
+        patch = "@@@ REPLACE: ## 1. Method\n## 1. Method\nBuild a better stub.\n@@@ END\n"
+        patched_document, applied_count, problems = sdi.apply_section_patches(PAPER, patch)
+        self.assertEqual((applied_count, problems), (1, []))
+        self.assertEqual(patched_document, PAPER.replace("The steps are as follows:\nFirst, build a stub.\n", "Build a better stub.\n"))
+
+    def test_replace_with_body_only_keeps_the_heading_line(self):
+        patch = "@@@ REPLACE: Method\nBuild a better stub.\n@@@ END"
+        patched_document, applied_count, problems = sdi.apply_section_patches(PAPER, patch)
+        self.assertEqual(applied_count, 1)
+        self.assertIn("## 1. Method\nBuild a better stub.\n\n**Conclusion**", patched_document)
+
+    def test_insert_after_adds_a_new_section(self):
+        patch = "@@@ INSERT AFTER: **Conclusion**\n## Limitations\nStubs are small.\n@@@ END\n"
+        patched_document, applied_count, problems = sdi.apply_section_patches(PAPER, patch)
+        self.assertEqual(applied_count, 1)
+        self.assertTrue(patched_document.endswith("Stubs work.\n\n## Limitations\nStubs are small.\n"))
+        self.assertEqual(sdi.section_headings_list(patched_document).splitlines()[-1], "- ## Limitations")
+
+    def test_unknown_target_is_skipped_and_reported(self):
+        patch = ("@@@ REPLACE: Results\nResults:\nNone.\n@@@ END\n"
+                 "@@@ REPLACE: Abstract:\nAbstract:\nWe study better stubs.\n@@@ END\n")
+        patched_document, applied_count, problems = sdi.apply_section_patches(PAPER, patch)
+        self.assertEqual(applied_count, 1)
+        self.assertEqual(problems, ["REPLACE target 'Results' not found"])
+        self.assertIn("We study better stubs.", patched_document)
+
+    def test_answer_without_usable_blocks_is_rejected(self):
+        self.assertEqual(sdi.apply_section_patches(PAPER, "Here is my rewrite."), (None, 0, ["no patch blocks found"]))
+        run = {"document_edit_mode": "patch"}
+        self.assertEqual(sdi.apply_llm_rewrite(run, PAPER, "@@@ REPLACE: Results\nNone.\n@@@ END")[0], None)
+
+if __name__ == "__main__":
+    unittest.main()
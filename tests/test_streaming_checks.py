@@ -0,0 +1,49 @@
+# Cutting off runaway generations while they stream in, without losing structured answers that are already complete.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simple_document_improver as sdi
+
+RUN = {"llm_model": "stub", "system_prompt": "You are a co-author.", "document_title": "Stub paper"}
+
+class StreamingClient:
+    # Streams the given text in 8-character chunks, then the final chunk with the server's counters.
+    def __init__(self, text):
+        self.text = text
+
+    def generate(self, stream=False, **kwargs):
+        final_chunk = {"response": "", "done": True, "prompt_eval_count": 20, "eval_count": len(self.text) // 4}
+        return iter([{"response": self.text[start:start + 8], "done": False} for start in range(0, len(self.text), 8)] + [final_chunk])
+
+class StreamingCheckTest(unittest.TestCase):
+    def setUp(self):
+        sdi.configure({})
+
+    def generate(self, text, response_format=None):
+        return sdi.generate_llm_response(StreamingClient(text), RUN, "TASK / QUESTION:\nAnswer.", {"num_ctx": 2048}, response_format=response_format)
+
+    def test_answer_reads_through_to_the_final_chunk(self):
+        text, abort_reason, final_chunk = self.generate('{"same_or_better": true}', response_format={"type": "object"})
+        self.assertEqual((text, abort_reason, final_chunk.get("eval_count")), ('{"same_or_better": true}', None, 6))
+
+    def test_runaway_prose_is_cut_off(self):
+        text, abort_reason, final_chunk = self.generate("Some notes.\n" + "\n" * 1000)
+        self.assertEqual(abort_reason, "repeated character run")
+        self.assertLess(len(text), 1000)
+
+    def test_complete_structured_answer_survives_trailing_whitespace(self):
+        text, abort_reason, final_chunk = self.generate('{"con_number": 2}' + "\n" * 1000, response_format={"type": "object"})
+        self.assertIsNone(abort_reason)
+        self.assertEqual(sdi.parse_json_answer(text), {"con_number": 2})
+
+    def test_incomplete_structured_answer_is_still_cut_off(self):
+        text, abort_reason, final_chunk = self.generate('{"pros": ["' + "a" * 1000, response_format={"type": "object"})
+        self.assertEqual(abort_reason, "repeated character run")
+
+if __name__ == "__main__":
+    unittest.main()
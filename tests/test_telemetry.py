@@ -0,0 +1,42 @@
+# Per-step LLM telemetry: the latency percentiles and the Prometheus endpoint of the library API.
+#
+#   python -m pytest tests        (or: python -m unittest discover tests)
+
+import os
+import socket
+import sys
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import simple_document_improver as sdi
+from scripted_improver import ScriptedRunTestCase
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        self.assertEqual(sdi.percentile(list(range(1, 11)), 0.5), 5)
+        self.assertEqual(sdi.percentile(list(range(1, 7)), 0.5), 3)
+        self.assertEqual(sdi.percentile([1, 2], 0.5), 1)
+        self.assertEqual(sdi.percentile(list(range(1, 101)), 0.95), 95)
+        self.assertEqual(sdi.percentile([3, 1, 2], 0.0), 1)
+        self.assertIsNone(sdi.percentile([], 0.5))
+
+class PrometheusEndpointTest(ScriptedRunTestCase):
+    def tearDown(self):
+        server = sdi.telemetry_server_state["server"]
+        if server is not None:
+            server.shutdown(); server.server_close()
+        sdi.telemetry_server_state["server"] = None
+
+    def test_improve_serves_metrics_when_a_port_is_configured(self):
+        with socket.socket() as probe_socket:
+            probe_socket.bind(("127.0.0.1", 0))
+            port = probe_socket.getsockname()[1]
+        self.improve("metrics", {"telemetry_prometheus_port": port}, {"max_iterations_simple": 1})
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            metrics = response.read().decode("utf-8")
+        self.assertIn('document="paper"', metrics)
+
+if __name__ == "__main__":
+    unittest.main()